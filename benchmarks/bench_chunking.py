@@ -0,0 +1,77 @@
+"""Chunking throughput on a multi-megabyte mixed Chinese/English corpus.
+
+Usage: python benchmarks/bench_chunking.py [size_mb]
+"""
+import random
+import re
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from file_utils import iter_chunks  # noqa: E402
+
+SENTENCES = [
+    "本研究为多中心、开放标签的I期剂量递增试验。",
+    "受试者需满足ECOG评分0-1分，且预期生存期不少于12周！",
+    "The recommended phase 2 dose will be determined by the SMC.",
+    "Dose-limiting toxicity is assessed during the first 28 days? ",
+    "给药剂量为3.5 mg/kg，每3周一次（Q3W）。",
+    "Patients received 1.0e8 cells per infusion. ",
+]
+
+
+def legacy_chunk_text(text, chunk_size=500, overlap=50):
+    """chunk_text as it was before the streaming chunker."""
+    if len(text) <= chunk_size:
+        return [text.strip()]
+    import re
+    sentences = re.split(r"(?<=[。！？.!?])", text)
+    chunks = []
+    current = ""
+    for sentence in sentences:
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        if len(current) + len(sentence) <= chunk_size:
+            current += sentence
+        else:
+            chunks.append(current)
+            current = (current[-overlap:] if overlap > 0 else "") + sentence
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def build_corpus(size_mb, seed=0):
+    rng = random.Random(seed)
+    segments, total = [], 0
+    while total < size_mb * 1024 * 1024:
+        segment = "".join(rng.choice(SENTENCES) for _ in range(rng.randint(5, 400)))
+        segments.append(segment)
+        total += len(segment.encode("utf-8"))
+    return segments, total
+
+
+def measure(name, run, size_bytes):
+    started = time.perf_counter()
+    chunks = run()
+    elapsed = time.perf_counter() - started
+    print(f"{name:<22} {elapsed:8.3f}s  {size_bytes / elapsed / 1e6:8.2f} MB/s  {chunks:>8} chunks")
+
+
+def main():
+    size_mb = float(sys.argv[1]) if len(sys.argv) > 1 else 8
+    segments, size_bytes = build_corpus(size_mb)
+    print(f"corpus: {len(segments)} segments, {size_bytes / 1e6:.1f} MB")
+    measure("legacy chunk_text", lambda: sum(len(legacy_chunk_text(s)) for s in segments), size_bytes)
+    measure("iter_chunks (chars)", lambda: sum(1 for _ in iter_chunks(segments)), size_bytes)
+    from context_packer import estimate_tokens
+    measure("iter_chunks (tokens)",
+            lambda: sum(1 for _ in iter_chunks(segments, chunk_size=300, overlap=30, length=estimate_tokens)),
+            size_bytes)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Resident bytes per stored chunk: plain chunk dicts versus ChunkRecord.
+
+Both representations are built from the same vector-file JSON, as at startup.
+
+Usage: python benchmarks/bench_memory.py [chunks] [dimension]
+"""
+import gc
+import json
+import sys
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from chunk_records import ChunkRecord  # noqa: E402
+
+CHUNKS_PER_FILE = 50
+
+
+def make_vector_file(chunks: int, dimension: int) -> str:
+    docs = []
+    for i in range(chunks):
+        file_no = i // CHUNKS_PER_FILE
+        docs.append({
+            "id": f"guide{file_no}.pdf_{i}_1700000000.{file_no}",
+            "content": f"第{i}段：受试者入组标准、给药方案与安全性评估说明。" * 4,
+            "content_hash": f"{i:064x}",
+            "embedding": [((i * 31 + j) % 997) / 997 - 0.5 for j in range(dimension)],
+            "knowledge_type": ("指南", "文献", "方案模板")[file_no % 3],
+            "metadata": {
+                "title": f"肿瘤临床指南 第{file_no}版",
+                "source_file": f"guide{file_no}.pdf",
+                "chunk_index": i % CHUNKS_PER_FILE,
+                "upload_time": f"2024-05-{file_no % 28 + 1:02d}T10:00:00",
+                "file_type": ".pdf",
+                "embedding_dimension": dimension,
+                "page": i % CHUNKS_PER_FILE // 3 + 1,
+            },
+        })
+    return json.dumps(docs, ensure_ascii=False)
+
+
+def measure(build, text: str) -> int:
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = build(text)
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del kept
+    return used
+
+
+def main():
+    chunks = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    dimension = int(sys.argv[2]) if len(sys.argv) > 2 else 768
+    text = make_vector_file(chunks, dimension)
+    as_dicts = measure(json.loads, text)
+    as_records = measure(lambda t: [ChunkRecord.of(d) for d in json.loads(t)], text)
+    print(f"{chunks} chunks x {dimension}d")
+    print(f"  dicts:   {as_dicts / chunks:10.0f} bytes/chunk")
+    print(f"  records: {as_records / chunks:10.0f} bytes/chunk ({as_records / as_dicts:.0%})")
+
+
+if __name__ == "__main__":
+    main()
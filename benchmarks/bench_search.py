@@ -0,0 +1,98 @@
+"""Query latency of sharded vector search versus the number of shard processes.
+
+A random normalized float32 matrix is written as an index file and searched
+with 1..N shard processes (N = CPU cores by default); the single-process
+numpy scan is the baseline. Sizes that would not fit in memory are skipped.
+
+Usage: python benchmarks/bench_search.py [sizes] [dimension] [max_shards] [queries]
+       e.g. python benchmarks/bench_search.py 100000,1000000,5000000 1024
+"""
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from sharded_search import _score_shard, merge_top_k  # noqa: E402
+
+TOP_K = 10
+
+
+def available_bytes() -> int:
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_AVPHYS_PAGES")
+
+
+def random_matrix(rows: int, dimension: int) -> np.ndarray:
+    matrix = np.empty((rows, dimension), dtype=np.float32)
+    rng = np.random.default_rng(0)
+    for start in range(0, rows, 100000):
+        block = rng.standard_normal((min(100000, rows - start), dimension), dtype=np.float32)
+        matrix[start:start + len(block)] = block / np.linalg.norm(block, axis=1, keepdims=True)
+    return matrix
+
+
+def latency_ms(search, queries) -> float:
+    search(queries[0])  # warm up: map the index file, fault pages in
+    started = time.perf_counter()
+    for query in queries:
+        search(query)
+    return (time.perf_counter() - started) / len(queries) * 1000
+
+
+def sharded(pool, stem: str, rows: int, dimension: int, shards: int, query: np.ndarray):
+    bounds = np.linspace(0, rows, shards + 1, dtype=int)
+    futures = [pool.submit(_score_shard, stem, rows, dimension, int(start), int(end), query.tobytes(), TOP_K, 0)
+               for start, end in zip(bounds[:-1], bounds[1:])]
+    return merge_top_k((future.result() for future in futures), TOP_K)
+
+
+def baseline(matrix: np.ndarray, query: np.ndarray):
+    scores = matrix @ query
+    best = np.argpartition(-scores, TOP_K - 1)[:TOP_K]
+    return best[np.argsort(-scores[best])]
+
+
+def main():
+    sizes = [int(n) for n in (sys.argv[1] if len(sys.argv) > 1 else "100000,1000000,5000000").split(",")]
+    dimension = int(sys.argv[2]) if len(sys.argv) > 2 else 1024
+    max_shards = int(sys.argv[3]) if len(sys.argv) > 3 else os.cpu_count() or 1
+    query_count = int(sys.argv[4]) if len(sys.argv) > 4 else 20
+    queries = [(q / np.linalg.norm(q)).astype(np.float32)
+               for q in np.random.default_rng(1).standard_normal((query_count, dimension))]
+    shard_counts = sorted({1, 2, 4, 8, 16, 32, 64, max_shards} & set(range(1, max_shards + 1)))
+    print(f"{os.cpu_count()} CPU cores, {dimension}d float32, top {TOP_K}, {query_count} queries")
+    context = multiprocessing.get_context("spawn")
+    for rows in sizes:
+        # the matrix is built in process memory and written once to the page cache
+        needed = rows * dimension * 4 * 2
+        if needed > available_bytes() * 0.9:
+            print(f"{rows:>9} vectors: skipped, needs {needed / 2 ** 30:.1f} GiB of memory")
+            continue
+        matrix = random_matrix(rows, dimension)
+        base = latency_ms(lambda q: baseline(matrix, q), queries)
+        print(f"{rows:>9} vectors: in-process scan {base:8.1f} ms")
+        with tempfile.TemporaryDirectory() as directory:
+            stem = os.path.join(directory, "bench")
+            matrix.tofile(stem + ".f32")
+            for shards in shard_counts:
+                with ProcessPoolExecutor(max_workers=shards, mp_context=context) as pool:
+                    took = latency_ms(lambda q: sharded(pool, stem, rows, dimension, shards, q), queries)
+                print(f"{'':>9}          {shards:>3} shards {took:8.1f} ms  ({base / took:4.2f}x)")
+        del matrix
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Import time of the knowledge-store modules versus the background load time.
+
+Importing must not depend on corpus size; the corpus is read by
+chunk_store.start_loading() after the server is up.
+
+Usage: python benchmarks/bench_startup.py [documents] [dimension]
+"""
+import json
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+PROBE = """
+import json, sys, time
+sys.path.insert(0, {root!r})
+started = time.perf_counter()
+import chunk_store
+imported = time.perf_counter() - started
+state = chunk_store.store.status["state"]
+chunk_store.start_loading()
+chunk_store.store.wait_ready()
+print(json.dumps({{"import_seconds": imported, "state_after_import": state,
+                  "load_seconds": time.perf_counter() - started - imported,
+                  "state_after_load": chunk_store.store.status["state"],
+                  "documents": len(chunk_store.store)}}))
+"""
+
+
+def write_corpus(data_dir: Path, documents: int, dimension: int):
+    data_dir.mkdir()
+    docs = [{
+        "id": str(i),
+        "content": f"第{i}段：受试者入组标准与给药方案说明。",
+        "content_hash": f"{i:064x}",
+        "embedding": [((i * 31 + j) % 997) / 997 for j in range(dimension)],
+        "knowledge_type": "指南",
+        "metadata": {"source_file": f"doc{i // 100}.txt", "chunk_index": i % 100},
+    } for i in range(documents)]
+    (data_dir / "embedded_documents.json").write_text(json.dumps(docs), encoding="utf-8")
+
+
+def measure_startup(documents: int, dimension: int = 384) -> dict:
+    """Import chunk_store in a fresh interpreter against a synthetic corpus."""
+    with tempfile.TemporaryDirectory() as tmp:
+        write_corpus(Path(tmp) / "data", documents, dimension)
+        out = subprocess.run([sys.executable, "-c", PROBE.format(root=str(ROOT))], cwd=tmp,
+                             capture_output=True, text=True, check=True).stdout
+        return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    documents = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    dimension = int(sys.argv[2]) if len(sys.argv) > 2 else 384
+    for n in (documents // 10, documents):
+        result = measure_startup(n, dimension)
+        print(f"{n:>8} docs x {dimension}d: import {result['import_seconds'] * 1000:7.1f} ms "
+              f"({result['state_after_import']}), background load {result['load_seconds']:6.2f} s")
+
+
+if __name__ == "__main__":
+    main()
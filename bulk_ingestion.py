@@ -0,0 +1,226 @@
+import csv
+import hashlib
+import io
+import json
+import logging
+import zipfile
+from pathlib import Path, PurePosixPath
+from typing import Any, BinaryIO, Callable, Dict, Iterator, List, Tuple
+
+from config import (
+    UPLOAD_DIR,
+    BULK_IMPORT_ALLOWED_DIRS,
+    BULK_IMPORT_MAX_FILES,
+    BULK_IMPORT_MAX_FILE_BYTES,
+    BULK_IMPORT_MAX_TOTAL_BYTES,
+)
+
+logger = logging.getLogger("medical_ai_agent")
+
+# File types the extractors understand; anything else in a batch is skipped
+SUPPORTED_SUFFIXES = {'.txt', '.md', '.csv', '.pdf', '.docx', '.xlsx', '.xls'}
+
+# Manifest files looked up at the root of an archive or directory
+MANIFEST_NAMES = ("manifest.json", "manifest.csv")
+
+Opener = Callable[[], BinaryIO]
+
+
+def parse_manifest(name: str, data: bytes) -> Dict[str, Dict[str, Any]]:
+    """Parse a bulk-ingestion manifest into ``{path or folder: fields}``.
+
+    ``manifest.json`` maps a relative file or folder path to a knowledge type
+    string or to ``{"knowledge_type": ..., "title": ...}``; ``manifest.csv``
+    has ``path,knowledge_type[,title]`` columns.
+    """
+    entries: Dict[str, Dict[str, Any]] = {}
+    text = data.decode("utf-8-sig")
+    if name.endswith(".json"):
+        for path, value in json.loads(text).items():
+            entries[path.strip("/")] = value if isinstance(value, dict) else {"knowledge_type": value}
+    else:
+        for row in csv.DictReader(io.StringIO(text)):
+            path = (row.get("path") or "").strip().strip("/")
+            if path:
+                entries[path] = {k: v for k, v in row.items() if k != "path" and v}
+    return entries
+
+
+def resolve_entry(relpath: str, manifest: Dict[str, Dict[str, Any]], default_type: str) -> Dict[str, Any]:
+    """Pick knowledge_type/title for a file: the manifest entry for the file or
+    its nearest listed folder, else the top-level folder name, else the default."""
+    parts = PurePosixPath(relpath).parts
+    for depth in range(len(parts), 0, -1):
+        entry = manifest.get("/".join(parts[:depth]))
+        if entry:
+            return {"knowledge_type": entry.get("knowledge_type") or default_type, "title": entry.get("title")}
+    knowledge_type = parts[0] if len(parts) > 1 else default_type
+    return {"knowledge_type": knowledge_type, "title": None}
+
+
+def _zip_member_name(info: zipfile.ZipInfo) -> str:
+    name = info.filename
+    if not info.flag_bits & 0x800:
+        # Archives made on Chinese Windows store GBK names without the UTF-8 flag
+        try:
+            name = name.encode("cp437").decode("gbk")
+        except (UnicodeEncodeError, UnicodeDecodeError):
+            pass
+    return name
+
+
+def check_archive_limits(archive: zipfile.ZipFile):
+    """Refuse an archive whose member count or declared uncompressed size is
+    over the bulk-import limits, before anything is extracted (zip bombs).
+
+    Reading a member never yields more than its declared size, so the
+    declared sizes bound what staging writes.
+    """
+    members = [info for info in archive.infolist() if not info.is_dir()]
+    if len(members) > BULK_IMPORT_MAX_FILES:
+        raise ValueError(f"压缩包包含 {len(members)} 个文件，超过上限 {BULK_IMPORT_MAX_FILES}")
+    total = sum(info.file_size for info in members)
+    if total > BULK_IMPORT_MAX_TOTAL_BYTES:
+        raise ValueError(f"压缩包解压后共 {total} 字节，超过上限 {BULK_IMPORT_MAX_TOTAL_BYTES}")
+
+
+def iter_archive_files(archive: zipfile.ZipFile) -> Iterator[Tuple[str, Opener]]:
+    """Yield ``(relative path, opener)`` for regular files in a zip archive."""
+    for info in archive.infolist():
+        if info.is_dir():
+            continue
+        relpath = PurePosixPath(_zip_member_name(info).replace("\\", "/"))
+        # refuse absolute paths and ".." (zip slip) and skip macOS metadata
+        if relpath.is_absolute() or ".." in relpath.parts or relpath.parts[0] == "__MACOSX":
+            continue
+        if info.file_size > BULK_IMPORT_MAX_FILE_BYTES:
+            yield str(relpath), _refuse(f"解压后 {info.file_size} 字节，超过单个文件上限")
+            continue
+        yield str(relpath), (lambda info=info: archive.open(info))
+
+
+def _refuse(reason: str) -> Opener:
+    def opener():
+        raise ValueError(reason)
+    return opener
+
+
+def _in_allowed_root(path: Path) -> bool:
+    """Whether a resolved path lies in one of the allowed import roots."""
+    for allowed in BULK_IMPORT_ALLOWED_DIRS:
+        root = Path(allowed).resolve()
+        if path == root or root in path.parents:
+            return True
+    return False
+
+
+def _open_import_file(path: Path) -> BinaryIO:
+    # resolved again at open time: a symlink may point outside the allowed roots
+    resolved = path.resolve()
+    if not _in_allowed_root(resolved):
+        raise PermissionError("链接指向允许导入的目录之外")
+    if resolved.stat().st_size > BULK_IMPORT_MAX_FILE_BYTES:
+        raise ValueError("文件超过单个文件大小上限")
+    return open(resolved, "rb")
+
+
+def iter_directory_files(root: Path) -> Iterator[Tuple[str, Opener]]:
+    """Yield ``(relative path, opener)`` for files below a directory."""
+    for path in sorted(root.rglob("*")):
+        if path.is_file():
+            yield path.relative_to(root).as_posix(), (lambda path=path: _open_import_file(path))
+
+
+def resolve_import_directory(directory: str) -> Path:
+    """Resolve a server-side directory, which must lie in an allowed import root."""
+    path = Path(directory).resolve()
+    if not _in_allowed_root(path):
+        raise PermissionError(f"目录 {directory} 不在允许导入的目录 {BULK_IMPORT_ALLOWED_DIRS} 中")
+    if not path.is_dir():
+        raise ValueError(f"目录不存在: {directory}")
+    return path
+
+
+def _upload_path(relpath: str, batch_id: str) -> Path:
+    flat = relpath.replace("/", "__")
+    path = UPLOAD_DIR / flat
+    if path.exists():
+        path = UPLOAD_DIR / f"{Path(flat).stem}_{batch_id[:8]}{Path(flat).suffix}"
+    return path
+
+
+def _copy_with_hash(source: BinaryIO, dest: Path, max_bytes: int) -> Tuple[int, str]:
+    digest = hashlib.sha256()
+    size = 0
+    tmp_path = dest.with_name(dest.name + ".part")
+    try:
+        with open(tmp_path, "wb") as out:
+            for block in iter(lambda: source.read(1024 * 1024), b""):
+                size += len(block)
+                if size > max_bytes:
+                    raise ValueError("超过批量导入的大小上限")
+                digest.update(block)
+                out.write(block)
+        tmp_path.replace(dest)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    return size, digest.hexdigest()
+
+
+def stage_files(files: List[Tuple[str, Opener]], batch_id: str,
+                default_type: str) -> Tuple[List[Dict[str, Any]], List[Dict[str, str]]]:
+    """Copy supported files into the upload directory for ingestion.
+
+    Returns the job specs (path, original name, knowledge type, title, size,
+    sha256) and the skipped files with the reason. Raises ValueError if
+    there are more than ``BULK_IMPORT_MAX_FILES`` files; files beyond the
+    per-file or total byte limit are skipped.
+    """
+    if len(files) > BULK_IMPORT_MAX_FILES:
+        raise ValueError(f"共 {len(files)} 个文件，超过上限 {BULK_IMPORT_MAX_FILES}")
+    manifest: Dict[str, Dict[str, Any]] = {}
+    for relpath, opener in files:
+        if relpath in MANIFEST_NAMES:
+            with opener() as f:
+                manifest = parse_manifest(relpath, f.read())
+            break
+
+    specs, skipped = [], []
+    staged_bytes = 0
+    for relpath, opener in files:
+        if relpath in MANIFEST_NAMES:
+            continue
+        name = PurePosixPath(relpath).name
+        if name.startswith(".") or Path(name).suffix.lower() not in SUPPORTED_SUFFIXES:
+            skipped.append({"file": relpath, "reason": "不支持的文件类型"})
+            continue
+        try:
+            dest = _upload_path(relpath, batch_id)
+            with opener() as source:
+                budget = min(BULK_IMPORT_MAX_FILE_BYTES, BULK_IMPORT_MAX_TOTAL_BYTES - staged_bytes)
+                size, sha256 = _copy_with_hash(source, dest, budget)
+            staged_bytes += size
+        except Exception as e:
+            skipped.append({"file": relpath, "reason": str(e)})
+            continue
+        specs.append({"file_path": dest, "original_name": relpath, "size": size, "sha256": sha256,
+                      **resolve_entry(relpath, manifest, default_type)})
+    logger.info(f"📦 批量导入已暂存 {len(specs)} 个文件，跳过 {len(skipped)} 个")
+    return specs, skipped
+
+
+def stage_archive(archive_path: Path, batch_id: str, default_type: str):
+    """Stage the files of a zip archive; the archive is deleted afterwards."""
+    try:
+        with zipfile.ZipFile(archive_path) as archive:
+            check_archive_limits(archive)
+            return stage_files(list(iter_archive_files(archive)), batch_id, default_type)
+    finally:
+        archive_path.unlink(missing_ok=True)
+
+
+def stage_directory(directory: str, batch_id: str, default_type: str):
+    """Stage the files of an allowed server-side directory (copied, not moved)."""
+    root = resolve_import_directory(directory)
+    return stage_files(list(iter_directory_files(root)), batch_id, default_type)
@@ -0,0 +1,541 @@
+import base64
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS files (
+    filename TEXT PRIMARY KEY,
+    original_name TEXT,
+    knowledge_type TEXT,
+    upload_time TEXT,
+    sha256 TEXT,
+    info TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_files_original_name ON files (original_name);
+CREATE INDEX IF NOT EXISTS idx_files_knowledge_type ON files (knowledge_type);
+CREATE INDEX IF NOT EXISTS idx_files_upload_time ON files (upload_time);
+CREATE INDEX IF NOT EXISTS idx_files_sha256 ON files (sha256);
+CREATE TABLE IF NOT EXISTS chunks (
+    content_hash TEXT PRIMARY KEY,
+    doc_id TEXT,
+    knowledge_type TEXT,
+    source_file TEXT,
+    upload_time TEXT,
+    metadata TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_chunks_source_file ON chunks (source_file);
+CREATE INDEX IF NOT EXISTS idx_chunks_knowledge_type ON chunks (knowledge_type);
+CREATE INDEX IF NOT EXISTS idx_chunks_upload_time ON chunks (upload_time);
+CREATE TABLE IF NOT EXISTS chunk_refs (
+    content_hash TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    chunk_index INTEGER NOT NULL,
+    knowledge_type TEXT,
+    page INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_chunk_refs_filename ON chunk_refs (filename, chunk_index);
+CREATE INDEX IF NOT EXISTS idx_chunk_refs_hash ON chunk_refs (content_hash);
+CREATE INDEX IF NOT EXISTS idx_chunk_refs_knowledge_type ON chunk_refs (knowledge_type);
+CREATE TABLE IF NOT EXISTS chunk_vectors (
+    content_hash TEXT PRIMARY KEY,
+    content TEXT NOT NULL,
+    vector_offset INTEGER NOT NULL,
+    dimension INTEGER NOT NULL,
+    segment INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS changes (
+    generation INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    key TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_changes_generation ON changes (generation);
+CREATE TABLE IF NOT EXISTS ingestion_jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    created REAL NOT NULL,
+    lease_owner TEXT,
+    lease_expires REAL,
+    job TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_ingestion_jobs_status ON ingestion_jobs (status, created);
+CREATE TABLE IF NOT EXISTS ingestion_batches (
+    id TEXT PRIMARY KEY,
+    created REAL NOT NULL,
+    batch TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS workflow_gates (
+    workflow_id TEXT NOT NULL,
+    gate TEXT NOT NULL,
+    created REAL NOT NULL,
+    confirmed INTEGER NOT NULL DEFAULT 0,
+    payload TEXT,
+    PRIMARY KEY (workflow_id, gate)
+);
+"""
+
+# Unique index on a file's chunk positions; catalogs written before it existed
+# may hold duplicate references, which are removed before it is created
+_UNIQUE_REFS_INDEX = "idx_chunk_refs_unique"
+
+# Generations kept in the change log; a worker further behind reloads fully
+CHANGE_LOG_RETENTION = 10000
+
+# Seconds a workflow gate row is kept if its worker died without closing it
+WORKFLOW_GATE_RETENTION = 24 * 3600
+
+# Bound on the number of host parameters in one IN (...) query
+_IN_BATCH = 500
+
+
+# Columns /knowledge/files may sort by; each is indexed
+FILE_SORT_COLUMNS = ("upload_time", "original_name", "filename")
+
+
+def encode_cursor(values: List[Any]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values, ensure_ascii=False).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> List[Any]:
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except Exception:
+        raise ValueError(f"无效的分页游标: {cursor}")
+
+
+def _ref_from_row(row) -> Dict[str, Any]:
+    ref = {"content_hash": row[0], "file": row[1], "chunk_index": row[2], "knowledge_type": row[3]}
+    if row[4] is not None:
+        ref["page"] = row[4]
+    return ref
+
+
+class KnowledgeCatalog:
+    """SQLite catalog of uploaded files, chunks and chunk references.
+
+    The catalog answers the lookups by filename, source file, knowledge type
+    and upload time through indexes. Chunk text and the position of each
+    embedding in the vector segment are stored with the chunks, and every
+    change is numbered in a change log, so worker processes sharing the
+    database can follow each other's uploads and deletes. Writers take the
+    connection returned by ``transaction()`` so a file's rows change together.
+
+    Reads outside a transaction use a read-only connection per thread: in WAL
+    mode they see the last committed state without waiting for a writer,
+    whether it is in this process or another one.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = str(path)
+        self._lock = threading.RLock()
+        self._local = threading.local()
+        # other worker processes may hold the write lock for a moment
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+        if self.path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._unique_refs()
+        self._segment_column()
+
+    def _unique_refs(self):
+        """Make a file's chunk position unique, dropping duplicate reference
+        rows left by workers that ingested the same job twice."""
+        exists = "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?"
+        if self._query(exists, (_UNIQUE_REFS_INDEX,)):
+            return
+        with self.transaction() as conn:
+            if conn.execute(exists, (_UNIQUE_REFS_INDEX,)).fetchone():
+                return
+            conn.execute("DELETE FROM chunk_refs WHERE rowid NOT IN (SELECT MIN(rowid) FROM chunk_refs "
+                         "GROUP BY content_hash, filename, chunk_index)")
+            conn.execute(f"CREATE UNIQUE INDEX {_UNIQUE_REFS_INDEX} ON chunk_refs "
+                         "(content_hash, filename, chunk_index)")
+
+    def _segment_column(self):
+        """Add the segment number to chunk_vectors of catalogs written before
+        the vector segment was compacted into numbered files."""
+        columns = [row[1] for row in self._query("PRAGMA table_info(chunk_vectors)")]
+        if "segment" not in columns:
+            with self.transaction() as conn:
+                if "segment" not in [row[1] for row in conn.execute("PRAGMA table_info(chunk_vectors)")]:
+                    conn.execute("ALTER TABLE chunk_vectors ADD COLUMN segment INTEGER NOT NULL DEFAULT 0")
+
+    def transaction(self):
+        """Context manager holding the catalog lock around one transaction."""
+        return _Transaction(self)
+
+    def _query(self, sql: str, params: Iterable[Any] = ()) -> List[tuple]:
+        if self.path == ":memory:" or getattr(self._local, "writing", False):
+            # an in-memory database has one connection; a transaction reads its own writes
+            with self._lock:
+                return self._conn.execute(sql, tuple(params)).fetchall()
+        return self._reader().execute(sql, tuple(params)).fetchall()
+
+    def _reader(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "reader", None)
+        if conn is None:
+            conn = self._local.reader = sqlite3.connect(self.path, isolation_level=None, timeout=30)
+            conn.execute("PRAGMA query_only = ON")
+        return conn
+
+    # -- meta ---------------------------------------------------------------
+
+    def get_meta(self, key: str) -> Optional[str]:
+        rows = self._query("SELECT value FROM meta WHERE key = ?", (key,))
+        return rows[0][0] if rows else None
+
+    def set_meta(self, conn, key: str, value: str):
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    # -- files --------------------------------------------------------------
+
+    def put_file(self, conn, file_info: Dict[str, Any]):
+        conn.execute(
+            "INSERT OR REPLACE INTO files (filename, original_name, knowledge_type, upload_time, sha256, info) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (file_info["filename"], file_info.get("original_name") or file_info["filename"],
+             file_info.get("knowledge_type"), file_info.get("upload_time") or "", file_info.get("sha256"),
+             json.dumps(file_info, ensure_ascii=False)),
+        )
+
+    def delete_file(self, conn, filename: str):
+        conn.execute("DELETE FROM files WHERE filename = ?", (filename,))
+
+    def get_file(self, filename: str) -> Optional[Dict[str, Any]]:
+        rows = self._query("SELECT info FROM files WHERE filename = ?", (filename,))
+        return json.loads(rows[0][0]) if rows else None
+
+    def find_file(self, name: str) -> Optional[Dict[str, Any]]:
+        """Look a file up by stored filename, then by original name."""
+        return self.get_file(name) or next(iter(self._files_where("original_name = ?", (name,), limit=1)), None)
+
+    def files_named(self, original_name: str) -> List[Dict[str, Any]]:
+        return self._files_where("original_name = ?", (original_name,))
+
+    def find_file_by_hash(self, sha256: str) -> Optional[Dict[str, Any]]:
+        return next(iter(self._files_where("sha256 = ?", (sha256,), limit=1)), None)
+
+    def _files_where(self, where: str, params: Iterable[Any], limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        sql = f"SELECT info FROM files WHERE {where} ORDER BY upload_time"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        return [json.loads(row[0]) for row in self._query(sql, params)]
+
+    def list_files(self, knowledge_type: Optional[str] = None) -> List[Dict[str, Any]]:
+        if knowledge_type:
+            return self._files_where("knowledge_type = ?", (knowledge_type,))
+        return self._files_where("1", ())
+
+    def query_files(self, knowledge_type: Optional[str] = None, name: Optional[str] = None,
+                    uploaded_after: Optional[str] = None, uploaded_before: Optional[str] = None,
+                    sort: str = "upload_time", descending: bool = True, limit: int = 50,
+                    cursor: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str], int]:
+        """One page of files matching the filters, in keyset order.
+
+        ``name`` matches part of the stored or original file name; upload
+        times compare as ISO strings. Returns the files, the cursor of the
+        next page (None on the last page) and the number of matching files.
+        """
+        if sort not in FILE_SORT_COLUMNS:
+            raise ValueError(f"不支持的排序字段: {sort}，可选 {', '.join(FILE_SORT_COLUMNS)}")
+        where, params = [], []
+        if knowledge_type:
+            where.append("knowledge_type = ?")
+            params.append(knowledge_type)
+        if name:
+            where.append("(original_name LIKE ? ESCAPE '\\' OR filename LIKE ? ESCAPE '\\')")
+            pattern = "%" + name.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            params += [pattern, pattern]
+        if uploaded_after:
+            where.append("upload_time >= ?")
+            params.append(uploaded_after)
+        if uploaded_before:
+            where.append("upload_time < ?")
+            params.append(uploaded_before)
+        total = self._query(f"SELECT COUNT(*) FROM files WHERE {' AND '.join(where) or '1'}", params)[0][0]
+
+        direction, compare = ("DESC", "<") if descending else ("ASC", ">")
+        if cursor:
+            try:
+                value, filename = decode_cursor(cursor)
+            except TypeError:
+                raise ValueError(f"无效的分页游标: {cursor}")
+            where.append(f"({sort} {compare} ? OR ({sort} = ? AND filename {compare} ?))")
+            params += [value, value, filename]
+        rows = self._query(
+            f"SELECT {sort}, filename, info FROM files WHERE {' AND '.join(where) or '1'} "
+            f"ORDER BY {sort} {direction}, filename {direction} LIMIT ?", params + [limit + 1])
+        next_cursor = encode_cursor(list(rows[limit - 1][:2])) if len(rows) > limit else None
+        return [json.loads(row[2]) for row in rows[:limit]], next_cursor, total
+
+    def count_files(self) -> int:
+        return self._query("SELECT COUNT(*) FROM files")[0][0]
+
+    # -- chunks -------------------------------------------------------------
+
+    def put_chunk(self, conn, doc: Dict[str, Any]):
+        metadata = doc.get("metadata", {})
+        conn.execute(
+            "INSERT OR REPLACE INTO chunks (content_hash, doc_id, knowledge_type, source_file, upload_time, metadata) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (doc["content_hash"], doc.get("id"), doc.get("knowledge_type"), metadata.get("source_file"),
+             metadata.get("upload_time"), json.dumps(metadata, ensure_ascii=False)),
+        )
+
+    def delete_chunks(self, conn, hashes: Iterable[str]):
+        """Delete chunk rows, their vectors and any references left pointing at them."""
+        params = [(h,) for h in hashes]
+        conn.executemany("DELETE FROM chunks WHERE content_hash = ?", params)
+        conn.executemany("DELETE FROM chunk_vectors WHERE content_hash = ?", params)
+        conn.executemany("DELETE FROM chunk_refs WHERE content_hash = ?", params)
+
+    def put_vectors(self, conn, rows: Iterable[Tuple[str, str, int, int, int]]):
+        """Store ``(content_hash, content, vector_offset, dimension, segment)`` rows."""
+        conn.executemany(
+            "INSERT OR REPLACE INTO chunk_vectors (content_hash, content, vector_offset, dimension, segment) "
+            "VALUES (?, ?, ?, ?, ?)", rows)
+
+    def vector_rows(self) -> List[Tuple[str, int, int, int]]:
+        """``(content_hash, vector_offset, dimension, segment)`` of every stored vector, in storage order."""
+        return self._query("SELECT content_hash, vector_offset, dimension, segment FROM chunk_vectors ORDER BY rowid")
+
+    def move_vectors(self, conn, rows: Iterable[Tuple[int, int, str]]):
+        """Point vectors at their copies: ``(vector_offset, segment, content_hash)`` rows."""
+        conn.executemany("UPDATE chunk_vectors SET vector_offset = ?, segment = ? WHERE content_hash = ?", rows)
+
+    def segment_floats(self, segment: int) -> int:
+        """Floats of a vector segment still used by stored chunks."""
+        return self._query("SELECT COALESCE(SUM(dimension), 0) FROM chunk_vectors WHERE segment = ?", (segment,))[0][0]
+
+    def vector_hashes(self) -> List[str]:
+        return [row[0] for row in self._query("SELECT content_hash FROM chunk_vectors")]
+
+    def chunk_rows(self, hashes: Optional[Iterable[str]] = None) -> List[tuple]:
+        """``(content_hash, doc_id, knowledge_type, metadata, content,
+        vector_offset, dimension, segment)`` of chunks with stored vectors; all
+        of them in storage order, or those of ``hashes``."""
+        sql = ("SELECT c.content_hash, c.doc_id, c.knowledge_type, c.metadata, v.content, v.vector_offset, "
+               "v.dimension, v.segment FROM chunks c JOIN chunk_vectors v ON v.content_hash = c.content_hash")
+        if hashes is None:
+            return self._query(sql + " ORDER BY v.rowid")
+        hashes = list(hashes)
+        rows = []
+        for i in range(0, len(hashes), _IN_BATCH):
+            part = hashes[i:i + _IN_BATCH]
+            rows += self._query(sql + f" WHERE c.content_hash IN ({', '.join('?' * len(part))})", part)
+        return rows
+
+    def count_chunks(self) -> int:
+        return self._query("SELECT COUNT(*) FROM chunks")[0][0]
+
+    def chunk_type_counts(self) -> Dict[str, int]:
+        """Number of stored chunks per knowledge type."""
+        return dict(self._query("SELECT knowledge_type, COUNT(*) FROM chunks GROUP BY knowledge_type"))
+
+    def chunk_hashes(self) -> List[str]:
+        return [row[0] for row in self._query("SELECT content_hash FROM chunks")]
+
+    # -- chunk references ---------------------------------------------------
+
+    def add_refs(self, conn, refs: Iterable[Dict[str, Any]]):
+        """Insert ``{"content_hash", "file", "chunk_index", "knowledge_type"[, "page"]}`` references;
+        a reference the file already has is kept as it is."""
+        conn.executemany(
+            "INSERT OR IGNORE INTO chunk_refs (content_hash, filename, chunk_index, knowledge_type, page) VALUES (?, ?, ?, ?, ?)",
+            [(ref["content_hash"], ref["file"], ref["chunk_index"], ref.get("knowledge_type"), ref.get("page"))
+             for ref in refs],
+        )
+
+    def delete_refs(self, conn, filename: str):
+        conn.execute("DELETE FROM chunk_refs WHERE filename = ?", (filename,))
+
+    def file_refs(self, filename: str) -> List[Dict[str, Any]]:
+        """References of a file in chunk order."""
+        rows = self._query(
+            "SELECT content_hash, filename, chunk_index, knowledge_type, page FROM chunk_refs "
+            "WHERE filename = ? ORDER BY chunk_index", (filename,))
+        return [_ref_from_row(row) for row in rows]
+
+    def file_refs_page(self, filename: str, after_index: Optional[int] = None,
+                       limit: int = 50) -> List[Dict[str, Any]]:
+        """References of a file with ``chunk_index`` above ``after_index``, in order."""
+        rows = self._query(
+            "SELECT content_hash, filename, chunk_index, knowledge_type, page FROM chunk_refs "
+            "WHERE filename = ? AND chunk_index > ? ORDER BY chunk_index LIMIT ?",
+            (filename, -1 if after_index is None else after_index, limit))
+        return [_ref_from_row(row) for row in rows]
+
+    def file_ref_summary(self, filename: str) -> Dict[str, Any]:
+        """Reference count and knowledge types of a file."""
+        count = self._query("SELECT COUNT(*) FROM chunk_refs WHERE filename = ?", (filename,))[0][0]
+        types = self._query("SELECT DISTINCT knowledge_type FROM chunk_refs WHERE filename = ?", (filename,))
+        return {"chunks": count, "knowledge_types": [row[0] for row in types]}
+
+    def hash_refs(self, content_hash: str) -> List[Dict[str, Any]]:
+        rows = self._query(
+            "SELECT content_hash, filename, chunk_index, knowledge_type, page FROM chunk_refs "
+            "WHERE content_hash = ? ORDER BY rowid", (content_hash,))
+        return [_ref_from_row(row) for row in rows]
+
+    def file_hashes(self, filename: str) -> List[str]:
+        return [row[0] for row in self._query(
+            "SELECT DISTINCT content_hash FROM chunk_refs WHERE filename = ?", (filename,))]
+
+    def ref_types(self, hashes: Optional[Iterable[str]] = None) -> List[Tuple[str, str]]:
+        """``(content_hash, knowledge_type)`` reference pairs, all or of ``hashes``."""
+        sql = "SELECT DISTINCT content_hash, knowledge_type FROM chunk_refs"
+        if hashes is None:
+            return self._query(sql)
+        hashes = list(hashes)
+        rows = []
+        for i in range(0, len(hashes), _IN_BATCH):
+            part = hashes[i:i + _IN_BATCH]
+            rows += self._query(sql + f" WHERE content_hash IN ({', '.join('?' * len(part))})", part)
+        return rows
+
+    # -- change log ---------------------------------------------------------
+
+    def generation(self) -> int:
+        """Number of the last change logged by any process using the catalog."""
+        return int(self.get_meta("generation") or 0)
+
+    def log_change(self, conn, entries: Iterable[Tuple[str, Optional[str]]]) -> int:
+        """Log one change made of ``(kind, key)`` entries; return its generation."""
+        row = conn.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()
+        generation = int(row[0] if row else 0) + 1
+        self.set_meta(conn, "generation", str(generation))
+        rows = [(generation, kind, key) for kind, key in entries] or [(generation, "version", None)]
+        conn.executemany("INSERT INTO changes (generation, kind, key) VALUES (?, ?, ?)", rows)
+        conn.execute("DELETE FROM changes WHERE generation <= ?", (generation - CHANGE_LOG_RETENTION,))
+        return generation
+
+    def changes_since(self, generation: int) -> Optional[List[Tuple[int, str, Optional[str]]]]:
+        """``(generation, kind, key)`` entries logged after ``generation``, in
+        order; None if the log no longer reaches back that far."""
+        current = self.generation()
+        rows = self._query("SELECT generation, kind, key FROM changes WHERE generation > ? "
+                           "ORDER BY generation, rowid", (generation,))
+        first = rows[0][0] if rows else current + 1
+        return None if first > generation + 1 else rows
+
+
+    # -- ingestion jobs and batches -----------------------------------------
+
+    def add_job(self, conn, job: Dict[str, Any]):
+        conn.execute("INSERT INTO ingestion_jobs (id, status, created, job) VALUES (?, ?, ?, ?)",
+                     (job["id"], job["status"], job["created"], json.dumps(job, ensure_ascii=False)))
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        rows = self._query("SELECT job FROM ingestion_jobs WHERE id = ?", (job_id,))
+        return json.loads(rows[0][0]) if rows else None
+
+    def list_jobs(self) -> List[Dict[str, Any]]:
+        """Jobs of every worker, newest first."""
+        return [json.loads(row[0]) for row in self._query("SELECT job FROM ingestion_jobs ORDER BY created DESC")]
+
+    def claim_job(self, owner: str, lease_seconds: float, now: float) -> Optional[Dict[str, Any]]:
+        """Lease the oldest queued job, or one whose worker stopped renewing
+        its lease, to ``owner``; return it, or None if there is none.
+
+        The job is selected and leased under the write lock, so of several
+        workers polling at once exactly one gets it.
+        """
+        with self.transaction() as conn:
+            row = conn.execute(
+                "SELECT id, job FROM ingestion_jobs WHERE status = 'queued' "
+                "OR (status = 'running' AND (lease_expires IS NULL OR lease_expires < ?)) "
+                "ORDER BY created LIMIT 1", (now,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE ingestion_jobs SET status = 'running', lease_owner = ?, lease_expires = ? "
+                         "WHERE id = ?", (owner, now + lease_seconds, row[0]))
+            return json.loads(row[1])
+
+    def update_job(self, conn, job: Dict[str, Any], owner: str, lease_expires: Optional[float]) -> bool:
+        """Store a leased job's progress and extend its lease (None releases
+        it); False if ``owner`` no longer holds the lease."""
+        cursor = conn.execute(
+            "UPDATE ingestion_jobs SET status = ?, job = ?, lease_expires = ?, lease_owner = ? "
+            "WHERE id = ? AND lease_owner = ?",
+            (job["status"], json.dumps(job, ensure_ascii=False), lease_expires,
+             owner if lease_expires is not None else None, job["id"], owner))
+        return cursor.rowcount > 0
+
+    def prune_jobs(self, conn, keep: int):
+        """Delete finished jobs except the ``keep`` newest."""
+        conn.execute(
+            "DELETE FROM ingestion_jobs WHERE status IN ('completed', 'failed') AND id NOT IN ("
+            "SELECT id FROM ingestion_jobs WHERE status IN ('completed', 'failed') ORDER BY created DESC LIMIT ?)",
+            (keep,))
+
+    def put_batch(self, conn, batch: Dict[str, Any]):
+        conn.execute("INSERT OR REPLACE INTO ingestion_batches (id, created, batch) VALUES (?, ?, ?)",
+                     (batch["id"], batch["created"], json.dumps(batch, ensure_ascii=False)))
+
+    def get_batch(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        rows = self._query("SELECT batch FROM ingestion_batches WHERE id = ?", (batch_id,))
+        return json.loads(rows[0][0]) if rows else None
+
+    def list_batches(self) -> List[Dict[str, Any]]:
+        """Batches, newest first."""
+        return [json.loads(row[0]) for row in
+                self._query("SELECT batch FROM ingestion_batches ORDER BY created DESC")]
+
+    # -- workflow confirmation gates ----------------------------------------
+
+    def open_gate(self, workflow_id: str, gate: str, now: float):
+        """Record that a workflow waits for ``gate`` to be confirmed."""
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM workflow_gates WHERE created < ?", (now - WORKFLOW_GATE_RETENTION,))
+            conn.execute("INSERT OR REPLACE INTO workflow_gates (workflow_id, gate, created) VALUES (?, ?, ?)",
+                         (workflow_id, gate, now))
+
+    def confirm_gate(self, workflow_id: str, gate: str, payload: Any = None) -> bool:
+        """Confirm an open gate from any worker; False if none is waiting."""
+        with self.transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE workflow_gates SET confirmed = 1, payload = ? "
+                "WHERE workflow_id = ? AND gate = ? AND confirmed = 0",
+                (json.dumps(payload, ensure_ascii=False), workflow_id, gate))
+            return cursor.rowcount > 0
+
+    def gate_confirmation(self, workflow_id: str, gate: str) -> Tuple[bool, Any]:
+        """``(True, payload)`` once the gate was confirmed, else ``(False, None)``."""
+        rows = self._query("SELECT payload FROM workflow_gates WHERE workflow_id = ? AND gate = ? AND confirmed = 1",
+                           (workflow_id, gate))
+        return (True, json.loads(rows[0][0])) if rows else (False, None)
+
+    def close_gate(self, workflow_id: str, gate: str):
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM workflow_gates WHERE workflow_id = ? AND gate = ?", (workflow_id, gate))
+
+
+class _Transaction:
+    def __init__(self, catalog: KnowledgeCatalog):
+        self.catalog = catalog
+
+    def __enter__(self):
+        self.catalog._lock.acquire()
+        try:
+            # take the write lock up front so concurrent writers queue instead of failing
+            self.catalog._conn.execute("BEGIN IMMEDIATE")
+        except BaseException:
+            self.catalog._lock.release()
+            raise
+        self.catalog._local.writing = True
+        return self.catalog._conn
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.catalog._conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        finally:
+            self.catalog._local.writing = False
+            self.catalog._lock.release()
+        return False
@@ -0,0 +1,156 @@
+import sys
+import threading
+import weakref
+from array import array
+from typing import Any, Dict, Optional, Tuple
+
+# Chunk metadata that is the same for every chunk of an upload; stored once
+FILE_FIELDS = ("title", "source_file", "upload_time", "file_type", "embedding_dimension")
+# Metadata that differs per chunk; kept on the record itself
+CHUNK_FIELDS = ("chunk_index", "page")
+
+_MISSING = object()
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class FileRow:
+    """One interned file-level metadata row, shared by the chunks of an upload."""
+
+    __slots__ = ("values", "__weakref__")
+
+    def __init__(self, values: Tuple[Any, ...]):
+        self.values = values
+
+
+class FileMetadataTable:
+    """Interned file-level metadata rows, referenced from records.
+
+    The table only holds rows weakly: a row is dropped as soon as the last
+    record using it is gone (its file was removed or replaced and no
+    snapshot still reads the old records), so the table does not grow over
+    the life of the process.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rows: "weakref.WeakValueDictionary[Tuple[Any, ...], FileRow]" = weakref.WeakValueDictionary()
+
+    def intern(self, metadata: Dict[str, Any]) -> FileRow:
+        values = tuple(_intern(metadata.get(field, _MISSING)) for field in FILE_FIELDS)
+        with self._lock:
+            row = self._rows.get(values)
+            if row is None:
+                row = self._rows[values] = FileRow(values)
+            return row
+
+    @staticmethod
+    def get(row: FileRow) -> Dict[str, Any]:
+        return {field: value for field, value in zip(FILE_FIELDS, row.values) if value is not _MISSING}
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+
+file_metadata = FileMetadataTable()
+
+
+class ChunkRecord:
+    """Compact stored chunk.
+
+    The embedding is a float64 ``array`` (or a view into the shared vector
+    segment), file-level metadata is a shared row of ``file_metadata`` and
+    knowledge types are interned strings. Records
+    still read like the chunk dicts they replace (``doc["content"]``,
+    ``doc.get("metadata")``); ``metadata`` is assembled on access, so update
+    it through ``set_metadata``. ``types`` caches the knowledge types of all
+    files referencing the chunk.
+
+    Records published to the store are treated as immutable, since readers
+    may still hold them; change a ``copy()`` and publish that instead.
+    """
+
+    __slots__ = ("id", "content", "content_hash", "knowledge_type", "embedding",
+                 "file_row", "chunk_index", "page", "extra", "types")
+
+    _KEYS = frozenset(__slots__) - {"file_row", "chunk_index", "page", "extra", "types"}
+
+    def __init__(self, id: Optional[str], content: str, content_hash: str, knowledge_type: str,
+                 embedding, metadata: Dict[str, Any]):
+        self.id = id
+        self.content = content
+        self.content_hash = content_hash
+        self.knowledge_type = _intern(knowledge_type)
+        # a memoryview is a vector read from the shared segment; kept without copying
+        self.embedding = embedding if isinstance(embedding, (array, memoryview)) else array("d", embedding or ())
+        self.types: Optional[frozenset] = None
+        self.set_metadata(metadata)
+
+    @classmethod
+    def of(cls, doc) -> "ChunkRecord":
+        """Return ``doc`` as a record, converting a chunk dict."""
+        if isinstance(doc, cls):
+            return doc
+        return cls(doc.get("id"), doc.get("content", ""), doc["content_hash"], doc.get("knowledge_type"),
+                   doc.get("embedding"), doc.get("metadata") or {})
+
+    def copy(self) -> "ChunkRecord":
+        """Shallow copy sharing the content and embedding."""
+        record = ChunkRecord.__new__(ChunkRecord)
+        for slot in self.__slots__:
+            setattr(record, slot, getattr(self, slot))
+        return record
+
+    def set_metadata(self, metadata: Dict[str, Any]):
+        self.file_row = file_metadata.intern(metadata)
+        self.chunk_index = metadata.get("chunk_index")
+        self.page = metadata.get("page")
+        extra = {k: v for k, v in metadata.items() if k not in FILE_FIELDS and k not in CHUNK_FIELDS}
+        self.extra = extra or None
+
+    @property
+    def metadata(self) -> Dict[str, Any]:
+        metadata = file_metadata.get(self.file_row)
+        if self.chunk_index is not None:
+            metadata["chunk_index"] = self.chunk_index
+        if self.page is not None:
+            metadata["page"] = self.page
+        if self.extra:
+            metadata.update(self.extra)
+        return metadata
+
+    def __getitem__(self, key: str):
+        if key == "metadata":
+            return self.metadata
+        if key in self._KEYS:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __setitem__(self, key: str, value):
+        if key == "metadata":
+            self.set_metadata(value)
+        elif key in self._KEYS:
+            setattr(self, key, _intern(value) if key == "knowledge_type" else value)
+        else:
+            raise KeyError(key)
+
+    def __contains__(self, key: str) -> bool:
+        return key == "metadata" or key in self._KEYS
+
+    def get(self, key: str, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "content": self.content,
+            "content_hash": self.content_hash,
+            "embedding": self.embedding.tolist(),
+            "knowledge_type": self.knowledge_type,
+            "metadata": self.metadata,
+        }
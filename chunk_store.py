@@ -0,0 +1,858 @@
+import hashlib
+import json
+import logging
+import sys
+import threading
+import time
+from bisect import bisect_right
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from catalog import decode_cursor, encode_cursor
+from chunk_records import ChunkRecord
+from config import SHARED_STORE_POLL_SECONDS, catalog, current_config, vector_segment
+from data_persistence import load_chunk_refs, load_kb_version, load_uploaded_files, load_vectors
+from store_stats import KnowledgeStats
+
+logger = logging.getLogger("medical_ai_agent")
+
+# Serializes changes to the chunk store.
+store_lock = threading.Lock()
+
+# Tombstoned records are compacted away in the background once they make up
+# this share of the store (and at least COMPACTION_MIN_GARBAGE records).
+COMPACTION_GARBAGE_RATIO = 0.25
+COMPACTION_MIN_GARBAGE = 256
+
+# After a compaction, the vector segment is rewritten once vectors of deleted
+# chunks make up this share of it.
+SEGMENT_COMPACTION_GARBAGE_RATIO = 0.5
+
+_LIVE = sys.maxsize
+
+
+class KnowledgeSnapshot:
+    """Read-only view of the store as published at one version.
+
+    Taking a snapshot is O(1) and never waits for writers. It keeps seeing
+    the records of its version while later versions are published, and the
+    slot lists it holds stay alive until the last snapshot using them is
+    dropped, even if a compaction replaced them meanwhile.
+    """
+
+    __slots__ = ("epoch", "version", "_docs", "_added", "_deleted", "_slots", "_count")
+
+    def __init__(self, state: tuple):
+        self.epoch, self.version, self._docs, self._added, self._deleted, self._slots, self._count = state
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __contains__(self, content_hash: str) -> bool:
+        return self.get(content_hash) is not None
+
+    def get(self, content_hash: str) -> Optional[ChunkRecord]:
+        """Return the record with this content hash live at this version.
+
+        A hash re-published with new contents after the snapshot was taken
+        reads as missing.
+        """
+        slot = self._slots.get(content_hash)
+        if slot is not None and self._added[slot] <= self.epoch < self._deleted[slot]:
+            return self._docs[slot]
+        return None
+
+    def documents(self) -> Iterator[ChunkRecord]:
+        epoch = self.epoch
+        for doc, added_in, deleted_in in zip(self._docs, self._added, self._deleted):
+            if added_in <= epoch < deleted_in:
+                yield doc
+
+    def added_since(self, epoch: int) -> List[ChunkRecord]:
+        """Records live in this snapshot that were added after ``epoch``.
+
+        Slots are appended in epoch order, so this costs O(log n) plus the
+        slots added since.
+        """
+        added = self._added
+        records = []
+        for slot in range(bisect_right(added, epoch), len(added)):
+            if added[slot] > self.epoch:
+                break
+            if self._deleted[slot] > self.epoch:
+                records.append(self._docs[slot])
+        return records
+
+
+class KnowledgeStore:
+    """Owner of the stored chunk records (``ChunkRecord``) and their embeddings.
+
+    Records sit in append-only slots that carry the epoch they were added in
+    and the epoch they were deleted in. A reader takes a ``snapshot()`` when
+    it starts and sees exactly the records live at its epoch. ``publish``
+    stamps additions and tombstones with the next epoch and then switches to
+    it, so a delete costs O(records deleted), searches skip deleted records at
+    once and a file replacement becomes visible in a single step. Records are
+    never changed in place: an update tombstones the old record and adds a
+    changed copy. Tombstoned slots are dropped by a background compaction.
+
+    Every publish also advances ``version``, the knowledge-base version used
+    in cache keys; it changes in the same step as the records, so a snapshot's
+    version always names the records it sees.
+
+    A store created with ``ready=False`` is "cold" until ``mark_ready()``;
+    ``status`` tracks the background load meanwhile. ``on_compact`` is called
+    after each compaction.
+    """
+
+    def __init__(self, documents: Iterable[Dict[str, Any]] = (), ready: bool = True, version: int = 0,
+                 on_compact: Optional[Callable[[], None]] = None):
+        self._write_lock = threading.Lock()
+        self._compacting = False
+        self._on_compact = on_compact
+        self._settled = threading.Event()  # ready or failed
+        self.status: Dict[str, Any] = {"state": "cold"}
+        self.stats = KnowledgeStats()
+        self._state = (0, version, [], [], [], {}, 0)
+        self.load(documents, version)
+        if ready:
+            self.mark_ready()
+
+    def load(self, documents: Iterable[Dict[str, Any]], version: Optional[int] = None):
+        """Replace the contents; records must have distinct content hashes.
+
+        The version is set to ``version``, or advanced if it is None.
+        """
+        with self._write_lock:
+            docs = [ChunkRecord.of(doc) for doc in documents]
+            slots = {doc["content_hash"]: i for i, doc in enumerate(docs)}
+            if version is None:
+                version = self._state[1] + 1
+            # epochs keep counting across loads, so an epoch names one set of
+            # records for the life of the process
+            epoch = self._state[0] + 1
+            # (epoch, version, records, added-in epochs, deleted-in epochs,
+            #  hash -> slot, live count), swapped as one tuple so readers
+            # always see a consistent set
+            self._state = (epoch, version, docs, [epoch] * len(docs), [_LIVE] * len(docs), slots, len(docs))
+            self._garbage = 0
+            self.stats.reset()
+            for doc in docs:
+                self.stats.chunk_added(doc)
+
+    def mark_ready(self):
+        self.status["state"] = "ready"
+        self._settled.set()
+
+    def mark_failed(self, error: str):
+        self.status.update(state="failed", error=error)
+        self._settled.set()
+
+    @property
+    def ready(self) -> bool:
+        return self.status["state"] == "ready"
+
+    def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        """Block until loading finished; True if the store is usable."""
+        self._settled.wait(timeout)
+        return self.ready
+
+    def loading_status(self) -> Dict[str, Any]:
+        """Copy of the load status with the elapsed time and record count."""
+        status = dict(self.status)
+        if "started" in status:
+            status["seconds"] = round(status.get("finished", time.time()) - status["started"], 2)
+        status["documents"] = len(self)
+        return status
+
+    def snapshot(self) -> KnowledgeSnapshot:
+        """The current version, for a reader to hold while it works."""
+        return KnowledgeSnapshot(self._state)
+
+    @property
+    def epoch(self) -> int:
+        return self._state[0]
+
+    @property
+    def version(self) -> int:
+        return self._state[1]
+
+    @property
+    def garbage(self) -> int:
+        """Number of tombstoned slots waiting for compaction."""
+        return self._garbage
+
+    def __len__(self) -> int:
+        return self._state[6]
+
+    def __contains__(self, content_hash: str) -> bool:
+        return self.get(content_hash) is not None
+
+    def get(self, content_hash: str) -> Optional[ChunkRecord]:
+        """Return the live record with this content hash, if any."""
+        return self.snapshot().get(content_hash)
+
+    def documents(self) -> Iterator[ChunkRecord]:
+        """Iterate over the records live when iteration starts."""
+        return self.snapshot().documents()
+
+    def list_documents(self) -> List[ChunkRecord]:
+        return list(self.documents())
+
+    def publish(self, added: List[Dict[str, Any]], removed: Iterable[str], version: Optional[int] = None) -> int:
+        """Add records and tombstone records by hash as one visible change.
+
+        A hash may be in both to replace its record. The version becomes
+        ``version``, or advances if it is None; it is returned.
+        """
+        new_version = version
+        with self._write_lock:
+            epoch, version, docs, added_in, deleted_in, slots, count = self._state
+            next_epoch = epoch + 1
+            for content_hash in removed:
+                slot = slots.get(content_hash)
+                if slot is not None and deleted_in[slot] == _LIVE:
+                    deleted_in[slot] = next_epoch
+                    self._garbage += 1
+                    count -= 1
+                    self.stats.chunk_removed(docs[slot])
+            for doc in map(ChunkRecord.of, added):
+                # epochs first: readers zip the lists and stop at the shortest
+                added_in.append(next_epoch)
+                deleted_in.append(_LIVE)
+                docs.append(doc)
+                slots[doc["content_hash"]] = len(docs) - 1
+                count += 1
+                self.stats.chunk_added(doc)
+            version = version + 1 if new_version is None else new_version
+            self._state = (next_epoch, version, docs, added_in, deleted_in, slots, count)
+        self._maybe_compact()
+        return version
+
+    def bump_version(self, version: Optional[int] = None) -> int:
+        """Set or advance the version without changing records (e.g. a new embedding model)."""
+        with self._write_lock:
+            state = self._state
+            version = state[1] + 1 if version is None else version
+            self._state = (state[0], version) + state[2:]
+            return version
+
+    def _maybe_compact(self):
+        # checked and set under the lock: concurrent publishes start one compaction
+        with self._write_lock:
+            if self._compacting or self._garbage < max(COMPACTION_MIN_GARBAGE,
+                                                       COMPACTION_GARBAGE_RATIO * len(self._state[2])):
+                return
+            self._compacting = True
+        threading.Thread(target=self.compact, name="knowledge-store-compaction", daemon=True).start()
+
+    def compact(self):
+        """Copy the live records into fresh slot lists and drop tombstones.
+
+        Snapshots holding the previous lists keep reading them undisturbed.
+        """
+        try:
+            with self._write_lock:
+                epoch, version, docs, added_in, deleted_in, _, _ = self._state
+                keep = [i for i, deleted in enumerate(deleted_in) if deleted == _LIVE]
+                dropped = len(docs) - len(keep)
+                live = [docs[i] for i in keep]
+                slots = {doc["content_hash"]: i for i, doc in enumerate(live)}
+                self._state = (epoch, version, live, [added_in[i] for i in keep], [_LIVE] * len(keep),
+                               slots, len(live))
+                self._garbage = 0
+            if dropped:
+                logger.info(f"🧹 知识库压缩完成，清理 {dropped} 个已删除分块")
+            if self._on_compact is not None:
+                try:
+                    self._on_compact()
+                except Exception as e:
+                    logger.error(f"❌ 压缩后的清理失败: {e}")
+        finally:
+            with self._write_lock:
+                self._compacting = False
+
+
+def normalize_chunk(text: str) -> str:
+    """Collapse whitespace so formatting-only differences hash the same."""
+    return " ".join(text.split())
+
+
+def chunk_hash(text: str) -> str:
+    """Content address of a chunk: sha256 of its normalized text."""
+    return hashlib.sha256(normalize_chunk(text).encode("utf-8")).hexdigest()
+
+
+def find_chunk(content_hash: str) -> Optional[ChunkRecord]:
+    """Return the stored chunk with this hash, if any."""
+    return store.get(content_hash)
+
+
+def chunk_knowledge_types(doc: Dict[str, Any]) -> Set[str]:
+    """All knowledge types under which a chunk was uploaded."""
+    return getattr(doc, "types", None) or {doc["knowledge_type"]}
+
+
+def find_file_by_hash(sha256: Optional[str]) -> Optional[Dict[str, Any]]:
+    """Return the metadata of an uploaded file with this content hash."""
+    return catalog.find_file_by_hash(sha256) if sha256 else None
+
+
+def get_file_info(filename: str) -> Optional[Dict[str, Any]]:
+    """Return the metadata of an uploaded file by its stored filename."""
+    return catalog.get_file(filename)
+
+
+def find_file(name: str) -> Optional[Dict[str, Any]]:
+    """Return the metadata of an uploaded file by stored or original name."""
+    return catalog.find_file(name)
+
+
+def list_files(knowledge_type: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Uploaded files in upload order, optionally of one knowledge type."""
+    return catalog.list_files(knowledge_type)
+
+
+def query_files(**filters) -> Tuple[List[Dict[str, Any]], Optional[str], int]:
+    """One page of uploaded files; see ``KnowledgeCatalog.query_files``."""
+    return catalog.query_files(**filters)
+
+
+def update_file_info(filename: str, **fields) -> bool:
+    """Update and persist metadata fields of an uploaded file."""
+    with store_lock, catalog.transaction() as conn:
+        file_info = catalog.get_file(filename)
+        if file_info is None:
+            return False
+        file_info.update(fields)
+        catalog.put_file(conn, file_info)
+    return True
+
+
+def require_ready():
+    """Wait until the store has loaded; raise if loading failed."""
+    if not store.wait_ready():
+        raise RuntimeError(f"知识库加载失败: {store.status.get('error')}")
+
+
+def _store_vectors(conn, docs: Iterable[Dict[str, Any]]):
+    """Append the embeddings of new chunks to the shared segment and record
+    them with the chunk text in the catalog."""
+    docs = list(docs)
+    segment = _current_segment()
+    placed = vector_segment.append((doc["embedding"] for doc in docs), segment)
+    catalog.put_vectors(conn, [(doc["content_hash"], doc["content"], offset, dimension, segment)
+                               for doc, (offset, dimension) in zip(docs, placed)])
+
+
+def _current_segment() -> int:
+    """Number of the vector segment new embeddings are appended to."""
+    return int(catalog.get_meta("vector_segment_id") or 0)
+
+
+def _load_records(hashes: Optional[Iterable[str]] = None) -> List[ChunkRecord]:
+    """Chunk records as stored in the catalog and vector segment; all of them
+    or those of ``hashes``."""
+    if hashes is None:
+        # the records are all replaced: map the segment afresh, in one extent
+        vector_segment.release(_current_segment())
+    else:
+        hashes = list(hashes)
+    types: Dict[str, Set[str]] = {}
+    for content_hash, knowledge_type in catalog.ref_types(hashes):
+        types.setdefault(content_hash, set()).add(knowledge_type)
+    records = []
+    for row in catalog.chunk_rows(hashes):
+        content_hash, doc_id, knowledge_type, metadata, content, offset, dimension, segment = row
+        record = ChunkRecord(doc_id, content, content_hash, knowledge_type,
+                             vector_segment.read(offset, dimension, segment), json.loads(metadata))
+        record.types = frozenset(types.get(content_hash, ())) or None
+        records.append(record)
+    return records
+
+
+def _apply_shared_config():
+    config = catalog.get_meta("config")
+    if config:
+        current_config.update(json.loads(config))
+
+
+def _apply_changes() -> bool:
+    """Apply the changes other workers logged since the store's version.
+
+    The caller holds ``store_lock``. Returns True if anything changed.
+    """
+    changes = catalog.changes_since(store.version)
+    if changes is None:
+        # this worker fell behind the retained log; reload everything
+        logger.info("🔄 变更日志已截断，从目录重新加载知识库")
+        _reload(catalog.generation())
+        _apply_shared_config()
+        return True
+    if not changes:
+        return False
+    kinds = {kind for _, kind, _ in changes}
+    if "segment" in kinds:
+        # the vectors moved to a compacted segment; reload so no record views the retired one
+        _reload(changes[-1][0])
+    else:
+        hashes = {key for _, kind, key in changes if kind == "chunk"}
+        # re-read every touched chunk: present rows replace the record, missing ones are deletes
+        store.publish(_load_records(hashes), hashes, changes[-1][0])
+        if "file" in kinds:
+            store.stats.load_files(catalog.list_files())
+    if "config" in kinds:
+        _apply_shared_config()
+    return True
+
+
+def _reload(generation: int):
+    store.load(_load_records(), generation)
+    store.stats.load_files(catalog.list_files())
+
+
+def compact_vector_segment(garbage_ratio: float = SEGMENT_COMPACTION_GARBAGE_RATIO) -> bool:
+    """Copy the live vectors into the next segment file once vectors of
+    deleted chunks make up ``garbage_ratio`` of the current one.
+
+    The catalog offsets move to the copy in the same transaction, and every
+    worker reloads its records from it through the change log. The segment
+    replaced by the previous compaction is deleted; the one replaced now is
+    kept until then, for workers still reading offsets looked up before the
+    switch. Returns True if the segment was rewritten.
+    """
+    with store_lock:
+        with catalog.transaction() as conn:
+            _apply_changes()
+            segment = _current_segment()
+            size = vector_segment.size(segment)
+            if not size or size - catalog.segment_floats(segment) < garbage_ratio * size:
+                return False
+            rows = catalog.vector_rows()
+            placed = vector_segment.write_segment(
+                segment + 1, (vector_segment.read(offset, dimension, old) for _, offset, dimension, old in rows))
+            catalog.move_vectors(conn, [(offset, segment + 1, row[0]) for row, (offset, _) in zip(rows, placed)])
+            catalog.set_meta(conn, "vector_segment_id", str(segment + 1))
+            generation = catalog.log_change(conn, [("segment", str(segment + 1))])
+        _reload(generation)
+    for retired in range(segment):
+        vector_segment.drop_segment(retired)
+    vector_segment.release(segment)
+    logger.info(f"🧹 向量段压缩完成: {size} -> {vector_segment.size(segment + 1)} 个浮点数")
+    return True
+
+
+def _change_entries(staged: Dict[str, ChunkRecord], removed: Iterable[str],
+                    filenames: Iterable[str]) -> List[Tuple[str, str]]:
+    return ([("chunk", content_hash) for content_hash in set(staged) | set(removed)]
+            + [("file", filename) for filename in filenames])
+
+
+def sync_changes() -> bool:
+    """Pick up uploads, deletes and configuration changes of other worker processes."""
+    if not store.ready:
+        return False
+    with store_lock:
+        return _apply_changes()
+
+
+def advance_version(config: Optional[Dict[str, Any]] = None) -> int:
+    """Advance the knowledge-base version in every worker without changing
+    records; with ``config``, also share that configuration with them."""
+    with store_lock:
+        with catalog.transaction() as conn:
+            _apply_changes()
+            if config is not None:
+                catalog.set_meta(conn, "config", json.dumps(config, ensure_ascii=False))
+            generation = catalog.log_change(conn, [("config", None)] if config is not None else [])
+        return store.bump_version(generation)
+
+
+def migrate_legacy_catalog(files: List[Dict[str, Any]], refs: Dict[str, List[Dict[str, Any]]]) -> bool:
+    """Copy the JSON file list and reference table into an empty catalog once."""
+    with catalog.transaction() as conn:
+        # checked inside the transaction: workers starting together migrate once
+        if catalog.get_meta("legacy_migrated"):
+            return False
+        for file_info in files:
+            catalog.put_file(conn, file_info)
+        catalog.add_refs(conn, ({"content_hash": content_hash, **ref}
+                                for content_hash, file_refs in refs.items() for ref in file_refs))
+        catalog.set_meta(conn, "legacy_migrated", "1")
+    return bool(files or refs)
+
+
+def rebuild_index(documents: Optional[Iterable[Dict[str, Any]]] = None, version: Optional[int] = None) -> bool:
+    """Load ``documents`` (default: the current records) into the store at
+    ``version``, indexed by hash, and reconcile the catalog with them.
+
+    Chunks stored before content addressing have no ``content_hash`` and no
+    reference entries; they are hashed, merged and linked to the uploaded
+    files whose original name matches their ``source_file``. Embeddings not
+    yet in the shared vector segment are appended to it. Catalog rows of
+    chunks missing from ``documents`` are dropped. Returns True if the
+    records changed.
+    """
+    changed = False
+    unique: Dict[str, ChunkRecord] = {}
+    for doc in store.list_documents() if documents is None else documents:
+        content_hash = doc.get("content_hash")
+        if content_hash is None:
+            content_hash = doc["content_hash"] = chunk_hash(doc["content"])
+            changed = True
+        if content_hash in unique:
+            changed = True
+        else:
+            # a copy, since the current records may still be read
+            unique[content_hash] = ChunkRecord.of(doc).copy()
+
+    with catalog.transaction() as conn:
+        referenced = {content_hash for content_hash, _ in catalog.ref_types()}
+        cataloged = set(catalog.chunk_hashes())
+        vectored = set(catalog.vector_hashes())
+        _store_vectors(conn, [doc for content_hash, doc in unique.items() if content_hash not in vectored])
+        catalog.set_meta(conn, "vector_segment", "1")
+        new_refs = []
+        for content_hash, doc in unique.items():
+            if content_hash not in cataloged:
+                catalog.put_chunk(conn, doc)
+            if content_hash in referenced:
+                continue
+            metadata = doc.get("metadata", {})
+            source = metadata.get("source_file", "")
+            filenames = [f["filename"] for f in catalog.files_named(source)] or [source]
+            new_refs.extend({"content_hash": content_hash, "file": filename,
+                             "chunk_index": metadata.get("chunk_index", 0),
+                             "knowledge_type": doc["knowledge_type"]} for filename in filenames)
+        catalog.add_refs(conn, new_refs)
+        stale = (referenced | cataloged) - set(unique)
+        catalog.delete_chunks(conn, stale)
+
+    types: Dict[str, Set[str]] = {}
+    for content_hash, knowledge_type in catalog.ref_types():
+        types.setdefault(content_hash, set()).add(knowledge_type)
+    for content_hash, doc in unique.items():
+        doc.types = frozenset(types.get(content_hash, ())) or None
+    store.load(unique.values(), version)
+    return changed
+
+
+def _staged(staged: Dict[str, ChunkRecord], content_hash: str) -> Optional[ChunkRecord]:
+    """The record of a hash as changed so far in the current update."""
+    return staged.get(content_hash) or store.get(content_hash)
+
+
+def _restored(record: ChunkRecord, file_info: Dict[str, Any], chunk_index: int,
+              location: Dict[str, Any]) -> ChunkRecord:
+    """Copy of a reused record, owned by ``file_info``, to store again."""
+    doc = record.copy()
+    metadata = {k: v for k, v in record.metadata.items() if k != "page"}
+    metadata.update(source_file=file_info["original_name"], title=file_info.get("title"),
+                    upload_time=file_info.get("upload_time"), chunk_index=chunk_index, **location)
+    doc["knowledge_type"] = file_info["knowledge_type"]
+    doc.types = None
+    doc.set_metadata(metadata)
+    return doc
+
+
+def _attach_file(conn, file_info: Dict[str, Any], refs: Iterable[Tuple[str, int, Dict[str, Any]]],
+                 new_chunks: Iterable[Dict[str, Any]], staged: Dict[str, ChunkRecord],
+                 reused: Optional[Dict[str, ChunkRecord]] = None) -> Tuple[int, int]:
+    """Record a file and its references, staging new records and retyped
+    copies of reused ones in ``staged``; return how many new chunks were
+    staged and how many of the file's chunks were already stored.
+
+    A reused chunk that was deleted since the file was embedded (its other
+    files were removed meanwhile) is stored again from its record in
+    ``reused``; without one the update fails rather than refer to nothing.
+    """
+    filename = file_info["filename"]
+    knowledge_type = file_info["knowledge_type"]
+    refs = list(refs)
+    new_chunks = list(new_chunks)
+    pending = {doc["content_hash"] for doc in new_chunks}
+    for content_hash, chunk_index, location in refs:
+        if content_hash in pending or _staged(staged, content_hash) is not None:
+            continue
+        record = (reused or {}).get(content_hash)
+        if record is None:
+            raise RuntimeError(f"文件 {filename} 引用的分块 {content_hash[:12]} 已被删除，请重新入库")
+        new_chunks.append(_restored(record, file_info, chunk_index, location))
+        pending.add(content_hash)
+    added = []
+    for doc in new_chunks:
+        if _staged(staged, doc["content_hash"]) is not None:
+            continue
+        catalog.put_chunk(conn, doc)
+        staged[doc["content_hash"]] = ChunkRecord.of(doc)
+        added.append(doc)
+    _store_vectors(conn, added)
+    rows = [{"content_hash": content_hash, "file": filename, "chunk_index": chunk_index,
+             "knowledge_type": knowledge_type, **location} for content_hash, chunk_index, location in refs]
+    hashes = {row["content_hash"] for row in rows}
+    shared = sum(1 for content_hash in hashes if store.get(content_hash) is not None)
+    catalog.add_refs(conn, rows)
+    catalog.put_file(conn, file_info)
+    for content_hash in hashes:
+        doc = _staged(staged, content_hash)
+        if doc is not None and knowledge_type not in (doc.types or ()):
+            doc = doc.copy()
+            doc.types = frozenset(chunk_knowledge_types(doc) | {knowledge_type})
+            staged[content_hash] = doc
+    return len(added), shared
+
+
+def _detach_file(conn, filename: str, staged: Dict[str, ChunkRecord]) -> Optional[Tuple[Dict[str, Any], Set[str]]]:
+    """Drop a file and its references, staging updated copies of the chunks
+    it shares; return its metadata and the hashes of chunks no other file
+    references any more."""
+    file_info = catalog.get_file(filename)
+    if file_info is None:
+        return None
+    hashes = catalog.file_hashes(filename)
+    catalog.delete_refs(conn, filename)
+    catalog.delete_file(conn, filename)
+
+    orphaned = set()
+    for content_hash in hashes:
+        refs = catalog.hash_refs(content_hash)
+        if not refs:
+            staged.pop(content_hash, None)
+            orphaned.add(content_hash)
+            continue
+        doc = _staged(staged, content_hash)
+        types = frozenset(ref["knowledge_type"] for ref in refs)
+        owned = doc is not None and doc["metadata"].get("source_file") == file_info.get("original_name")
+        if doc is None or (not owned and types == doc.types):
+            continue
+        doc = doc.copy()
+        doc.types = types
+        if owned:
+            ref = refs[0]
+            owner = catalog.get_file(ref["file"]) or {}
+            metadata = doc.metadata
+            metadata["source_file"] = owner.get("original_name", ref["file"])
+            metadata["chunk_index"] = ref["chunk_index"]
+            metadata.pop("page", None)
+            if "page" in ref:
+                metadata["page"] = ref["page"]
+            doc["knowledge_type"] = ref["knowledge_type"]
+            doc.set_metadata(metadata)
+            catalog.put_chunk(conn, doc)
+        staged[content_hash] = doc
+    catalog.delete_chunks(conn, orphaned)
+    return file_info, orphaned
+
+
+def _publish(staged: Dict[str, ChunkRecord], removed: Set[str], generation: int):
+    """Publish staged records as ``generation``, replacing stored ones with the same hash."""
+    store.publish(list(staged.values()), removed | {h for h in staged if h in store}, generation)
+
+
+def add_file(file_info: Dict[str, Any], refs: Iterable[Tuple[str, int, Dict[str, Any]]],
+             new_chunks: Iterable[Dict[str, Any]],
+             reused: Optional[Dict[str, ChunkRecord]] = None) -> Dict[str, int]:
+    """Publish an ingested file: its new chunk records and its chunk references.
+
+    ``refs`` lists ``(content_hash, chunk_index, location)`` for every chunk
+    position in the file, where ``location`` holds extra reference fields such
+    as the PDF page; ``new_chunks`` are records for hashes that were not stored when
+    the file was embedded. A hash stored meanwhile by another upload is
+    reused instead of stored twice. ``reused`` holds the stored records the
+    file's other hashes were found as, to store again if they were deleted
+    meanwhile.
+    """
+    require_ready()
+    staged: Dict[str, ChunkRecord] = {}
+    with store_lock:
+        with catalog.transaction() as conn:
+            _apply_changes()
+            # set when a job taken over from a stalled worker stores the file again
+            previous = catalog.get_file(file_info["filename"])
+            added, shared = _attach_file(conn, file_info, refs, new_chunks, staged, reused)
+            generation = catalog.log_change(conn, _change_entries(staged, (), [file_info["filename"]]))
+        _publish(staged, set(), generation)
+        if previous is not None:
+            store.stats.file_removed(previous)
+        store.stats.file_added(file_info)
+    return {"chunks_added": added, "chunks_reused": shared}
+
+
+def replace_file(old_filename: str, file_info: Dict[str, Any],
+                 refs: Iterable[Tuple[str, int, Dict[str, Any]]],
+                 new_chunks: Iterable[Dict[str, Any]],
+                 reused: Optional[Dict[str, ChunkRecord]] = None) -> Dict[str, int]:
+    """Atomically swap a file for its new version.
+
+    Chunks whose hash is in both versions are kept as they are, chunks only in
+    the new version are added and chunks only the old version referenced are
+    removed, all in one publish step. ``reused`` is as for ``add_file``.
+    """
+    refs = list(refs)
+    new_hashes = {content_hash for content_hash, _, _ in refs}
+    require_ready()
+    staged: Dict[str, ChunkRecord] = {}
+    with store_lock:
+        with catalog.transaction() as conn:
+            _apply_changes()
+            # read under the write lock, so no other change to the file falls in between
+            old_hashes = set(catalog.file_hashes(old_filename))
+            added, shared = _attach_file(conn, file_info, refs, new_chunks, staged, reused)
+            detached = _detach_file(conn, old_filename, staged)
+            orphaned = detached[1] if detached else set()
+            generation = catalog.log_change(
+                conn, _change_entries(staged, orphaned, [file_info["filename"], old_filename]))
+        _publish(staged, orphaned, generation)
+        store.stats.file_added(file_info)
+        if detached:
+            store.stats.file_removed(detached[0])
+    return {
+        "chunks_added": added,
+        "chunks_reused": shared,
+        "chunks_unchanged": len(old_hashes & new_hashes),
+        "chunks_new": len(new_hashes - old_hashes),
+        "chunks_dropped": len(old_hashes - new_hashes),
+        "chunks_removed": len(orphaned),
+    }
+
+
+def remove_file(filename: str) -> Optional[Tuple[Dict[str, Any], int]]:
+    """Remove a file and the chunks no other file references.
+
+    Returns ``(file_info, deleted_chunks)`` or None if the file is unknown.
+    Shared chunks stay; their metadata is pointed at a remaining file.
+    """
+    require_ready()
+    staged: Dict[str, ChunkRecord] = {}
+    with store_lock:
+        with catalog.transaction() as conn:
+            _apply_changes()
+            detached = _detach_file(conn, filename, staged)
+            if detached is None:
+                return None
+            file_info, orphaned = detached
+            generation = catalog.log_change(conn, _change_entries(staged, orphaned, [filename]))
+        _publish(staged, orphaned, generation)
+        store.stats.file_removed(file_info)
+    return file_info, len(orphaned)
+
+
+def get_file_chunks(filename: str) -> List[Tuple[Dict[str, Any], Dict[str, Any]]]:
+    """Return ``(chunk, reference)`` pairs of a file in chunk order."""
+    pairs = []
+    for ref in catalog.file_refs(filename):
+        doc = store.get(ref["content_hash"])
+        if doc is not None:
+            pairs.append((doc, ref))
+    return pairs
+
+
+def get_file_chunks_page(filename: str, cursor: Optional[str] = None,
+                         limit: int = 50) -> Tuple[List[Tuple[ChunkRecord, Dict[str, Any]]], Optional[str]]:
+    """One page of ``get_file_chunks`` in ``chunk_index`` order.
+
+    Returns the pairs and the cursor of the next page (None on the last page).
+    Raises ValueError for a malformed cursor.
+    """
+    after_index = None
+    if cursor:
+        values = decode_cursor(cursor)
+        if not (isinstance(values, list) and len(values) == 1 and isinstance(values[0], int)):
+            raise ValueError(f"无效的分页游标: {cursor}")
+        after_index = values[0]
+    refs = catalog.file_refs_page(filename, after_index, limit)
+    pairs = []
+    for ref in refs:
+        doc = store.get(ref["content_hash"])
+        if doc is not None:
+            pairs.append((doc, ref))
+    next_cursor = encode_cursor([refs[-1]["chunk_index"]]) if len(refs) == limit else None
+    return pairs, next_cursor
+
+
+def file_chunk_summary(filename: str) -> Dict[str, Any]:
+    """Chunk count, knowledge types, embedding dimension and average chunk length of a file."""
+    summary = catalog.file_ref_summary(filename)
+    docs = [doc for doc in map(store.get, catalog.file_hashes(filename)) if doc is not None]
+    summary["embedding_dimension"] = len(docs[0].embedding) if docs else 0
+    summary["avg_chunk_length"] = sum(len(doc.content) for doc in docs) / len(docs) if docs else 0
+    return summary
+
+
+# The single owner of chunk records; every module searches through it.
+# It starts cold and is filled by start_loading().
+store = KnowledgeStore(ready=False, on_compact=lambda: compact_vector_segment())
+_loader_lock = threading.Lock()
+
+
+def load_knowledge_base():
+    """Read the stored chunk records, reconcile the catalog and mark the store ready."""
+    status = store.status
+    status.update(state="loading", phase="reading", started=time.time(), bytes_read=0, bytes_total=0)
+    try:
+        if catalog.get_meta("vector_segment"):
+            # the catalog and the shared vector segment hold every record
+            status["phase"] = "indexing"
+            generation = catalog.generation()
+            store.load(_load_records(), generation)
+        else:
+            # first start: import the JSON vector file into the shared store
+            documents = load_vectors(lambda read, total: status.update(bytes_read=read, bytes_total=total))
+            status["phase"] = "indexing"
+            uploaded_files = load_uploaded_files()
+            if migrate_legacy_catalog(uploaded_files, load_chunk_refs()):
+                logger.info(f"🗂️ 已将 {len(uploaded_files)} 个文件记录迁移到SQLite目录")
+            with catalog.transaction() as conn:
+                if catalog.get_meta("generation") is None:
+                    # continue the version numbering of the old kb_version file
+                    catalog.set_meta(conn, "generation", str(load_kb_version()))
+            if rebuild_index(documents, catalog.generation()):
+                logger.info(f"🔗 已为 {len(store)} 个唯一分块建立内容哈希索引")
+            if len(store):
+                logger.info(f"🗄️ 已将 {len(store)} 个分块向量写入共享向量段")
+        _apply_shared_config()
+    except Exception as e:
+        status["finished"] = time.time()
+        store.mark_failed(str(e))
+        logger.error(f"❌ 知识库加载失败: {e}")
+        return
+    store.stats.load_files(catalog.list_files())
+    status.pop("phase", None)
+    status["finished"] = time.time()
+    store.mark_ready()
+    logger.info(f"📚 知识库加载完成: {len(store)} 个分块，耗时 {status['finished'] - status['started']:.2f}秒")
+
+
+def start_loading() -> bool:
+    """Load the knowledge base in a background thread; returns False if already started."""
+    with _loader_lock:
+        if store.status["state"] != "cold":
+            return False
+        store.status["state"] = "loading"
+    threading.Thread(target=load_knowledge_base, name="knowledge-store-loader", daemon=True).start()
+    return True
+
+
+def _sync_loop(interval: float):
+    if not store.wait_ready():
+        return
+    while True:
+        time.sleep(interval)
+        try:
+            sync_changes()
+        except Exception as e:
+            logger.error(f"❌ 同步其他进程的知识库变更失败: {e}")
+
+
+_sync_started = False
+
+
+def start_sync(interval: float = SHARED_STORE_POLL_SECONDS) -> bool:
+    """Poll the catalog's change log in a background thread once the store is
+    loaded, so changes of other workers show up within ``interval`` seconds."""
+    global _sync_started
+    with _loader_lock:
+        if _sync_started:
+            return False
+        _sync_started = True
+    threading.Thread(target=_sync_loop, args=(interval,), name="knowledge-store-sync", daemon=True).start()
+    return True
@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 
 # Global configuration for LLM and embedding services
@@ -18,10 +19,23 @@ current_config = {
     },
 }
 
-from data_persistence import load_data, save_data
+# Token budget for retrieved knowledge packed into a prompt, per LLM model
+CONTEXT_TOKEN_BUDGETS = {
+    "default": 1500,
+    "gpt-4.1-mini": 3000,
+}
+# Token budget for protocol excerpts sent to quality checks
+QUALITY_CHECK_TOKEN_BUDGET = 1500
+
+from data_persistence import CATALOG_FILE, VECTOR_SEGMENT_FILE
+from catalog import KnowledgeCatalog
+from vector_segment import VectorSegment
 
-# In-memory data stores
-embedded_documents, uploaded_files = load_data()
+# File, chunk and chunk reference catalog (SQLite) and the embedding segment it
+# points into; both are shared by all worker processes. The chunk records are
+# loaded in the background by chunk_store.start_loading().
+catalog = KnowledgeCatalog(CATALOG_FILE)
+vector_segment = VectorSegment(VECTOR_SEGMENT_FILE)
 knowledge_stats = {
     "临床试验方案示例": {"document_count": 5},
     "肿瘤临床指南": {"document_count": 8},
@@ -33,6 +47,49 @@ knowledge_stats = {
 
 generation_history = []
 
+# Maximum number of ingestion jobs processed at the same time; ingestion runs
+# on its own thread pool so it does not compete with interactive requests.
+INGESTION_MAX_CONCURRENT_JOBS = 2
+
+# Jobs are leased to one worker process at a time; the lease is renewed while
+# the job runs, and a job whose worker stopped renewing it is picked up again
+INGESTION_JOB_LEASE_SECONDS = 30
+
+# Progress of a running job is stored at most this often, so the job events
+# stream and throughput figures follow the ingestion closely
+INGESTION_PROGRESS_SAVE_SECONDS = 0.5
+
+# Knowledge chunking: maximum chunk size and overlap, measured in characters
+# ("chars") or estimated tokens ("tokens")
+CHUNK_SIZE = 500
+CHUNK_OVERLAP = 50
+CHUNK_SIZE_UNIT = "chars"
+
+# Document extraction worker processes (None = one per CPU core), per-document
+# time limit in seconds and per-process address-space limit in MB
+EXTRACTION_PROCESSES = None
+EXTRACTION_TIMEOUT_SECONDS = 300
+EXTRACTION_MEMORY_LIMIT_MB = 2048
+# Processes extracting page ranges of one PDF in parallel
+PDF_PAGE_WORKERS = 4
+
+# Server-side directories that bulk ingestion may import from
+BULK_IMPORT_ALLOWED_DIRS = ["imports"]
+# Limits on one bulk import: files, uncompressed bytes per file and in total
+BULK_IMPORT_MAX_FILES = 10000
+BULK_IMPORT_MAX_FILE_BYTES = 512 * 1024 * 1024
+BULK_IMPORT_MAX_TOTAL_BYTES = 4 * 1024 * 1024 * 1024
+
+# API worker processes; they share the catalog and vector segment and pick up
+# each other's uploads, deletes and configuration changes within the poll interval
+API_WORKERS = int(os.environ.get("MED_AGENT_WORKERS", "1"))
+SHARED_STORE_POLL_SECONDS = 1.0
+
+# Processes scoring shards of the embedding matrix in parallel (0 = scan in the
+# request process); only used once the knowledge base has this many vectors
+SEARCH_SHARDS = 0
+SHARDED_SEARCH_MIN_VECTORS = 100000
+
 # Ensure upload directory exists
 UPLOAD_DIR = Path("uploads")
 UPLOAD_DIR.mkdir(exist_ok=True)
@@ -0,0 +1,121 @@
+import re
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from config import current_config, CONTEXT_TOKEN_BUDGETS
+
+# CJK ideographs, kana/hangul and full-width punctuation each cost roughly one
+# token; other text averages about four characters per token.
+_CJK_PATTERN = re.compile(r"[\u3000-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uff00-\uffef]")
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+_SHINGLE_SIZE = 5
+
+# Chunks sharing at least this fraction of shingles with an already packed
+# chunk are treated as redundant (e.g. the overlap between adjacent chunks).
+REDUNDANCY_THRESHOLD = 0.8
+
+# Do not bother appending a truncated chunk smaller than this.
+MIN_PARTIAL_TOKENS = 50
+
+
+def estimate_tokens(text: str) -> int:
+    """Fast CJK-aware token estimate."""
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut text so that its estimated size fits max_tokens."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    cost = 0.0
+    for i, ch in enumerate(text):
+        cost += 1.0 if _CJK_PATTERN.match(ch) else 0.25
+        if cost > max_tokens:
+            return text[:i]
+    return text
+
+
+def get_context_budget(model: Optional[str] = None) -> int:
+    """Return the knowledge-context token budget for an LLM model."""
+    model = model or current_config["llm"]["model"]
+    return CONTEXT_TOKEN_BUDGETS.get(model, CONTEXT_TOKEN_BUDGETS["default"])
+
+
+def _shingles(text: str) -> set:
+    normalized = _WHITESPACE_PATTERN.sub("", text)
+    if len(normalized) <= _SHINGLE_SIZE:
+        return {normalized}
+    return {normalized[i:i + _SHINGLE_SIZE] for i in range(len(normalized) - _SHINGLE_SIZE + 1)}
+
+
+def _default_formatter(index: int, doc: Dict[str, Any], content: str) -> str:
+    return f"【{doc.get('knowledge_type', '')}】\n{content}"
+
+
+def _add_source(sources: List[str], doc: Dict[str, Any]):
+    metadata = doc.get("metadata") or {}
+    title = metadata.get("title") or metadata.get("source_file")
+    if title and title not in sources:
+        sources.append(title)
+
+
+def pack_context(
+    docs: List[Dict[str, Any]],
+    budget: Optional[int] = None,
+    formatter: Callable[[int, Dict[str, Any], str], str] = _default_formatter,
+    separator: str = "\n\n",
+) -> Tuple[str, Dict[str, Any]]:
+    """Pack retrieved chunks into a context string within a token budget.
+
+    Chunks are taken in descending score order; chunks that largely repeat
+    an already packed chunk are skipped, and the last chunk that does not
+    fit whole is truncated. Returns the context and packing metadata,
+    including the titles of the packed chunks' sources in packing order.
+    """
+    budget = get_context_budget() if budget is None else budget
+    separator_tokens = estimate_tokens(separator)
+    ordered = sorted(docs, key=lambda d: d.get("score", 0), reverse=True)
+
+    parts: List[str] = []
+    sources: List[str] = []
+    packed_shingles: List[set] = []
+    used_tokens = 0
+    redundant = 0
+    truncated = 0
+    for doc in ordered:
+        content = doc.get("content", "")
+        if not content:
+            continue
+        shingles = _shingles(content)
+        if any(len(shingles & seen) >= REDUNDANCY_THRESHOLD * len(shingles) for seen in packed_shingles):
+            redundant += 1
+            continue
+        part = formatter(len(parts), doc, content)
+        cost = estimate_tokens(part) + (separator_tokens if parts else 0)
+        if used_tokens + cost > budget:
+            remaining = budget - used_tokens - (separator_tokens if parts else 0)
+            overhead = estimate_tokens(formatter(len(parts), doc, ""))
+            if remaining - overhead >= MIN_PARTIAL_TOKENS:
+                part = formatter(len(parts), doc, truncate_to_tokens(content, remaining - overhead))
+                parts.append(part)
+                _add_source(sources, doc)
+                used_tokens += estimate_tokens(part) + (separator_tokens if len(parts) > 1 else 0)
+                truncated += 1
+            break
+        parts.append(part)
+        _add_source(sources, doc)
+        packed_shingles.append(shingles)
+        used_tokens += cost
+
+    info = {
+        "budget_tokens": budget,
+        "packed_tokens": used_tokens,
+        "chunks_used": len(parts),
+        "chunks_redundant": redundant,
+        "chunks_truncated": truncated,
+        "chunks_available": len(docs),
+        "sources": sources,
+    }
+    return separator.join(parts), info
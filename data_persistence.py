@@ -1,31 +1,82 @@
 import json
 from pathlib import Path
-from typing import List, Dict, Any, Tuple
+from typing import Callable, List, Dict, Any, Optional
 
 DATA_DIR = Path("data")
 DATA_DIR.mkdir(exist_ok=True)
 VECTOR_STORE_FILE = DATA_DIR / "embedded_documents.json"
 UPLOADED_FILES_FILE = DATA_DIR / "uploaded_files.json"
+KB_VERSION_FILE = DATA_DIR / "kb_version"
+INGESTION_JOBS_FILE = DATA_DIR / "ingestion_jobs.json"
+CHUNK_REFS_FILE = DATA_DIR / "chunk_refs.json"
+INGESTION_BATCHES_FILE = DATA_DIR / "ingestion_batches.json"
+CATALOG_FILE = DATA_DIR / "catalog.db"
+VECTOR_SEGMENT_FILE = DATA_DIR / "vectors.seg"
+SEARCH_INDEX_DIR = DATA_DIR / "search_index"
 
-def load_data() -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
-    embedded = []
-    uploaded = []
-    if VECTOR_STORE_FILE.exists():
-        try:
-            with open(VECTOR_STORE_FILE, "r", encoding="utf-8") as f:
-                embedded = json.load(f)
-        except Exception:
-            embedded = []
+# The loaders below read the JSON files that predate the SQLite catalog and the
+# vector segment; they are only used once, to import an existing installation.
+
+VECTOR_READ_BLOCK = 4 * 1024 * 1024
+
+def load_vectors(on_progress: Optional[Callable[[int, int], None]] = None) -> List[Dict[str, Any]]:
+    """Read the vector file, reporting ``(bytes_read, bytes_total)`` as it goes."""
+    if not VECTOR_STORE_FILE.exists():
+        return []
+    try:
+        total = VECTOR_STORE_FILE.stat().st_size
+        parts = []
+        read = 0
+        with open(VECTOR_STORE_FILE, "rb") as f:
+            for part in iter(lambda: f.read(VECTOR_READ_BLOCK), b""):
+                parts.append(part)
+                read += len(part)
+                if on_progress:
+                    on_progress(read, total)
+        return json.loads(b"".join(parts))
+    except Exception:
+        return []
+
+def load_uploaded_files() -> List[Dict[str, Any]]:
     if UPLOADED_FILES_FILE.exists():
         try:
             with open(UPLOADED_FILES_FILE, "r", encoding="utf-8") as f:
-                uploaded = json.load(f)
+                return json.load(f)
+        except Exception:
+            return []
+    return []
+
+def load_kb_version() -> int:
+    if KB_VERSION_FILE.exists():
+        try:
+            return int(KB_VERSION_FILE.read_text(encoding="utf-8").strip() or 0)
+        except Exception:
+            return 0
+    return 0
+
+def load_jobs() -> List[Dict[str, Any]]:
+    if INGESTION_JOBS_FILE.exists():
+        try:
+            with open(INGESTION_JOBS_FILE, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception:
+            return []
+    return []
+
+def load_batches() -> List[Dict[str, Any]]:
+    if INGESTION_BATCHES_FILE.exists():
+        try:
+            with open(INGESTION_BATCHES_FILE, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception:
+            return []
+    return []
+
+def load_chunk_refs() -> Dict[str, List[Dict[str, Any]]]:
+    if CHUNK_REFS_FILE.exists():
+        try:
+            with open(CHUNK_REFS_FILE, "r", encoding="utf-8") as f:
+                return json.load(f)
         except Exception:
-            uploaded = []
-    return embedded, uploaded
-
-def save_data(embedded: List[Dict[str, Any]], uploaded: List[Dict[str, Any]]) -> None:
-    with open(VECTOR_STORE_FILE, "w", encoding="utf-8") as f:
-        json.dump(embedded, f, ensure_ascii=False, indent=2)
-    with open(UPLOADED_FILES_FILE, "w", encoding="utf-8") as f:
-        json.dump(uploaded, f, ensure_ascii=False, indent=2)
+            return {}
+    return {}
\ No newline at end of file
@@ -0,0 +1,141 @@
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+logger = logging.getLogger("medical_ai_agent")
+
+# This module is imported by the extraction child processes, so it must not
+# import config (which loads the whole knowledge base); the parsers are
+# imported only where they are used.
+
+# CPU-bound formats extracted out of process; plain text is read inline.
+PROCESS_EXTRACTED_SUFFIXES = {'.pdf', '.docx', '.xlsx', '.xls'}
+
+
+class ExtractionError(RuntimeError):
+    """Raised when a document cannot be extracted in its worker process."""
+
+
+class ExtractionTimeout(ExtractionError):
+    """Raised when a document exceeds the per-document time limit."""
+
+
+def _limit_memory(memory_limit_mb: Optional[int]):
+    if not memory_limit_mb:
+        return
+    try:
+        import resource
+    except ImportError:
+        return
+    limit = memory_limit_mb * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _in_own_session(worker, *args):
+    """Child process entry point: run ``worker`` as the leader of a new
+    process group, so a timeout kills the page workers it starts as well."""
+    if hasattr(os, "setsid"):
+        os.setsid()
+    worker(*args)
+
+
+def _extraction_worker(path: str, filename: str, out_path: str, memory_limit_mb: Optional[int],
+                       pdf_workers: int = 1):
+    """Write extracted segments as JSON lines.
+
+    The address-space limit applies to each process separately, so when PDF
+    pages are extracted by ``pdf_workers`` processes the limit is split
+    between them and this one; the page workers inherit their share.
+    """
+    processes = pdf_workers + 1 if pdf_workers > 1 and Path(filename).suffix.lower() == ".pdf" else 1
+    with open(out_path, "w", encoding="utf-8") as out:
+        try:
+            _limit_memory(memory_limit_mb and max(1, memory_limit_mb // processes))
+            from file_utils import iter_segments_from_path
+            for text, metadata in iter_segments_from_path(Path(path), filename, pdf_workers=pdf_workers):
+                out.write(json.dumps({"text": text, "meta": metadata}, ensure_ascii=False) + "\n")
+        except MemoryError:
+            out.write(json.dumps({"error": f"超出内存上限 {memory_limit_mb} MB"}, ensure_ascii=False) + "\n")
+        except Exception as e:
+            out.write(json.dumps({"error": str(e)}, ensure_ascii=False) + "\n")
+
+
+class ExtractionExecutor:
+    """Runs CPU-bound document extraction in separate processes.
+
+    At most ``max_workers`` documents are extracted at once, each in its own
+    short-lived process, so a pathological file can be killed on timeout or
+    stopped by its address-space limit without affecting the API process or
+    the other extractions. Segments are handed back through a JSON-lines file
+    next to the document and read lazily, keeping parent memory bounded.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, timeout: Optional[float] = None,
+                 memory_limit_mb: Optional[int] = None, pdf_workers: int = 1):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.timeout = timeout
+        self.memory_limit_mb = memory_limit_mb
+        self.pdf_workers = pdf_workers
+        self._slots = threading.BoundedSemaphore(self.max_workers)
+        methods = multiprocessing.get_all_start_methods()
+        # fork is unsafe from the multi-threaded server; prefer forkserver
+        self._context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+        if self._context.get_start_method() == "forkserver":
+            # Preload the parsers instead of the default __main__ (the server).
+            self._context.set_forkserver_preload(["extraction_executor"])
+
+    def _run(self, path: Path, filename: str, out_path: Path):
+        with self._slots:
+            process = self._context.Process(
+                target=_in_own_session,
+                args=(_extraction_worker, str(path), filename, str(out_path), self.memory_limit_mb,
+                      self.pdf_workers),
+                # not daemonic: PDF extraction starts its own page workers
+                daemon=False,
+            )
+            process.start()
+            process.join(self.timeout)
+            if process.is_alive():
+                self._kill(process)
+                raise ExtractionTimeout(f"文档 {filename} 提取超时（{self.timeout}秒）")
+            if process.exitcode != 0:
+                raise ExtractionError(f"文档 {filename} 提取进程异常退出 (exit code {process.exitcode})")
+
+    @staticmethod
+    def _kill(process):
+        """Kill an extraction process together with the page workers it started."""
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except (AttributeError, ProcessLookupError, PermissionError):
+            # no process groups here, or the child had not called setsid yet
+            process.kill()
+        process.join()
+
+    def iter_segments(self, path: Path, filename: Optional[str] = None,
+                      encoding: Optional[str] = None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """Extract ``path`` in a worker process and yield ``(text, metadata)``.
+
+        ``encoding`` is used for plain text formats, which are read inline.
+        """
+        path = Path(path)
+        filename = filename or path.name
+        if Path(filename).suffix.lower() not in PROCESS_EXTRACTED_SUFFIXES:
+            from file_utils import iter_segments_from_path
+            yield from iter_segments_from_path(path, filename, encoding)
+            return
+        out_path = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.segments")
+        try:
+            self._run(path, filename, out_path)
+            with open(out_path, "r", encoding="utf-8") as lines:
+                for line in lines:
+                    record = json.loads(line)
+                    if "error" in record:
+                        raise ExtractionError(f"文档 {filename} 提取失败: {record['error']}")
+                    yield record["text"], record.get("meta", {})
+        finally:
+            out_path.unlink(missing_ok=True)
@@ -1,156 +1,392 @@
 from pathlib import Path
-from typing import List
+from typing import Any, BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
 import chardet
+import codecs
+import hashlib
+import io
 import logging
+import re
+import time
+
+from pdf_extraction import iter_pdf_segments
 
 logger = logging.getLogger("medical_ai_agent")
 
+# Block size used when streaming uploads to disk
+UPLOAD_CHUNK_SIZE = 1024 * 1024
 
-def read_file_with_encoding_detection(file_path: Path) -> str:
-    """Read file with encoding detection."""
+# Bytes of a text file sampled by chardet when it is not valid UTF-8
+ENCODING_SAMPLE_SIZE = 64 * 1024
+
+# Text formats whose encoding is detected (and cached in the upload metadata)
+TEXT_FILE_SUFFIXES = {'.txt', '.md', '.csv'}
+
+# Rows stringified per DataFrame slice when a sheet has to go through pandas
+TABLE_BATCH_ROWS = 10000
+
+# Text without blank lines (OCR output, single-line exports) is cut at the
+# last sentence end once a paragraph grows past this many characters, so
+# extraction never holds more than about this much of it in memory
+PARAGRAPH_MAX_CHARS = 64 * 1024
+
+# UTF-32 marks first: BOM_UTF32_LE starts with BOM_UTF16_LE
+_BOMS = [
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+]
+
+# A sentence ends at Chinese/English terminal punctuation (plus closing quotes
+# or brackets), at a period followed by whitespace (so "3.5 mg" is not split)
+# or at a line break.
+_SENTENCE_PATTERN = re.compile(r"[^。！？!?.\n]*(?:\.(?=\S)[^。！？!?.\n]*)*(?:[。！？!?]+[”’\"'）)」』]*|\.|\n+)?")
+_SENTENCE_END = re.compile(r"[。！？!?]+[”’\"'）)」』]*|\.(?=\s)|\n")
+
+
+def detect_file_encoding(file_path: Path, sample_size: int = ENCODING_SAMPLE_SIZE) -> str:
+    """Detect a text file's encoding without running chardet on the whole file.
+
+    Checks for a byte-order mark, then validates the file as strict UTF-8 in
+    blocks, and only falls back to chardet on the first ``sample_size`` bytes.
+    """
+    with open(file_path, 'rb') as f:
+        head = f.read(sample_size)
+        for bom, encoding in _BOMS:
+            if head.startswith(bom):
+                return encoding
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        try:
+            decoder.decode(head)
+            for block in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b''):
+                decoder.decode(block)
+            decoder.decode(b'', final=True)
+            return 'utf-8'
+        except UnicodeDecodeError:
+            pass
+    detected = chardet.detect(head)
+    encoding = (detected.get('encoding') or '').lower()
+    if detected.get('confidence', 0) > 0.7 and encoding:
+        # GB2312/GBK text regularly contains characters only GB18030 covers
+        return 'gb18030' if encoding in ('gb2312', 'gbk') else encoding
     try:
-        with open(file_path, 'rb') as f:
-            raw_data = f.read()
-        detected = chardet.detect(raw_data)
-        confidence = detected.get('confidence', 0)
-        encoding = detected.get('encoding', 'utf-8')
-        logger.info(f"📄 [编码检测] 文件: {file_path.name}")
-        logger.info(f"   检测到编码: {encoding} (置信度: {confidence:.2f})")
-        if confidence > 0.7 and encoding:
+        head.decode('gb18030')
+        return 'gb18030'
+    except UnicodeDecodeError:
+        return 'latin1'
+
+
+def read_text_file(file_path: Path, encoding: Optional[str] = None,
+                   max_chars: Optional[int] = None) -> Tuple[str, Optional[str]]:
+    """Read a text file, detecting its encoding unless one is given.
+
+    Returns the text and the encoding used, so callers can cache it. With
+    ``max_chars`` only the beginning of the file is read.
+    """
+    try:
+        if encoding is None:
+            encoding = detect_file_encoding(file_path)
+            logger.info(f"📄 [编码检测] 文件: {file_path.name} 编码: {encoding}")
+        if max_chars is not None:
             try:
-                content = raw_data.decode(encoding)
-                logger.info(f"   ✅ 使用检测编码 {encoding} 成功读取")
-                return content
+                with open(file_path, 'r', encoding=encoding, newline='') as f:
+                    return f.read(max_chars), encoding
             except (UnicodeDecodeError, LookupError) as e:
-                logger.warning(f"   ❌ 检测编码 {encoding} 读取失败: {e}")
-        for enc in ['utf-8', 'gbk', 'gb2312', 'utf-16', 'utf-16le', 'utf-16be', 'latin1', 'cp1252']:
-            try:
-                content = raw_data.decode(enc)
-                logger.info(f"   ✅ 使用备选编码 {enc} 成功读取")
-                return content
-            except (UnicodeDecodeError, LookupError):
-                continue
+                logger.warning(f"   ⚠️ 编码 {encoding} 读取失败，使用UTF-8错误替换模式: {e}")
+                with open(file_path, 'r', encoding='utf-8', errors='replace', newline='') as f:
+                    return f.read(max_chars), None
+        with open(file_path, 'rb') as f:
+            raw_data = f.read()
         try:
-            content = raw_data.decode('utf-8', errors='replace')
-            logger.warning("   ⚠️ 使用UTF-8错误替换模式读取")
-            return content
-        except Exception as e:
-            logger.error(f"   ❌ 所有编码尝试失败: {e}")
-            return "无法读取文件内容: 编码检测失败"
+            return raw_data.decode(encoding), encoding
+        except (UnicodeDecodeError, LookupError) as e:
+            logger.warning(f"   ⚠️ 编码 {encoding} 读取失败，使用UTF-8错误替换模式: {e}")
+            return raw_data.decode('utf-8', errors='replace'), None
     except Exception as e:
         logger.error(f"   💥 文件读取异常: {e}")
-        return f"无法读取原始文件: {str(e)}"
+        return f"无法读取原始文件: {str(e)}", None
+
+
+def read_file_with_encoding_detection(file_path: Path) -> str:
+    """Read file with encoding detection."""
+    return read_text_file(file_path)[0]
+
+
+def _split_long_sentence(sentence: str, chunk_size: int, length: Callable[[str], int]) -> List[str]:
+    """Hard-split a sentence that alone exceeds chunk_size."""
+    step = chunk_size if length is len else max(1, chunk_size * len(sentence) // max(1, length(sentence)))
+    return [sentence[i:i + step] for i in range(0, len(sentence), step)]
+
+
+def iter_chunks(segments: Iterable[str], chunk_size: int = 500, overlap: int = 50,
+                length: Callable[[str], int] = len) -> Iterator[str]:
+    """Lazily split text segments into chunks at sentence boundaries.
+
+    ``length`` measures text size: ``len`` for characters, or a token
+    estimator such as ``context_packer.estimate_tokens``. Chunks never span
+    segments; each chunk after the first in a segment starts with the last
+    ``overlap`` units of the previous one. Sentences longer than
+    ``chunk_size`` are split hard, and no empty chunks are produced. Chunks
+    are slices of the segment, so no text is built up by concatenation.
+    """
+    for segment in segments:
+        if not segment or segment.isspace():
+            continue
+        if length(segment) <= chunk_size:
+            yield segment.strip()
+            continue
+        start = end = size = 0
+        for sentence in _SENTENCE_PATTERN.findall(segment):
+            sentence_size = length(sentence)
+            pieces = (sentence,) if sentence_size <= chunk_size else _split_long_sentence(sentence, chunk_size, length)
+            for piece in pieces:
+                piece_size = sentence_size if piece is sentence else length(piece)
+                if size + piece_size > chunk_size and end > start:
+                    chunk = segment[start:end].strip()
+                    if chunk:
+                        yield chunk
+                    tail = overlap if length is len else overlap * (end - start) // max(1, size)
+                    start = end - tail if 0 < tail < end - start else end
+                    size = length(segment[start:end]) if start < end else 0
+                end += len(piece)
+                size += piece_size
+        chunk = segment[start:end].strip()
+        if chunk:
+            yield chunk
 
 
 def chunk_text(text: str, chunk_size: int = 500, overlap: int = 50) -> List[str]:
     """Split text into chunks at sentence boundaries with optional overlap."""
-    if len(text) <= chunk_size:
-        return [text.strip()]
-    import re
-    sentences = re.split(r"(?<=[。！？.!?])", text)
-    chunks = []
-    current = ""
-    for sentence in sentences:
-        sentence = sentence.strip()
-        if not sentence:
+    return list(iter_chunks([text], chunk_size, overlap))
+
+
+async def spool_upload(upload, dest_path: Path, chunk_size: int = UPLOAD_CHUNK_SIZE) -> Tuple[int, str]:
+    """Stream an UploadFile to dest_path in fixed-size chunks.
+
+    Returns the number of bytes written and the SHA-256 hex digest. The data
+    is written to a temporary file first and renamed into place when done.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    tmp_path = dest_path.with_name(dest_path.name + ".part")
+    try:
+        with open(tmp_path, "wb") as buffer:
+            while True:
+                block = await upload.read(chunk_size)
+                if not block:
+                    break
+                digest.update(block)
+                buffer.write(block)
+                size += len(block)
+        tmp_path.replace(dest_path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    return size, digest.hexdigest()
+
+
+def _iter_paragraphs(text_stream: Iterable[str], max_chars: int = PARAGRAPH_MAX_CHARS) -> Iterator[str]:
+    """Yield blank-line separated paragraphs from an iterable of lines.
+
+    A paragraph growing past ``max_chars`` is yielded up to its last
+    sentence end (or whole, if it has none) and continues in the next one.
+    """
+    lines: List[str] = []
+    size = 0
+    for line in text_stream:
+        if line.strip():
+            lines.append(line)
+            size += len(line)
+            if size > max_chars:
+                text = "".join(lines)
+                cut = 0
+                for match in _SENTENCE_END.finditer(text):
+                    cut = match.end()
+                cut = cut or len(text)
+                paragraph = text[:cut].strip()
+                if paragraph:
+                    yield paragraph
+                lines = [text[cut:]] if cut < len(text) else []
+                size = len(text) - cut
+        elif lines:
+            paragraph = "".join(lines).strip()
+            lines = []
+            if paragraph:
+                yield paragraph
+    if lines:
+        paragraph = "".join(lines).strip()
+        if paragraph:
+            yield paragraph
+
+
+def _iter_table_segments(rows: Iterable[Sequence[Any]], sheet: Optional[str] = None) -> Iterator[str]:
+    """Format table rows as "表头: ..." and "行N: ..." segments.
+
+    The first non-empty row is the header; data rows are numbered by their
+    position below it. Empty cells are skipped. Logs rows/sec per table.
+    """
+    prefix = f"工作表 {sheet} " if sheet else ""
+    started = time.perf_counter()
+    row_number = 0
+    header_seen = False
+    for row in rows:
+        if header_seen:
+            row_number += 1
+        text = ' | '.join(cell for cell in (str(value).strip() for value in row if value is not None) if cell)
+        if not text:
             continue
-        if len(current) + len(sentence) <= chunk_size:
-            current += sentence
+        if header_seen:
+            yield f"{prefix}行{row_number}: {text}"
         else:
-            chunks.append(current)
-            current = (current[-overlap:] if overlap > 0 else "") + sentence
-    if current:
-        chunks.append(current)
-    return chunks
+            header_seen = True
+            yield f"{prefix}表头: {text}"
+    elapsed = time.perf_counter() - started
+    rate = row_number / elapsed if elapsed > 0 else 0.0
+    logger.info(f"📊 表格{(' ' + sheet) if sheet else ''}: {row_number} 行, {rate:.0f} 行/秒")
 
 
-def extract_text_from_file(file_content: bytes, filename: str) -> List[str]:
-    """Extract text content from uploaded file."""
+def _iter_workbook_segments(source: BinaryIO) -> Iterator[str]:
+    """Stream every sheet of an .xlsx workbook in read-only mode."""
+    from openpyxl import load_workbook
+    workbook = load_workbook(source, read_only=True, data_only=True)
+    try:
+        multiple = len(workbook.sheetnames) > 1
+        for sheet in workbook.worksheets:
+            yield from _iter_table_segments(sheet.iter_rows(values_only=True), sheet.title if multiple else None)
+    finally:
+        workbook.close()
+
+
+def _iter_dataframe_rows(df) -> Iterator[List[Optional[str]]]:
+    """Yield a DataFrame's header and rows as strings, missing cells as None.
+
+    Cells are stringified and null-masked a slice at a time with vectorized
+    pandas operations instead of ``iterrows``.
+    """
+    yield [str(column) for column in df.columns]
+    for start in range(0, len(df), TABLE_BATCH_ROWS):
+        part = df.iloc[start:start + TABLE_BATCH_ROWS]
+        values = part.astype(str).to_numpy()
+        present = part.notna().to_numpy()
+        for row, mask in zip(values.tolist(), present.tolist()):
+            yield [value if ok else None for value, ok in zip(row, mask)]
+
+
+def _iter_legacy_workbook_segments(source: BinaryIO) -> Iterator[str]:
+    """Extract every sheet of an .xls workbook through pandas."""
+    import pandas as pd
+    sheets = pd.read_excel(source, sheet_name=None)
+    multiple = len(sheets) > 1
+    for name, df in sheets.items():
+        yield from _iter_table_segments(_iter_dataframe_rows(df), str(name) if multiple else None)
+
+
+def _iter_stream_paragraphs(source: BinaryIO, encoding: str) -> Iterator[str]:
+    """Yield paragraphs decoded from a binary file object, reading it in parts."""
+    text_stream = io.TextIOWrapper(source, encoding=encoding, newline='')
+    # bounded reads: a file without line breaks is still read a part at a time
+    lines = iter(lambda: text_stream.readline(PARAGRAPH_MAX_CHARS), '')
+    yield from _iter_paragraphs(lines)
+
+
+def _iter_text_segments(source: BinaryIO, filename: str, encoding: Optional[str] = None) -> Iterator[str]:
+    """Yield text segments extracted from a binary file object.
+
+    ``encoding`` applies to text formats and defaults to UTF-8.
+    """
+    encoding = encoding or 'utf-8'
+
     file_extension = Path(filename).suffix.lower()
     try:
         if file_extension in ['.txt', '.md']:
-            text = file_content.decode('utf-8')
-            paragraphs = [p.strip() for p in text.split('\n\n') if p.strip()]
-            return paragraphs if paragraphs else [text]
+            found = False
+            for paragraph in _iter_stream_paragraphs(source, encoding):
+                found = True
+                yield paragraph
+            if not found:
+                yield ""
         elif file_extension == '.csv':
-            import io
             import csv
-            text_data = file_content.decode('utf-8')
-            reader = csv.reader(io.StringIO(text_data))
-            rows = []
-            for row in reader:
-                if any(cell.strip() for cell in row):
-                    rows.append(' | '.join(row))
-            return rows
+            text_stream = io.TextIOWrapper(source, encoding=encoding, newline='')
+            yield from _iter_table_segments(csv.reader(text_stream))
         elif file_extension == '.pdf':
             try:
-                import io
-                import PyPDF2
-                pdf_file = io.BytesIO(file_content)
-                pdf_reader = PyPDF2.PdfReader(pdf_file)
-                pages_text = []
-                for page_num, page in enumerate(pdf_reader.pages):
-                    try:
-                        page_text = page.extract_text()
-                        if page_text.strip():
-                            cleaned_text = page_text.replace('\n', ' ').replace('\r', ' ')
-                            cleaned_text = ' '.join(cleaned_text.split())
-                            import re
-                            cleaned_text = re.sub(r'[^\u4e00-\u9fff\u3400-\u4dbf\w\s\.,;:!?\'"()\-\[\]{}@#$%^&*+=<>/\\|`~·。，、；：！？""''（）【】《》]+', '', cleaned_text)
-                            cleaned_text = re.sub(r'\s+', ' ', cleaned_text)
-                            cleaned_text = re.sub(r'([.。,，;；:：!！?？])\1+', r'\1', cleaned_text)
-                            if cleaned_text and len(cleaned_text.strip()) > 20:
-                                if len(cleaned_text) > 2000:
-                                    cleaned_text = cleaned_text[:2000] + "..."
-                                pages_text.append(f"第{page_num+1}页: {cleaned_text}")
-                            else:
-                                raw_text = page_text.strip()
-                                if raw_text and len(raw_text) > 10:
-                                    pages_text.append(f"第{page_num+1}页: [可能包含表格或图片] {raw_text[:100]}...")
-                    except Exception as e:
-                        pages_text.append(f"第{page_num+1}页解析错误: {str(e)}")
-                if not pages_text:
-                    return [f"PDF文件 {filename} 无法提取文本内容，可能是扫描版PDF、加密文件或纯图片文档"]
-                return pages_text
+                for text, _ in iter_pdf_segments(source, filename):
+                    if text:
+                        yield text
             except ImportError:
-                return ["PDF解析需要安装PyPDF2库: pip install PyPDF2"]
+                yield "PDF解析需要安装PyPDF2库: pip install PyPDF2"
             except Exception as e:
-                return [f"PDF文件解析失败: {str(e)}"]
+                yield f"PDF文件解析失败: {str(e)}"
         elif file_extension in ['.xlsx', '.xls']:
             try:
-                import io
-                import pandas as pd
-                df = pd.read_excel(io.BytesIO(file_content))
-                rows = []
-                headers = ' | '.join(str(col) for col in df.columns)
-                rows.append(f"表头: {headers}")
-                for idx, row in df.iterrows():
-                    row_text = ' | '.join(str(val) for val in row.values if pd.notna(val))
-                    if row_text.strip():
-                        rows.append(f"行{idx+1}: {row_text}")
-                return rows if rows else [f"Excel文件 {filename} 为空"]
+                if file_extension == '.xlsx':
+                    yield from _iter_workbook_segments(source)
+                else:
+                    yield from _iter_legacy_workbook_segments(source)
             except Exception as e:
-                return [f"Excel文件解析失败: {str(e)}"]
+                yield f"Excel文件解析失败: {str(e)}"
         elif file_extension == '.docx':
             try:
-                import io
                 from docx import Document
-                doc = Document(io.BytesIO(file_content))
-                paragraphs = []
+                doc = Document(source)
+                found = False
                 for para in doc.paragraphs:
                     text = para.text.strip()
                     if text:
-                        paragraphs.append(text)
-                return paragraphs if paragraphs else [f"Word文档 {filename} 无文本内容"]
+                        found = True
+                        yield text
+                if not found:
+                    yield f"Word文档 {filename} 无文本内容"
             except ImportError:
-                return ["Word文档解析需要安装python-docx库: pip install python-docx"]
+                yield "Word文档解析需要安装python-docx库: pip install python-docx"
             except Exception as e:
-                return [f"Word文档解析失败: {str(e)}"]
+                yield f"Word文档解析失败: {str(e)}"
         else:
+            found = False
             try:
-                text = file_content.decode('utf-8')
-                return [text] if text.strip() else [f"文件 {filename} 内容为空"]
+                for paragraph in _iter_stream_paragraphs(source, 'utf-8'):
+                    found = True
+                    yield paragraph
+                if not found:
+                    yield f"文件 {filename} 内容为空"
             except UnicodeDecodeError:
-                return [f"不支持的文件格式: {file_extension}，无法解析为文本"]
+                yield f"不支持的文件格式: {file_extension}，无法解析为文本"
     except Exception as e:
-        return [f"文件处理错误: {str(e)}"]
+        yield f"文件处理错误: {str(e)}"
+
+
+def iter_segments_from_path(file_path: Path, filename: Optional[str] = None,
+                            encoding: Optional[str] = None,
+                            pdf_workers: int = 1) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """Lazily extract ``(text, metadata)`` segments from a file on disk.
+
+    PDF pages carry ``page`` and ``extract_seconds`` metadata and are
+    extracted by ``pdf_workers`` processes; other formats have no metadata.
+    """
+    filename = filename or file_path.name
+    if Path(filename).suffix.lower() == '.pdf':
+        try:
+            yield from iter_pdf_segments(file_path, filename, pdf_workers)
+        except ImportError:
+            yield "PDF解析需要安装PyPDF2库: pip install PyPDF2", {}
+        except Exception as e:
+            yield f"PDF文件解析失败: {str(e)}", {}
+        return
+    with open(file_path, 'rb') as source:
+        for text in _iter_text_segments(source, filename, encoding):
+            yield text, {}
+
+
+def iter_text_from_path(file_path: Path, filename: Optional[str] = None,
+                        encoding: Optional[str] = None) -> Iterator[str]:
+    """Lazily extract text segments from a file on disk."""
+    for text, _ in iter_segments_from_path(file_path, filename, encoding):
+        if text:
+            yield text
+
+
+def extract_text_from_file(file_content: bytes, filename: str) -> List[str]:
+    """Extract text content from uploaded file."""
+    return list(_iter_text_segments(io.BytesIO(file_content), filename))
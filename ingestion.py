@@ -0,0 +1,516 @@
+import asyncio
+import logging
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import chunk_store
+from chunk_store import (
+    add_file, replace_file, chunk_hash, find_chunk, find_file_by_hash, get_file_info, require_ready,
+)
+from config import (
+    current_config,
+    INGESTION_MAX_CONCURRENT_JOBS,
+    INGESTION_JOB_LEASE_SECONDS,
+    INGESTION_PROGRESS_SAVE_SECONDS,
+    SHARED_STORE_POLL_SECONDS,
+    CHUNK_SIZE,
+    CHUNK_OVERLAP,
+    CHUNK_SIZE_UNIT,
+    EXTRACTION_PROCESSES,
+    EXTRACTION_TIMEOUT_SECONDS,
+    EXTRACTION_MEMORY_LIMIT_MB,
+    PDF_PAGE_WORKERS,
+    UPLOAD_DIR,
+)
+from context_packer import estimate_tokens
+from data_persistence import load_batches, load_jobs
+from embedding_utils import get_embedding
+from extraction_executor import ExtractionExecutor
+from file_utils import TEXT_FILE_SUFFIXES, detect_file_encoding, iter_chunks
+
+logger = logging.getLogger("medical_ai_agent")
+
+# Finished jobs kept in the catalog; older ones are dropped.
+MAX_FINISHED_JOBS = 200
+
+# Failures listed per batch summary; the rest are only counted
+MAX_BATCH_FAILURES_LISTED = 100
+
+# PDF/DOCX/Excel parsing runs in separate processes with a timeout and memory limit
+extraction_executor = ExtractionExecutor(
+    max_workers=EXTRACTION_PROCESSES,
+    timeout=EXTRACTION_TIMEOUT_SECONDS,
+    memory_limit_mb=EXTRACTION_MEMORY_LIMIT_MB,
+    pdf_workers=PDF_PAGE_WORKERS,
+)
+
+
+def ingest_file(job: Dict[str, Any], on_stage: Optional[Callable[[], None]] = None) -> Dict[str, Any]:
+    """Extract, chunk and embed one spooled file and add it to the knowledge base.
+
+    Progress is written into ``job`` as it goes; ``on_stage`` is called on
+    every stage change. New chunks are published in one step at the end so
+    searches never see a partially ingested file. Chunks whose content hash is
+    already stored (or repeated within the file) reuse the stored embedding.
+
+    If ``job["replace_filename"]`` is set the file replaces that upload: only
+    chunks not in the old version are embedded, and the old version is
+    swapped out in the same publish step.
+    """
+    file_path = Path(job["file_path"])
+    original_name = job["original_name"]
+    knowledge_type = job["knowledge_type"]
+    title = job.get("title") or original_name
+    replace_filename = job.get("replace_filename")
+    # one timestamp per upload, so file-level chunk metadata is shared by all chunks
+    upload_time = datetime.now().isoformat()
+
+    def set_stage(stage: str):
+        job["stage"] = stage
+        if on_stage:
+            on_stage()
+
+    # 启动时知识库在后台加载，加载完成后才能按内容哈希复用已有向量
+    require_ready()
+    set_stage("extracting")
+    encoding = None
+    if file_path.suffix.lower() in TEXT_FILE_SUFFIXES:
+        # 同一内容哈希的文件已检测过编码时直接复用
+        known = find_file_by_hash(job.get("sha256"))
+        encoding = (known or {}).get("encoding") or detect_file_encoding(file_path)
+    text_segments = 0
+    new_documents: Dict[str, Dict[str, Any]] = {}
+    # stored chunks this file reuses, kept in case their files are deleted before it is published
+    reused_records: Dict[str, Any] = {}
+    chunk_hashes: List[tuple] = []
+    reused_embeddings = 0
+    preview_chunks: List[str] = []
+    embeddings_info: List[Dict[str, Any]] = []
+
+    page_timings: List[Dict[str, Any]] = []
+
+    def iter_located_chunks():
+        nonlocal text_segments
+        for text, metadata in extraction_executor.iter_segments(file_path, original_name, encoding):
+            if "page" in metadata:
+                page_timings.append({"page": metadata["page"], "seconds": metadata.get("extract_seconds", 0.0)})
+            if not text:
+                continue
+            text_segments += 1
+            location = {"page": metadata["page"]} if "page" in metadata else {}
+            # 对较长的文本进行进一步分块，页码作为分块元数据保留
+            for chunk in iter_chunks(
+                [text],
+                chunk_size=CHUNK_SIZE,
+                overlap=CHUNK_OVERLAP,
+                length=estimate_tokens if CHUNK_SIZE_UNIT == "tokens" else len,
+            ):
+                yield chunk, location
+
+    for i, (chunk, location) in enumerate(iter_located_chunks()):
+        if i == 0:
+            set_stage("embedding")
+        job["chunks_processed"] = i + 1
+        if len(preview_chunks) < 3:
+            preview_chunks.append(chunk)
+        content_hash = chunk_hash(chunk)
+        found = None if content_hash in new_documents else find_chunk(content_hash)
+        if found is not None:
+            reused_records[content_hash] = found
+        if found is not None or content_hash in new_documents:
+            chunk_hashes.append((content_hash, i, location))
+            reused_embeddings += 1
+            job["chunks_embedded"] = len(chunk_hashes)
+            continue
+        try:
+            embedding = get_embedding(chunk)
+            new_documents[content_hash] = {
+                "id": f"{original_name}_{i}_{datetime.now().timestamp()}",
+                "content": chunk,
+                "content_hash": content_hash,
+                "embedding": embedding,
+                "knowledge_type": knowledge_type,
+                "metadata": {
+                    "title": title,
+                    "source_file": original_name,
+                    "chunk_index": i,
+                    "upload_time": upload_time,
+                    "file_type": file_path.suffix,
+                    "embedding_dimension": len(embedding),
+                    **location
+                }
+            }
+            chunk_hashes.append((content_hash, i, location))
+            job["chunks_embedded"] = len(chunk_hashes)
+            if len(embeddings_info) < 3:
+                embeddings_info.append({
+                    "chunk_length": len(chunk),
+                    "embedding_dimension": len(embedding),
+                    "embedding_sample": embedding[:3] if len(embedding) > 3 else embedding
+                })
+        except Exception as e:
+            logger.error(f"为文本块 {i} 生成embedding失败: {e}")
+            job["embedding_failures"] = job.get("embedding_failures", 0) + 1
+
+    chunks_count = job.get("chunks_processed", 0)
+    set_stage("saving")
+    file_info = {
+        "filename": file_path.name,
+        "original_name": original_name,
+        "size": job.get("size") or file_path.stat().st_size,
+        "sha256": job.get("sha256"),
+        "encoding": encoding,
+        "modified": file_path.stat().st_mtime,
+        "knowledge_type": knowledge_type,
+        "title": title,
+        "upload_time": upload_time,
+        "chunks_count": chunks_count,
+        "embedded_count": len(chunk_hashes),
+        "chunks": preview_chunks  # 只保存前3个块作为预览
+    }
+    if replace_filename:
+        previous = get_file_info(replace_filename) or {}
+        file_info["replaces"] = replace_filename
+        file_info["version"] = previous.get("version", 1) + 1
+        stored = replace_file(replace_filename, file_info, chunk_hashes, new_documents.values(), reused_records)
+        old_path = UPLOAD_DIR / replace_filename
+        if old_path.exists() and old_path.resolve() != file_path.resolve():
+            old_path.unlink()
+        logger.info(f"🔁 替换文件 {replace_filename} -> {file_path.name}: "
+                    f"未变 {stored['chunks_unchanged']}, 新增 {stored['chunks_new']}, 移除 {stored['chunks_dropped']}")
+    else:
+        stored = add_file(file_info, chunk_hashes, new_documents.values(), reused_records)
+
+    return {
+        "file_path": str(file_path),
+        "records_added": stored["chunks_added"],
+        "chunks_count": chunks_count,
+        "processing_info": {
+            "file_type": file_path.suffix,
+            "text_extracted": text_segments > 0,
+            "chunking_applied": True,
+            "embedding_applied": len(chunk_hashes) > 0,
+            "embedding_model": current_config["embedding"]["type"],
+            "embedding_failures": chunks_count - len(chunk_hashes),
+            "embedding_calls": len(new_documents),
+            "embeddings_reused": reused_embeddings,
+            "chunks_shared": stored["chunks_reused"]
+        },
+        "page_extraction": {
+            "pages": len(page_timings),
+            "total_seconds": round(sum(p["seconds"] for p in page_timings), 3),
+            "slowest_pages": sorted(page_timings, key=lambda p: p["seconds"], reverse=True)[:5],
+        } if page_timings else None,
+        "replacement": {
+            "replaced_file": replace_filename,
+            "chunks_unchanged": stored["chunks_unchanged"],
+            "chunks_new": stored["chunks_new"],
+            "chunks_dropped": stored["chunks_dropped"],
+        } if replace_filename else None,
+        "embeddings_sample": embeddings_info
+    }
+
+
+class IngestionQueue:
+    """Ingestion jobs shared by all worker processes through the catalog.
+
+    Jobs and batch totals live in the catalog. Each worker's job slots claim
+    queued jobs under a lease that is renewed while the job runs, so a job
+    is ingested by one worker at a time, and a job whose worker died is
+    picked up again once its lease expires.
+    """
+
+    def __init__(self, max_concurrent_jobs: int = INGESTION_MAX_CONCURRENT_JOBS):
+        self.max_concurrent_jobs = max(1, max_concurrent_jobs)
+        # identifies this worker's leases
+        self.owner = uuid.uuid4().hex
+        self._wakeup: Optional[asyncio.Queue] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._workers: List[asyncio.Task] = []
+
+    @staticmethod
+    def _import_legacy_jobs():
+        """Copy the jobs and batches of the old JSON files into the catalog once."""
+        catalog = chunk_store.catalog
+        with catalog.transaction() as conn:
+            # checked inside the transaction: workers starting together import once
+            if catalog.get_meta("legacy_jobs_migrated"):
+                return
+            jobs = load_jobs()
+            for job in jobs:
+                if job["status"] == "running":
+                    job["status"] = "queued"
+                catalog.add_job(conn, job)
+            for batch in load_batches():
+                catalog.put_batch(conn, batch)
+            catalog.set_meta(conn, "legacy_jobs_migrated", "1")
+        if jobs:
+            logger.info(f"🗂️ 已将 {len(jobs)} 个入库任务迁移到SQLite目录")
+
+    def start(self):
+        """Start this worker's job slots; jobs left unfinished by a restart
+        are claimed again once their lease has expired."""
+        if self._wakeup is not None:
+            return
+        self._import_legacy_jobs()
+        self._wakeup = asyncio.Queue()
+        self._loop = asyncio.get_running_loop()
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_concurrent_jobs, thread_name_prefix="ingestion"
+        )
+        pending = [j for j in chunk_store.catalog.list_jobs() if j["status"] in ("queued", "running")]
+        if pending:
+            logger.info(f"📥 {len(pending)} 个未完成的入库任务等待处理")
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.max_concurrent_jobs)]
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        self._workers = []
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        self._wakeup = None
+
+    def _notify(self, jobs: int = 1):
+        # enqueue may run on a request thread; wake the job slots on their loop
+        wakeup, loop = self._wakeup, self._loop
+        if wakeup is not None:
+            for _ in range(jobs):
+                loop.call_soon_threadsafe(wakeup.put_nowait, None)
+
+    def enqueue(self, file_path: Path, original_name: str, knowledge_type: str,
+                title: Optional[str] = None, size: Optional[int] = None,
+                sha256: Optional[str] = None, replace_filename: Optional[str] = None,
+                batch_id: Optional[str] = None) -> Dict[str, Any]:
+        """Record a new job for a spooled file and schedule it.
+
+        ``replace_filename`` makes the job replace that uploaded file;
+        ``batch_id`` counts the job towards a bulk ingestion batch.
+        """
+        job = self._new_job(file_path, original_name, knowledge_type, title=title, size=size,
+                            sha256=sha256, replace_filename=replace_filename, batch_id=batch_id)
+        catalog = chunk_store.catalog
+        with catalog.transaction() as conn:
+            catalog.add_job(conn, job)
+        self._notify()
+        return job
+
+    @staticmethod
+    def _new_job(file_path: Path, original_name: str, knowledge_type: str, **fields) -> Dict[str, Any]:
+        return {
+            "id": uuid.uuid4().hex,
+            "file_path": str(file_path),
+            "filename": Path(file_path).name,
+            "original_name": original_name,
+            "knowledge_type": knowledge_type,
+            "title": fields.get("title"),
+            "size": fields.get("size"),
+            "sha256": fields.get("sha256"),
+            "replace_filename": fields.get("replace_filename"),
+            "batch_id": fields.get("batch_id"),
+            "status": "queued",
+            "stage": "queued",
+            "chunks_processed": 0,
+            "chunks_embedded": 0,
+            "embedding_failures": 0,
+            "error": None,
+            "result": None,
+            "created": time.time(),
+            "started": None,
+            "finished": None,
+        }
+
+    def enqueue_batch(self, batch_id: str, source: str, specs: List[Dict[str, Any]],
+                      skipped: List[Dict[str, str]]) -> Dict[str, Any]:
+        """Record a bulk ingestion batch and enqueue a job per staged file.
+
+        The batch's files run through the same queue, so at most
+        ``max_concurrent_jobs`` of them are ingested at a time per worker.
+        """
+        batch = {
+            "id": batch_id,
+            "source": source,
+            "status": "running" if specs else "completed",
+            "total_files": len(specs),
+            "files_completed": 0,
+            "files_failed": 0,
+            "chunks_processed": 0,
+            "chunks_embedded": 0,
+            "embedding_calls": 0,
+            "embeddings_reused": 0,
+            "embedding_failures": 0,
+            "failures": [],
+            "skipped": skipped,
+            "created": time.time(),
+            "started": None,
+            "finished": None if specs else time.time(),
+        }
+        catalog = chunk_store.catalog
+        # the batch and its jobs appear together, so no job finishes before its batch exists
+        with catalog.transaction() as conn:
+            catalog.put_batch(conn, batch)
+            for spec in specs:
+                catalog.add_job(conn, self._new_job(
+                    spec["file_path"],
+                    spec["original_name"],
+                    spec["knowledge_type"],
+                    title=spec.get("title"),
+                    size=spec.get("size"),
+                    sha256=spec.get("sha256"),
+                    batch_id=batch_id,
+                ))
+        self._notify(len(specs))
+        return batch
+
+    def _record_batch_result(self, batch: Dict[str, Any], job: Dict[str, Any]):
+        job_started = job.get("started") or job["finished"]
+        batch["started"] = min(batch["started"] or job_started, job_started)
+        batch["chunks_processed"] += job.get("chunks_processed", 0)
+        batch["chunks_embedded"] += job.get("chunks_embedded", 0)
+        batch["embedding_failures"] += job.get("embedding_failures", 0)
+        if job["status"] == "completed":
+            batch["files_completed"] += 1
+            info = (job.get("result") or {}).get("processing_info", {})
+            batch["embedding_calls"] += info.get("embedding_calls", 0)
+            batch["embeddings_reused"] += info.get("embeddings_reused", 0)
+        else:
+            batch["files_failed"] += 1
+            if len(batch["failures"]) < MAX_BATCH_FAILURES_LISTED:
+                batch["failures"].append({"file": job["original_name"], "error": job.get("error")})
+        if batch["files_completed"] + batch["files_failed"] >= batch["total_files"]:
+            batch.update(status="completed", finished=time.time())
+            summary = self.describe_batch(batch)
+            logger.info(
+                f"📦 批量入库完成: {batch['files_completed']}/{batch['total_files']} 个文件成功, "
+                f"{summary['files_per_second']} 文件/秒, {summary['chunks_per_second']} 分块/秒, "
+                f"{batch['embedding_calls']} 次向量化调用, {batch['files_failed']} 个失败"
+            )
+
+    def get_batch(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        batch = chunk_store.catalog.get_batch(batch_id)
+        return self.describe_batch(batch) if batch else None
+
+    def list_batches(self) -> List[Dict[str, Any]]:
+        return [self.describe_batch(batch) for batch in chunk_store.catalog.list_batches()]
+
+    @staticmethod
+    def describe_batch(batch: Dict[str, Any]) -> Dict[str, Any]:
+        """Return a batch record with aggregate throughput figures."""
+        info = dict(batch)
+        started = batch.get("started")
+        elapsed = ((batch.get("finished") or time.time()) - started) if started else 0.0
+        done = batch["files_completed"] + batch["files_failed"]
+        info["elapsed_seconds"] = round(elapsed, 3)
+        info["files_per_second"] = round(done / elapsed, 2) if elapsed > 0 else 0.0
+        info["chunks_per_second"] = round(batch["chunks_processed"] / elapsed, 2) if elapsed > 0 else 0.0
+        return info
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = chunk_store.catalog.get_job(job_id)
+        return self.describe(job) if job else None
+
+    def list_jobs(self) -> List[Dict[str, Any]]:
+        return [self.describe(job) for job in chunk_store.catalog.list_jobs()]
+
+    @staticmethod
+    def describe(job: Dict[str, Any]) -> Dict[str, Any]:
+        """Return a job record with derived throughput figures."""
+        info = dict(job)
+        started = job.get("started")
+        if started:
+            elapsed = (job.get("finished") or time.time()) - started
+            info["elapsed_seconds"] = round(elapsed, 3)
+            info["chunks_per_second"] = round(job.get("chunks_processed", 0) / elapsed, 2) if elapsed > 0 else 0.0
+        return info
+
+    def _claim(self) -> Optional[Dict[str, Any]]:
+        """Lease the next job to this worker and reset its progress."""
+        job = chunk_store.catalog.claim_job(self.owner, INGESTION_JOB_LEASE_SECONDS, time.time())
+        if job is None:
+            return None
+        if job["status"] == "running":
+            logger.info(f"📥 接管租约已过期的入库任务: {job['original_name']}")
+        job.update(status="running", stage="queued", chunks_processed=0, chunks_embedded=0,
+                   embedding_failures=0, error=None, started=time.time())
+        if not Path(job["file_path"]).exists():
+            job.update(status="failed", stage="failed", error="上传文件已不存在", finished=time.time())
+            self._finish(job)
+        else:
+            self._save(job)
+        return job
+
+    def _save(self, job: Dict[str, Any]) -> bool:
+        """Store a running job's progress and renew its lease; False if another
+        worker has taken the job over."""
+        catalog = chunk_store.catalog
+        with catalog.transaction() as conn:
+            return catalog.update_job(conn, job, self.owner, time.time() + INGESTION_JOB_LEASE_SECONDS)
+
+    def _finish(self, job: Dict[str, Any]):
+        """Store a finished job, release its lease and count it towards its batch."""
+        catalog = chunk_store.catalog
+        with catalog.transaction() as conn:
+            if not catalog.update_job(conn, job, self.owner, None):
+                logger.warning(f"⚠️ 入库任务 {job['original_name']} 已由其他进程接管，忽略本次结果")
+                return
+            batch = catalog.get_batch(job["batch_id"]) if job.get("batch_id") else None
+            if batch is not None:
+                self._record_batch_result(batch, job)
+                catalog.put_batch(conn, batch)
+            catalog.prune_jobs(conn, MAX_FINISHED_JOBS)
+
+    async def _run(self, job: Dict[str, Any]):
+        loop = asyncio.get_running_loop()
+
+        def on_stage():
+            if not self._save(job):
+                raise RuntimeError("入库任务已由其他进程接管")
+
+        def progress():
+            return job.get("stage"), job.get("chunks_processed"), job.get("chunks_embedded")
+
+        future = loop.run_in_executor(self._executor, ingest_file, job, on_stage)
+        # store progress while a stage runs, and renew the lease even when it stalls
+        saved, renewed = progress(), time.monotonic()
+        while not (await asyncio.wait({future}, timeout=INGESTION_PROGRESS_SAVE_SECONDS))[0]:
+            if progress() != saved or time.monotonic() - renewed >= INGESTION_JOB_LEASE_SECONDS / 3:
+                saved, renewed = progress(), time.monotonic()
+                await loop.run_in_executor(None, self._save, job)
+        return future.result()
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                job = await loop.run_in_executor(None, self._claim)
+            except Exception as e:
+                logger.error(f"❌ 领取入库任务失败: {e}")
+                job = None
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.get(), SHARED_STORE_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            if job["status"] != "running":
+                continue
+            try:
+                job["result"] = await self._run(job)
+                job.update(status="completed", stage="completed", finished=time.time())
+                logger.info(f"✅ 入库任务完成: {job['original_name']} ({job['chunks_embedded']} 个分块)")
+            except Exception as e:
+                logger.error(f"❌ 入库任务失败: {job['original_name']}: {e}")
+                job.update(status="failed", stage="failed", error=str(e), finished=time.time())
+            try:
+                await loop.run_in_executor(None, self._finish, job)
+            except Exception as e:
+                logger.error(f"❌ 保存入库任务结果失败: {job['original_name']}: {e}")
+
+
+ingestion_queue = IngestionQueue()
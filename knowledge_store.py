@@ -1,33 +1,76 @@
-from typing import List, Optional
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
 import logging
 from fastapi import HTTPException
 
-from config import embedded_documents
+from chunk_store import advance_version, chunk_knowledge_types, store
 from embedding_utils import get_embedding, cosine_similarity
+from sharded_search import sharded_search
 
 logger = logging.getLogger("medical_ai_agent")
 
+# LRU cache of search results keyed by (query, types, top_k, kb version)
+RETRIEVAL_CACHE_SIZE = 256
+_retrieval_cache: "OrderedDict[tuple, list]" = OrderedDict()
+
+
+def get_kb_version() -> int:
+    """Return the current knowledge-base version.
+
+    It is the generation of the last change in the shared catalog, so it
+    advances with every upload or delete (and with ``bump_kb_version``), is
+    the same in every worker process and stays valid across restarts. It is
+    part of every cache key.
+    """
+    return store.version
+
+
+def bump_kb_version(config: Optional[Dict[str, Any]] = None) -> int:
+    """Mark the knowledge base as changed without changing its records
+    (e.g. a new embedding model) and drop cached search results. A given
+    ``config`` is shared with the other worker processes."""
+    version = advance_version(config)
+    _retrieval_cache.clear()
+    return version
+
 
 async def search_knowledge_embedding(query: str, top_k: int = 5, types: Optional[List[str]] = None):
     """Search in-memory embeddings and return top_k results."""
+    if not store.ready:
+        # 启动时知识库仍在后台加载
+        return {"success": False, "status": "warming", "results": [],
+                "message": "知识库正在加载，请稍后重试", "loading": store.loading_status()}
+    # 整个搜索使用开始时的快照：入库和删除发布的新版本不会阻塞搜索，也不会被看到一半
+    snapshot = store.snapshot()
+    cache_key = (query, tuple(sorted(types)) if types else None, top_k, snapshot.version)
+    cached = _retrieval_cache.get(cache_key)
+    if cached is not None:
+        _retrieval_cache.move_to_end(cache_key)
+        return {"success": True, "results": list(cached), "kb_version": snapshot.version}
     try:
-        if not embedded_documents:
-            return {"success": True, "results": []}
+        if not len(snapshot):
+            return {"success": True, "results": [], "kb_version": snapshot.version}
         query_embedding = get_embedding(query)
-        results = []
-        for doc in embedded_documents:
-            if types and doc['knowledge_type'] not in types:
-                continue
-            similarity = cosine_similarity(query_embedding, doc['embedding'])
-            if similarity > 0.1:
-                results.append({
-                    "knowledge_type": doc["knowledge_type"],
-                    "content": doc["content"],
-                    "metadata": doc["metadata"],
-                    "score": similarity,
-                })
-        results.sort(key=lambda x: x['score'], reverse=True)
-        return {"success": True, "results": results[:top_k]}
+        # 大知识库在分片进程池上并行打分，否则在本进程内逐条计算
+        scored = await sharded_search(snapshot, query_embedding, top_k, types)
+        if scored is None:
+            scored = []
+            for doc in snapshot.documents():
+                if types and doc['knowledge_type'] not in types and not chunk_knowledge_types(doc) & set(types):
+                    continue
+                scored.append((doc, cosine_similarity(query_embedding, doc['embedding'])))
+            scored.sort(key=lambda x: x[1], reverse=True)
+        results = [{
+            "knowledge_type": doc["knowledge_type"],
+            "content": doc["content"],
+            "content_hash": doc.get("content_hash"),
+            "metadata": doc["metadata"],
+            "score": similarity,
+        } for doc, similarity in scored[:top_k] if similarity > 0.1]
+        _retrieval_cache[cache_key] = results
+        if len(_retrieval_cache) > RETRIEVAL_CACHE_SIZE:
+            _retrieval_cache.popitem(last=False)
+        return {"success": True, "results": list(results), "kb_version": snapshot.version}
     except Exception as e:
         logger.error(f"向量搜索适配器失败: {e}")
         raise HTTPException(status_code=400, detail=f"向量搜索失败: {str(e)}")
@@ -0,0 +1,104 @@
+import logging
+import multiprocessing
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Iterator, List, Tuple, Union
+
+logger = logging.getLogger("medical_ai_agent")
+
+# Like extraction_executor, this module runs inside extraction child
+# processes and must not import config.
+
+# Pages handed to one worker at a time
+PAGES_PER_TASK = 8
+
+# Pages slower than this are logged so problem documents can be diagnosed
+SLOW_PAGE_SECONDS = 2.0
+
+_LINE_BREAKS = re.compile(r"[\r\n]+")
+_DISALLOWED_CHARS = re.compile(
+    r'[^\u4e00-\u9fff\u3400-\u4dbf\w\s\.,;:!?\'"()\-\[\]{}@#$%^&*+=<>/\\|`~·。，、；：！？""''（）【】《》]+'
+)
+_WHITESPACE = re.compile(r"\s+")
+_REPEATED_PUNCTUATION = re.compile(r"([.。,，;；:：!！?？])\1+")
+
+
+def clean_page_text(text: str) -> str:
+    """Normalize whitespace and drop glyph garbage from extracted page text."""
+    text = _LINE_BREAKS.sub(" ", text)
+    text = _DISALLOWED_CHARS.sub("", text)
+    text = _WHITESPACE.sub(" ", text)
+    return _REPEATED_PUNCTUATION.sub(r"\1", text).strip()
+
+
+def _page_record(reader, index: int) -> Dict[str, Any]:
+    started = time.perf_counter()
+    record: Dict[str, Any] = {"page": index + 1, "text": ""}
+    try:
+        page_text = reader.pages[index].extract_text() or ""
+        if page_text.strip():
+            cleaned = clean_page_text(page_text)
+            if len(cleaned) > 20:
+                record["text"] = cleaned
+            elif len(page_text.strip()) > 10:
+                record["text"] = f"[可能包含表格或图片] {page_text.strip()}"
+    except Exception as e:
+        record["error"] = str(e)
+    record["seconds"] = round(time.perf_counter() - started, 4)
+    return record
+
+
+def _extract_page_range(path: str, start: int, end: int) -> List[Dict[str, Any]]:
+    """Worker: open the PDF and extract pages ``start`` to ``end - 1``."""
+    import PyPDF2
+    reader = PyPDF2.PdfReader(path)
+    return [_page_record(reader, index) for index in range(start, end)]
+
+
+def iter_pdf_pages(source: Union[str, Path, BinaryIO], workers: int = 1) -> Iterator[Dict[str, Any]]:
+    """Yield ``{"page", "text", "seconds"[, "error"]}`` for every page in order.
+
+    With a file path and ``workers > 1``, page ranges of ``PAGES_PER_TASK``
+    pages are extracted in parallel worker processes, each opening the file
+    itself; otherwise pages are extracted serially. Text is kept in full.
+    """
+    import PyPDF2
+    reader = PyPDF2.PdfReader(source)
+    page_count = len(reader.pages)
+    ranges = [(start, min(start + PAGES_PER_TASK, page_count)) for start in range(0, page_count, PAGES_PER_TASK)]
+    if not isinstance(source, (str, Path)) or workers <= 1 or len(ranges) <= 1:
+        for index in range(page_count):
+            yield _page_record(reader, index)
+        return
+
+    # Extraction children are single-threaded, so forking them is safe
+    context = multiprocessing.get_context("fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn")
+    with ProcessPoolExecutor(max_workers=min(workers, len(ranges)), mp_context=context) as pool:
+        paths = [str(source)] * len(ranges)
+        starts = [start for start, _ in ranges]
+        ends = [end for _, end in ranges]
+        for records in pool.map(_extract_page_range, paths, starts, ends):
+            yield from records
+
+
+def iter_pdf_segments(source: Union[str, Path, BinaryIO], filename: str,
+                      workers: int = 1) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """Yield ``(text, metadata)`` per PDF page with the page number and timing.
+
+    Pages without text (or that failed to parse) yield empty text, so their
+    timing is still reported.
+    """
+    found = False
+    for record in iter_pdf_pages(source, workers):
+        if record["seconds"] >= SLOW_PAGE_SECONDS:
+            logger.warning(f"🐢 PDF {filename} 第{record['page']}页提取耗时 {record['seconds']:.2f}秒")
+        metadata = {"page": record["page"], "extract_seconds": record["seconds"]}
+        if "error" in record:
+            logger.warning(f"⚠️ PDF {filename} 第{record['page']}页解析错误: {record['error']}")
+            metadata["error"] = record["error"]
+        found = found or bool(record["text"])
+        yield record["text"], metadata
+    if not found:
+        yield f"PDF文件 {filename} 无法提取文本内容，可能是扫描版PDF、加密文件或纯图片文档", {}
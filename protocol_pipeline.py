@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""
+单连接流水线式方案生成
+在一个SSE流中依次完成 关键信息提取 → 大纲生成 → 章节生成，
+并让后续步骤在前一步的部分结果可用时立即开始。
+"""
+
+import asyncio
+import threading
+import time
+import uuid
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+import logging
+
+from config import catalog
+from streaming_json import IncrementalJSONParser
+
+logger = logging.getLogger("medical_ai_agent")
+
+# 等待确认时轮询共享目录的间隔（秒）；确认请求可能落在任一API工作进程上
+GATE_POLL_SECONDS = 0.5
+
+
+def confirm_workflow(workflow_id: str, gate: str, payload: Optional[Any] = None) -> bool:
+    """放行指定工作流的确认关卡，返回是否找到对应的等待关卡
+
+    关卡记录在共享目录中，由运行该工作流的进程轮询，因此可在任一工作进程上调用。
+    """
+    return catalog.confirm_gate(workflow_id, gate, payload)
+
+
+class ProtocolPipeline:
+    """流水线式方案生成器 - 在单个连接内串联提取、大纲和章节生成"""
+
+    def __init__(
+        self,
+        llm_stream: Callable,
+        embedding_searcher: Callable,
+        extraction_prompt_builder: Callable[[str], str],
+        outline_prompt_builder: Callable[[Dict[str, Any]], str],
+        section_prompt_builder: Callable[[str, Dict[str, Any], List[Dict]], str],
+        extraction_parser: Callable[[str], Dict[str, Any]],
+        fallback_outline: Callable[[Dict[str, Any]], List[Dict[str, Any]]],
+        extraction_system_prompt: Optional[str] = None,
+        outline_system_prompt: Optional[str] = None,
+    ):
+        """
+        初始化流水线
+
+        Args:
+            llm_stream: 同步的流式LLM调用函数 (prompt, system_prompt, temperature)
+            embedding_searcher: 异步向量搜索函数
+            extraction_prompt_builder: 根据原始输入构建提取提示词
+            outline_prompt_builder: 根据确认信息构建大纲提示词
+            section_prompt_builder: 根据章节标题、确认信息和知识构建章节提示词
+            extraction_parser: 将提取输出解析为字典
+            fallback_outline: 大纲解析失败时使用的标准大纲
+        """
+        self.llm_stream = llm_stream
+        self.embedding_searcher = embedding_searcher
+        self.extraction_prompt_builder = extraction_prompt_builder
+        self.outline_prompt_builder = outline_prompt_builder
+        self.section_prompt_builder = section_prompt_builder
+        self.extraction_parser = extraction_parser
+        self.fallback_outline = fallback_outline
+        self.extraction_system_prompt = extraction_system_prompt
+        self.outline_system_prompt = outline_system_prompt
+
+        self.workflow_id = uuid.uuid4().hex
+        self._events: asyncio.Queue = asyncio.Queue()
+
+    async def _emit(self, event: Dict[str, Any]):
+        await self._events.put(event)
+
+    async def _stream_tokens(self, prompt: str, system_prompt: Optional[str], temperature: float) -> AsyncIterator[str]:
+        """在线程池中迭代同步的LLM流，避免阻塞事件循环
+
+        客户端断开或流水线取消时设置 cancelled，生产线程在下一个token处停止并关闭上游响应，
+        不再继续占用线程和消耗API token。
+        """
+        loop = asyncio.get_running_loop()
+        tokens: asyncio.Queue = asyncio.Queue()
+        cancelled = threading.Event()
+
+        def put(item):
+            if cancelled.is_set():
+                return
+            try:
+                loop.call_soon_threadsafe(tokens.put_nowait, item)
+            except RuntimeError:  # 事件循环已关闭
+                cancelled.set()
+
+        def worker():
+            stream = self.llm_stream(prompt, system_prompt, temperature)
+            try:
+                for token in stream:
+                    if cancelled.is_set():
+                        break
+                    put(("token", token))
+            except Exception as e:
+                put(("error", e))
+            finally:
+                # 关闭生成器即关闭其中的HTTP响应
+                close = getattr(stream, "close", None)
+                if close:
+                    close()
+                put(("end", None))
+
+        loop.run_in_executor(None, worker)
+        try:
+            while True:
+                kind, value = await tokens.get()
+                if kind == "token":
+                    yield value
+                elif kind == "error":
+                    raise value
+                else:
+                    break
+        finally:
+            cancelled.set()
+
+    async def _wait_gate(self, gate: str, data: Any, timeout: float) -> Any:
+        """发送等待确认事件并挂起，直到客户端调用确认接口（payload为用户修改后的数据，可为空）"""
+        await asyncio.to_thread(catalog.open_gate, self.workflow_id, gate, time.time())
+        await self._emit({
+            "type": "awaiting_confirmation",
+            "gate": gate,
+            "workflow_id": self.workflow_id,
+            "content": data,
+        })
+        deadline = time.monotonic() + timeout
+        try:
+            while True:
+                confirmed, payload = await asyncio.to_thread(catalog.gate_confirmation, self.workflow_id, gate)
+                if confirmed:
+                    break
+                if time.monotonic() >= deadline:
+                    raise asyncio.TimeoutError()
+                await asyncio.sleep(min(GATE_POLL_SECONDS, max(0.0, deadline - time.monotonic())))
+        finally:
+            try:
+                await asyncio.to_thread(catalog.close_gate, self.workflow_id, gate)
+            except Exception as e:
+                logger.warning(f"⚠️ 清理确认关卡失败: {e}")
+        return data if payload is None else payload
+
+    async def _retrieve_knowledge(self, confirmed_info: Dict[str, Any], knowledge_types: Optional[List[str]]) -> List[Dict]:
+        """基于药物类型和适应症进行知识检索"""
+        drug_type = confirmed_info.get('drug_type', '')
+        indication = confirmed_info.get('indication', confirmed_info.get('disease', ''))
+        study_phase = confirmed_info.get('study_phase', confirmed_info.get('trial_phase', ''))
+        search_queries = [
+            f"{drug_type} {indication}",
+            f"{study_phase} 临床试验设计",
+            f"{indication} 入组标准",
+        ]
+        results = []
+        for query in search_queries:
+            if not query.strip():
+                continue
+            try:
+                search_result = await self.embedding_searcher(query, top_k=3, types=knowledge_types or None)
+                if search_result.get('success'):
+                    results.extend(search_result['results'])
+            except Exception as e:
+                logger.warning(f"流水线知识检索失败 '{query}': {e}")
+        results.sort(key=lambda x: x.get('score', 0), reverse=True)
+        return results
+
+    async def _generate_section(self, index: int, section: Dict[str, Any], confirmed_info: Dict[str, Any],
+                                knowledge_task: asyncio.Task, semaphore: asyncio.Semaphore,
+                                temperature: float) -> str:
+        """生成单个章节并把事件写入共享队列"""
+        async with semaphore:
+            title = section.get('title', f"章节{index + 1}")
+            knowledge_results = await knowledge_task
+            relevant_knowledge = [k for k in knowledge_results
+                                  if any(keyword in k['content'] for keyword in title.split())]
+            if not relevant_knowledge:
+                relevant_knowledge = knowledge_results
+            prompt = self.section_prompt_builder(title, confirmed_info, relevant_knowledge)
+
+            await self._emit({"type": "section_start", "index": index, "title": title})
+            section_text = ""
+            try:
+                async for token in self._stream_tokens(prompt, None, temperature):
+                    section_text += token
+                    await self._emit({"type": "section_content", "index": index, "content": token})
+            except Exception as e:
+                logger.error(f"章节 {title} 生成失败: {e}")
+                await self._emit({"type": "section_error", "index": index, "title": title, "content": str(e)})
+                return ""
+            await self._emit({"type": "section_done", "index": index, "title": title, "content": section_text})
+            return section_text
+
+    async def _orchestrate(self, input_text: str, settings: Dict[str, Any]):
+        """依次驱动各阶段，章节生成在大纲流式输出期间并行展开"""
+        knowledge_types = settings.get('knowledge_types') or None
+        gate_timeout = settings.get('confirmation_timeout', 600)
+        temperature = settings.get('detail_level', 0.3)
+        semaphore = asyncio.Semaphore(max(1, int(settings.get('max_parallel_sections', 3))))
+        knowledge_task: Optional[asyncio.Task] = None
+        section_tasks: List[asyncio.Task] = []
+
+        try:
+            # 1. 关键信息提取
+            extraction_prompt = self.extraction_prompt_builder(input_text)
+            await self._emit({"type": "stage", "stage": "extract"})
+            await self._emit({"type": "system_prompt", "stage": "extract", "content": extraction_prompt})
+
+            accumulated = ""
+            early_fields: Dict[str, Any] = {}
+            extraction = IncrementalJSONParser("{")
+            async for token in self._stream_tokens(extraction_prompt, self.extraction_system_prompt, 0.1):
+                accumulated += token
+                await self._emit({"type": "content", "stage": "extract", "content": token})
+                for key, value in extraction.feed(token):
+                    early_fields[key] = value
+                    await self._emit({"type": "extracted_field", "key": key, "content": value})
+                if knowledge_task is None:
+                    if early_fields.get('drug_type') and (early_fields.get('disease') or early_fields.get('indication')):
+                        knowledge_task = asyncio.create_task(self._retrieve_knowledge(early_fields, knowledge_types))
+                        await self._emit({"type": "retrieval_started", "content": dict(early_fields)})
+
+            extracted_info = self.extraction_parser(accumulated)
+            confirmed_info = dict(extracted_info)
+            confirmed_info.setdefault('indication', extracted_info.get('disease', ''))
+            confirmed_info.setdefault('study_phase', extracted_info.get('trial_phase', ''))
+            await self._emit({"type": "extracted_info", "content": extracted_info})
+
+            if settings.get('confirm_info'):
+                confirmed_info = await self._wait_gate('info', confirmed_info, gate_timeout)
+                if knowledge_task is not None and (
+                    confirmed_info.get('drug_type') != early_fields.get('drug_type')
+                    or confirmed_info.get('indication') not in (early_fields.get('indication'), early_fields.get('disease'))
+                ):
+                    knowledge_task.cancel()
+                    knowledge_task = None
+            if knowledge_task is None:
+                knowledge_task = asyncio.create_task(self._retrieve_knowledge(confirmed_info, knowledge_types))
+                await self._emit({"type": "retrieval_started", "content": {
+                    "drug_type": confirmed_info.get('drug_type', ''),
+                    "indication": confirmed_info.get('indication', ''),
+                }})
+
+            # 2. 大纲生成，每解析出一个章节即开始生成
+            confirm_outline = bool(settings.get('confirm_outline'))
+            outline_prompt = self.outline_prompt_builder(confirmed_info)
+            await self._emit({"type": "stage", "stage": "outline"})
+            await self._emit({"type": "system_prompt", "stage": "outline", "content": outline_prompt})
+
+            outline: List[Dict[str, Any]] = []
+            outline_parser = IncrementalJSONParser("[", dict)
+            async for token in self._stream_tokens(outline_prompt, self.outline_system_prompt, 0.2):
+                await self._emit({"type": "content", "stage": "outline", "content": token})
+                for _, entry in outline_parser.feed(token):
+                    if not isinstance(entry, dict) or 'title' not in entry:
+                        continue
+                    entry.setdefault('subsections', [])
+                    index = len(outline)
+                    outline.append(entry)
+                    await self._emit({"type": "outline_entry", "index": index, "content": entry})
+                    if not confirm_outline:
+                        section_tasks.append(asyncio.create_task(self._generate_section(
+                            index, entry, confirmed_info, knowledge_task, semaphore, temperature)))
+
+            if not outline:
+                outline = self.fallback_outline(confirmed_info)
+                for index, entry in enumerate(outline):
+                    await self._emit({"type": "outline_entry", "index": index, "content": entry})
+                    if not confirm_outline:
+                        section_tasks.append(asyncio.create_task(self._generate_section(
+                            index, entry, confirmed_info, knowledge_task, semaphore, temperature)))
+            await self._emit({"type": "outline", "content": outline})
+
+            if confirm_outline:
+                outline = await self._wait_gate('outline', outline, gate_timeout)
+                for index, entry in enumerate(outline):
+                    section_tasks.append(asyncio.create_task(self._generate_section(
+                        index, entry, confirmed_info, knowledge_task, semaphore, temperature)))
+
+            # 3. 等待全部章节完成，按大纲顺序汇总
+            await self._emit({"type": "stage", "stage": "sections"})
+            section_texts = await asyncio.gather(*section_tasks)
+            full_content = "".join(
+                f"\n## {entry.get('title', '')}\n\n{text}\n" for entry, text in zip(outline, section_texts)
+            )
+            await self._emit({
+                "type": "done",
+                "content": "",
+                "sections_completed": sum(1 for text in section_texts if text),
+                "total_length": len(full_content),
+            })
+        except asyncio.TimeoutError:
+            await self._emit({"type": "error", "content": "等待确认超时，工作流已终止"})
+        except Exception as e:
+            logger.error(f"流水线生成失败: {e}")
+            await self._emit({"type": "error", "content": str(e)})
+        finally:
+            for task in section_tasks:
+                task.cancel()
+            if knowledge_task is not None:
+                knowledge_task.cancel()
+            await self._events.put(None)
+
+    async def run(self, input_text: str, settings: Optional[Dict[str, Any]] = None) -> AsyncIterator[Dict[str, Any]]:
+        """运行流水线，按发生顺序产出类型化事件"""
+        settings = settings or {}
+        orchestrator = asyncio.create_task(self._orchestrate(input_text, settings))
+        try:
+            yield {"type": "workflow", "workflow_id": self.workflow_id}
+            while True:
+                event = await self._events.get()
+                if event is None:
+                    break
+                yield event
+        finally:
+            orchestrator.cancel()
@@ -11,21 +11,29 @@ from typing import Dict, List, Any, Optional, Callable
 from datetime import datetime
 import logging
 
+from chunk_store import chunk_hash
+from config import QUALITY_CHECK_TOKEN_BUDGET
+from context_packer import pack_context, truncate_to_tokens
+
 logger = logging.getLogger("medical_ai_agent")
 
 class RealProtocolGenerator:
     """真实的临床试验方案生成器 - 分步骤生成真实内容"""
     
-    def __init__(self, llm_caller: Callable, embedding_searcher: Callable):
+    def __init__(self, llm_caller: Callable, embedding_searcher: Callable,
+                 context_token_budget: Optional[int] = None):
         """
         初始化生成器
         
         Args:
             llm_caller: LLM调用函数
             embedding_searcher: 向量搜索函数
+            context_token_budget: 知识库上下文的token预算，默认按当前模型配置
         """
         self.llm_caller = llm_caller
         self.embedding_searcher = embedding_searcher
+        self.context_token_budget = context_token_budget
+        self.last_context_info: Dict[str, Any] = {}
         self.progress_callback = None
         
         # 模块生成顺序和配置
@@ -250,7 +258,7 @@ class RealProtocolGenerator:
         seen_content = set()
         
         for doc in all_relevant_docs:
-            content_hash = hash(doc.get('content', '')[:100])
+            content_hash = doc.get('content_hash') or chunk_hash(doc.get('content', ''))
             if content_hash not in seen_content:
                 unique_docs.append(doc)
                 seen_content.add(content_hash)
@@ -272,7 +280,12 @@ class RealProtocolGenerator:
         cumulative_progress = 0
         
         # 构建知识库上下文
-        knowledge_context = self._build_knowledge_context(relevant_docs[:5])
+        knowledge_context = self._build_knowledge_context(relevant_docs)
+        if self.last_context_info:
+            info = self.last_context_info
+            await self.update_progress("内容生成", 0, "进行中",
+                                       f"知识上下文: {info['chunks_used']}/{info['chunks_available']} 个分块，"
+                                       f"{info['packed_tokens']}/{info['budget_tokens']} tokens")
         
         for i, module in enumerate(self.generation_modules):
             module_name = module['name']
@@ -313,14 +326,16 @@ class RealProtocolGenerator:
     def _build_knowledge_context(self, relevant_docs: List[Dict]) -> str:
         """构建知识库上下文"""
         if not relevant_docs:
+            self.last_context_info = {}
             return "无相关知识库内容"
         
-        context_parts = []
-        for i, doc in enumerate(relevant_docs[:3]):  # 只取前3个最相关的
-            content = doc.get('content', '')[:500]  # 限制长度
-            context_parts.append(f"参考资料{i+1}: {content}")
-        
-        return "\n\n".join(context_parts)
+        # 按相关度在token预算内打包，去除重叠的分块
+        context, self.last_context_info = pack_context(
+            relevant_docs,
+            self.context_token_budget,
+            formatter=lambda i, doc, content: f"参考资料{i+1}: {content}",
+        )
+        return context
     
     def _build_module_prompt(self, module_key: str, user_requirement: str, 
                            extracted_info: Dict, knowledge_context: str, temperature: float) -> str:
@@ -568,11 +583,12 @@ class RealProtocolGenerator:
     
     def _build_quality_check_prompt(self, check_type: str, content: str) -> str:
         """构建质量检查提示词"""
+        content = truncate_to_tokens(content, QUALITY_CHECK_TOKEN_BUDGET)
         check_prompts = {
             "模块完整性": f"""
             请评估以下临床试验方案的模块完整性（0-100分）：
 
-            {content[:2000]}...
+            {content}...
 
             评估要点：
             1. 是否包含必要的所有模块
@@ -586,7 +602,7 @@ class RealProtocolGenerator:
             "科学严谨性": f"""
             请评估以下临床试验方案的科学严谨性（0-100分）：
 
-            {content[:2000]}...
+            {content}...
 
             评估要点：
             1. 科学假设是否合理
@@ -600,7 +616,7 @@ class RealProtocolGenerator:
             "法规合规性": f"""
             请评估以下临床试验方案的法规合规性（0-100分）：
 
-            {content[:2000]}...
+            {content}...
 
             评估要点：
             1. 是否符合GCP要求
@@ -614,7 +630,7 @@ class RealProtocolGenerator:
             "逻辑一致性": f"""
             请评估以下临床试验方案的逻辑一致性（0-100分）：
 
-            {content[:2000]}...
+            {content}...
 
             评估要点：
             1. 各部分逻辑是否连贯
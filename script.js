@@ -632,7 +632,7 @@ window.uploadFiles = async function() {
                 
                 if (response.ok && result.success) {
                     successCount++;
-                    showToast(`文件 ${file.name} 上传成功，添加了 ${result.records_added} 条记录`, 'success');
+                    showToast(result.job_id ? `文件 ${file.name} 上传成功，正在后台入库` : `文件 ${file.name} 上传成功，添加了 ${result.records_added} 条记录`, 'success');
                 } else {
                     errorCount++;
                     showToast(`文件 ${file.name} 上传失败: ${result.message || '未知错误'}`, 'error');
@@ -1120,28 +1120,40 @@ function updateStatsDetails(stats) {
     `;
 }
 
-async function loadFileList() {
+// 文件列表按页加载，只请求列表显示所需的字段
+const FILE_LIST_FIELDS = 'filename,size,modified,upload_time';
+let fileListCursor = null;
+
+async function loadFileList(append = false) {
     try {
-        const response = await fetch(`${API_BASE_URL}/knowledge/files`);
+        const params = new URLSearchParams({ fields: FILE_LIST_FIELDS });
+        if (append && fileListCursor) {
+            params.set('cursor', fileListCursor);
+        }
+        const response = await fetch(`${API_BASE_URL}/knowledge/files?${params}`);
         if (response.ok) {
             const data = await response.json();
-            updateFileList(data.files);
+            fileListCursor = data.next_cursor || null;
+            updateFileList(data.files, append);
         }
     } catch (error) {
         console.error('加载文件列表失败:', error);
     }
 }
 
-function updateFileList(files) {
+function updateFileList(files, append = false) {
     const container = document.getElementById('file-list');
     if (!container) return;
 
-    if (files.length === 0) {
+    const moreButton = document.getElementById('file-list-more');
+    if (moreButton) moreButton.remove();
+
+    if (files.length === 0 && !append) {
         container.innerHTML = '<p style="text-align: center; color: #64748b;">暂无已上传的文件</p>';
         return;
     }
 
-    container.innerHTML = files.map(file => `
+    const itemsHtml = files.map(file => `
         <div class="file-item" style="display: flex; justify-content: space-between; align-items: center; padding: 1rem; border: 1px solid #e2e8f0; border-radius: 8px; margin-bottom: 0.5rem;">
             <div class="file-info" style="display: flex; align-items: center; gap: 1rem;">
                 <i class="fas fa-file" style="color: #6b7280;"></i>
@@ -1155,6 +1167,20 @@ function updateFileList(files) {
             </button>
         </div>
     `).join('');
+
+    if (append) {
+        container.insertAdjacentHTML('beforeend', itemsHtml);
+    } else {
+        container.innerHTML = itemsHtml;
+    }
+
+    if (fileListCursor) {
+        container.insertAdjacentHTML('beforeend', `
+            <button id="file-list-more" class="btn btn-secondary" onclick="loadFileList(true)" style="width: 100%; margin-top: 0.5rem;">
+                加载更多
+            </button>
+        `);
+    }
 }
 
 function displaySearchResults(results, searchInfo = null) {
@@ -0,0 +1,85 @@
+import hashlib
+import json
+import logging
+import os
+from datetime import datetime
+from typing import Optional
+
+from data_persistence import DATA_DIR
+
+logger = logging.getLogger("medical_ai_agent")
+
+SECTION_CACHE_DIR = DATA_DIR / "section_cache"
+
+# Cached sections kept on disk; the least recently used ones are evicted
+SECTION_CACHE_MAX_ENTRIES = 1000
+
+
+def section_cache_key(prompt: str, model: str, temperature: float, kb_version: int) -> str:
+    """Hash the inputs that determine a generated section.
+
+    The key starts with the knowledge-base version, so entries of older
+    versions, which can never be hit again, are recognized and pruned.
+    """
+    payload = json.dumps(
+        {"prompt": prompt, "model": model, "temperature": temperature, "kb_version": kb_version},
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return f"{kb_version}-{hashlib.sha256(payload.encode('utf-8')).hexdigest()}"
+
+
+def _key_version(key: str) -> int:
+    try:
+        return int(key.split("-", 1)[0])
+    except ValueError:  # entries written before keys carried the version
+        return -1
+
+
+def get_cached_section(key: str) -> Optional[str]:
+    """Return the cached section text for key, or None."""
+    path = SECTION_CACHE_DIR / f"{key}.json"
+    if not path.exists():
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            content = json.load(f)["content"]
+        # the modification time orders entries for eviction
+        os.utime(path)
+        return content
+    except Exception as e:
+        logger.warning(f"读取章节缓存失败: {e}")
+        return None
+
+
+def store_section(key: str, content: str) -> None:
+    """Persist a generated section under key and prune the cache."""
+    SECTION_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    path = SECTION_CACHE_DIR / f"{key}.json"
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"content": content, "created": datetime.now().isoformat()}, f, ensure_ascii=False)
+    tmp_path.replace(path)
+    prune_section_cache(_key_version(key))
+
+
+def prune_section_cache(kb_version: int, max_entries: Optional[int] = None) -> int:
+    """Delete entries of knowledge-base versions before ``kb_version``, then
+    the least recently used ones beyond ``max_entries``; return how many."""
+    max_entries = SECTION_CACHE_MAX_ENTRIES if max_entries is None else max_entries
+    entries = []
+    removed = 0
+    for path in SECTION_CACHE_DIR.glob("*.json"):
+        try:
+            if _key_version(path.stem) < kb_version:
+                path.unlink()
+                removed += 1
+            else:
+                entries.append((path.stat().st_mtime, path))
+        except FileNotFoundError:  # pruned by another worker
+            continue
+    entries.sort()
+    for _, path in entries[:max(0, len(entries) - max_entries)]:
+        path.unlink(missing_ok=True)
+        removed += 1
+    return removed
@@ -0,0 +1,369 @@
+import asyncio
+import atexit
+import heapq
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import uuid
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: index builds are only serialized within one process
+    fcntl = None
+
+from chunk_store import chunk_knowledge_types, store
+from config import SEARCH_SHARDS, SHARDED_SEARCH_MIN_VECTORS
+from data_persistence import SEARCH_INDEX_DIR
+
+logger = logging.getLogger("medical_ai_agent")
+
+# Knowledge types are matched through a 64-bit mask per vector
+MAX_INDEXED_TYPES = 64
+
+# Rows normalized and written at a time while building an index
+BUILD_BLOCK_ROWS = 4096
+
+# A new index is built once the records it does not cover plus its rows
+# deleted since exceed this share of its rows
+REBUILD_RATIO = 0.1
+
+# Index files kept next to the newest one, for workers still mapping them
+KEPT_INDEXES = 1
+
+
+def merge_top_k(parts: Iterable[Tuple[Sequence[int], Sequence[float]]], k: int) -> List[Tuple[int, float]]:
+    """Merge per-shard ``(rows, scores)`` into the overall best ``k``, best first."""
+    candidates = ((score, row) for rows, scores in parts for row, score in zip(rows, scores))
+    return [(row, score) for score, row in heapq.nlargest(k, candidates)]
+
+
+def _matches(doc, types: Optional[Iterable[str]]) -> bool:
+    return not types or doc.knowledge_type in types or bool(chunk_knowledge_types(doc) & set(types))
+
+
+# -- shard workers ----------------------------------------------------------
+
+# Index files mapped by this pool process, most recently used last
+_attached: "OrderedDict[str, np.ndarray]" = OrderedDict()
+_ATTACHED_LIMIT = 8
+
+
+def _attach(path: str, dtype, shape: tuple) -> "np.ndarray":
+    array = _attached.get(path)
+    if array is None:
+        array = np.memmap(path, dtype=dtype, mode="r", shape=shape)
+        _attached[path] = array
+        while len(_attached) > _ATTACHED_LIMIT:
+            _attached.popitem(last=False)
+    _attached.move_to_end(path)
+    return array
+
+
+def _score_shard(stem: str, rows: int, dimension: int, start: int, end: int,
+                 query: bytes, k: int, type_mask: int) -> Tuple[List[int], List[float]]:
+    """Local top-k of rows ``start:end``, run in a pool process."""
+    matrix = _attach(stem + ".f32", np.float32, (rows, dimension))[start:end]
+    scores = np.asarray(matrix @ np.frombuffer(query, dtype=np.float32))
+    if type_mask:
+        types = _attach(stem + ".types", np.uint64, (rows,))[start:end]
+        scores[(types & np.uint64(type_mask)) == 0] = -np.inf
+    k = min(k, len(scores))
+    if k <= 0:
+        return [], []
+    best = np.argpartition(-scores, k - 1)[:k]
+    best = best[np.isfinite(scores[best])]
+    return (best + start).tolist(), scores[best].tolist()
+
+
+# -- index ------------------------------------------------------------------
+
+class ShardedIndex:
+    """Normalized float32 embedding matrix of one store version, in files
+    that every worker process on the host maps.
+
+    ``build`` writes the matrix, a knowledge-type bit mask per row and the
+    row hashes under ``SEARCH_INDEX_DIR``; other workers ``open`` the same
+    files instead of building their own, so the host holds one copy in its
+    page cache. The rows are split into ``shards`` contiguous ranges; each
+    range is scored by a pool process mapping the file, which returns its
+    local top-k, and the results are merged. Scores are cosine similarities.
+
+    An index keeps serving later snapshots of the store. Rows whose record
+    was deleted or replaced since the index was opened are dropped from the
+    candidates, the shards returning that many extra, and live records
+    without a row are scored in this process.
+    """
+
+    def __init__(self, stem: str, dimension: int, type_ids: dict, records: List[Any],
+                 uncovered: List[Any], epoch: int, version: int, shards: int):
+        self.stem = stem
+        self.rows = len(records)
+        self.dimension = dimension
+        self.type_ids = type_ids
+        # row -> record live when the index was opened (None if it was gone)
+        self.records = records
+        # records live when it was opened that have no row
+        self.uncovered = uncovered
+        self.epoch = epoch
+        self.version = version
+        self.shards = max(1, min(shards, self.rows))
+
+    @classmethod
+    def build(cls, snapshot, directory: Path, shards: int) -> Optional["ShardedIndex"]:
+        """Write the index of a store snapshot; None if its vectors cannot be
+        indexed together (mixed dimensions or too many knowledge types)."""
+        records = list(snapshot.documents())
+        dimensions = Counter(len(doc.embedding) for doc in records)
+        if len(dimensions) != 1:
+            return None
+        (dimension, _), = dimensions.items()
+        type_ids: dict = {}
+        type_bits = np.zeros(len(records), dtype=np.uint64)
+        for row, doc in enumerate(records):
+            bits = 0
+            for knowledge_type in chunk_knowledge_types(doc) | {doc.knowledge_type}:
+                type_id = type_ids.setdefault(knowledge_type, len(type_ids))
+                if type_id >= MAX_INDEXED_TYPES:
+                    return None
+                bits |= 1 << type_id
+            type_bits[row] = bits
+
+        directory.mkdir(parents=True, exist_ok=True)
+        # unique per build: a pool process may still map an older build of the same version
+        stem = str(directory / f"{snapshot.version:012d}-{uuid.uuid4().hex[:8]}")
+        with open(stem + ".f32.tmp", "wb") as f:
+            for start in range(0, len(records), BUILD_BLOCK_ROWS):
+                # embeddings are buffers (array or segment views), converted a block at a time
+                block = np.asarray([doc.embedding for doc in records[start:start + BUILD_BLOCK_ROWS]],
+                                   dtype=np.float32)
+                norms = np.linalg.norm(block, axis=1, keepdims=True)
+                norms[norms == 0] = 1.0
+                block /= norms
+                block.tofile(f)
+        type_bits.tofile(stem + ".types.tmp")
+        with open(stem + ".hashes.tmp", "w", encoding="ascii") as f:
+            f.write("\n".join(doc.content_hash for doc in records))
+        with open(stem + ".json.tmp", "w", encoding="utf-8") as f:
+            json.dump({"version": snapshot.version, "rows": len(records), "dimension": dimension,
+                       "type_ids": type_ids}, f, ensure_ascii=False)
+        # the header goes last: an index is complete once its .json exists
+        for suffix in (".f32", ".types", ".hashes", ".json"):
+            os.replace(stem + suffix + ".tmp", stem + suffix)
+        return cls(stem, dimension, type_ids, records, [], snapshot.epoch, snapshot.version, shards)
+
+    @classmethod
+    def open(cls, stem: str, snapshot, shards: int) -> Optional["ShardedIndex"]:
+        """Map an index written by ``build``, possibly in another worker, for
+        the records of ``snapshot``; None if they cannot share it."""
+        with open(stem + ".json", encoding="utf-8") as f:
+            header = json.load(f)
+        with open(stem + ".hashes", encoding="ascii") as f:
+            hashes = f.read().split("\n") if header["rows"] else []
+        records = [snapshot.get(content_hash) for content_hash in hashes]
+        covered = set(hashes)
+        uncovered = [doc for doc in snapshot.documents() if doc.content_hash not in covered]
+        if any(len(doc.embedding) != header["dimension"] for doc in uncovered):
+            return None
+        return cls(stem, header["dimension"], header["type_ids"], records, uncovered,
+                   snapshot.epoch, snapshot.version, shards)
+
+    def delta(self, snapshot) -> Tuple[List[Any], int]:
+        """Live records of ``snapshot`` without a live row, and the number of
+        rows whose record is no longer live in it."""
+        unindexed = [doc for doc in self.uncovered if snapshot.get(doc.content_hash) is doc]
+        unindexed += snapshot.added_since(self.epoch)
+        return unindexed, self.rows - (len(snapshot) - len(unindexed))
+
+    def _live(self, snapshot, row: int):
+        doc = self.records[row]
+        if doc is not None and snapshot.get(doc.content_hash) is doc:
+            return doc
+        return None
+
+    def type_mask(self, types: Optional[Iterable[str]]) -> Optional[int]:
+        """Bit mask of ``types`` (0 for no filter); None if none of them is indexed."""
+        if not types:
+            return 0
+        mask = 0
+        for knowledge_type in types:
+            if knowledge_type in self.type_ids:
+                mask |= 1 << self.type_ids[knowledge_type]
+        return mask or None
+
+    async def search(self, pool: ProcessPoolExecutor, snapshot, query: Sequence[float], top_k: int,
+                     types: Optional[Iterable[str]] = None,
+                     delta: Optional[Tuple[List[Any], int]] = None) -> Optional[List[Tuple[Any, float]]]:
+        """The ``top_k`` best ``(record, score)`` pairs of ``snapshot``, best
+        first; None if its records differ from the rows too much for the
+        index to help. ``delta`` is ``self.delta(snapshot)`` if already known."""
+        unindexed, dead = delta or self.delta(snapshot)
+        if dead + len(unindexed) > self.rows:
+            return None
+        if top_k <= 0:
+            return []
+        vector = np.asarray(query, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if vector.shape != (self.dimension,) or norm == 0:
+            return []
+        vector = vector / norm
+        found: List[Tuple[Any, float]] = []
+
+        mask = self.type_mask(types)
+        if mask is not None:
+            # dead rows may rank among the best, so ask each shard for as many more
+            k = top_k + dead
+            query_bytes = vector.tobytes()
+            bounds = np.linspace(0, self.rows, self.shards + 1, dtype=int)
+            parts = await asyncio.gather(*(
+                asyncio.wrap_future(pool.submit(_score_shard, self.stem, self.rows, self.dimension,
+                                                int(start), int(end), query_bytes, k, mask))
+                for start, end in zip(bounds[:-1], bounds[1:])))
+            for row, score in merge_top_k(parts, k):
+                doc = self._live(snapshot, row)
+                if doc is not None:
+                    found.append((doc, score))
+
+        unindexed = [doc for doc in unindexed if _matches(doc, types)]
+        if unindexed:
+            matrix = np.asarray([doc.embedding for doc in unindexed], dtype=np.float32)
+            norms = np.linalg.norm(matrix, axis=1)
+            norms[norms == 0] = 1.0
+            found.extend(zip(unindexed, ((matrix @ vector) / norms).tolist()))
+        return heapq.nlargest(top_k, found, key=lambda pair: pair[1])
+
+
+# -- search entry point -----------------------------------------------------
+
+_pool: Optional[ProcessPoolExecutor] = None
+_index: Optional[ShardedIndex] = None
+_building = False
+_lock = threading.Lock()
+
+
+def get_pool() -> ProcessPoolExecutor:
+    """The shard process pool, started on first use."""
+    global _pool
+    with _lock:
+        if _pool is None:
+            # spawn: forking a threaded server process is unsafe
+            _pool = ProcessPoolExecutor(max_workers=SEARCH_SHARDS, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def _stale(index: Optional[ShardedIndex], snapshot) -> bool:
+    if index is None:
+        return True
+    unindexed, dead = index.delta(snapshot)
+    return dead + len(unindexed) > REBUILD_RATIO * index.rows
+
+
+@contextmanager
+def _build_lock():
+    """Let one worker of the host build an index at a time."""
+    SEARCH_INDEX_DIR.mkdir(parents=True, exist_ok=True)
+    with open(SEARCH_INDEX_DIR / ".lock", "a") as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _stems() -> List[str]:
+    """Complete index files, oldest version first."""
+    return sorted(str(path)[:-len(".json")] for path in SEARCH_INDEX_DIR.glob("*.json"))
+
+
+def _open_newest(snapshot) -> Optional[ShardedIndex]:
+    """Open the newest index written for this snapshot's version or an older one."""
+    for stem in reversed(_stems()):
+        if int(Path(stem).name.split("-")[0]) <= snapshot.version:
+            try:
+                return ShardedIndex.open(stem, snapshot, SEARCH_SHARDS)
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"⚠️ 无法打开分片搜索索引 {stem}: {e}")
+                return None
+    return None
+
+
+def _prune(keep: str):
+    stems = _stems()
+    for stem in stems[:max(0, stems.index(keep) - KEPT_INDEXES)]:
+        for suffix in (".json", ".f32", ".types", ".hashes"):
+            try:
+                os.remove(stem + suffix)
+            except FileNotFoundError:
+                pass
+            except PermissionError:
+                # Windows cannot delete a file that is still mapped; the next build retries
+                pass
+
+
+def _build():
+    global _index, _building
+    try:
+        snapshot = store.snapshot()
+        index = _open_newest(snapshot)
+        if _stale(index, snapshot):
+            with _build_lock():
+                # another worker may have written a fresh index while we waited
+                snapshot = store.snapshot()
+                index = _open_newest(snapshot)
+                if _stale(index, snapshot):
+                    index = ShardedIndex.build(snapshot, SEARCH_INDEX_DIR, SEARCH_SHARDS)
+                    if index is not None:
+                        _prune(index.stem)
+        if index is None:
+            logger.info("ℹ️ 向量维度不一致或知识类型过多，分片搜索不可用")
+        else:
+            logger.info(f"🧩 分片搜索索引已就绪: {index.rows} 个向量，{index.shards} 个分片，版本 {index.version}")
+        with _lock:
+            _index = index
+    except Exception as e:
+        logger.error(f"❌ 建立分片搜索索引失败: {e}")
+    finally:
+        _building = False
+
+
+async def sharded_search(snapshot, query: Sequence[float], top_k: int,
+                         types: Optional[Iterable[str]] = None) -> Optional[List[Tuple[Any, float]]]:
+    """Score ``snapshot`` on the shard pool if sharded search is enabled and
+    an index is open; otherwise return None and let the caller scan the
+    snapshot itself.
+
+    The current index serves later versions too: only the records it does
+    not cover are scored here. Once they (or its deleted rows) pass
+    ``REBUILD_RATIO`` of its rows, a new index is built in the background
+    while the old one keeps serving.
+    """
+    global _building
+    if SEARCH_SHARDS < 2 or len(snapshot) < SHARDED_SEARCH_MIN_VECTORS:
+        return None
+    with _lock:
+        index = _index
+    delta = index.delta(snapshot) if index is not None else None
+    unindexed, dead = delta or ([], 0)
+    with _lock:
+        if (index is None or dead + len(unindexed) > REBUILD_RATIO * index.rows) and not _building:
+            _building = True
+            threading.Thread(target=_build, name="sharded-index-builder", daemon=True).start()
+    if index is None:
+        return None
+    return await index.search(get_pool(), snapshot, query, top_k, types, delta)
+
+
+@atexit.register
+def _shutdown():
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
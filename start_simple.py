@@ -12,28 +12,48 @@ import json
 import uvicorn
 import os
 import shutil
+import zipfile
 from module_templates import MODULE_TEMPLATES
 from datetime import datetime
 import requests
 
 from logging_setup import setup_logging
 from config import (
+    API_WORKERS,
     current_config,
-    embedded_documents,
-    uploaded_files,
     knowledge_stats,
     UPLOAD_DIR,
     generation_history,
+    QUALITY_CHECK_TOKEN_BUDGET,
 )
 from file_utils import (
-    read_file_with_encoding_detection,
-    chunk_text,
-    extract_text_from_file,
+    read_text_file,
+    spool_upload,
 )
 from embedding_utils import cosine_similarity, get_embedding
+from sharded_search import sharded_search
 from llm_interface import call_local_llm, call_local_llm_stream
-from knowledge_store import search_knowledge_embedding
-from data_persistence import save_data
+from knowledge_store import search_knowledge_embedding, bump_kb_version, get_kb_version
+from section_cache import section_cache_key, get_cached_section, store_section
+from context_packer import pack_context, truncate_to_tokens
+from protocol_pipeline import ProtocolPipeline, confirm_workflow
+from streaming_json import IncrementalJSONParser, parse_json_block
+from fastapi.concurrency import run_in_threadpool
+from chunk_store import (
+    chunk_hash,
+    file_chunk_summary,
+    find_file,
+    get_file_chunks_page,
+    get_file_info,
+    query_files,
+    remove_file,
+    start_loading,
+    start_sync,
+    store,
+    update_file_info,
+)
+from ingestion import ingestion_queue
+from bulk_ingestion import stage_archive, stage_directory
 
 logger = setup_logging()
 
@@ -108,14 +128,17 @@ async def health_check():
 
 @app.get("/status")
 async def get_system_status():
-    """获取系统状态"""
+    """获取系统状态（含知识库后台加载进度）"""
+    loading = store.loading_status()
     return {
-        "status": "healthy",
+        "status": "healthy" if loading["state"] != "failed" else "degraded",
         "version": "1.0.0",
         "knowledge_base_status": {
-            "status": "ready",
+            "status": loading["state"],
             "types_count": 10,
-            "embedded_documents": len(embedded_documents)
+            "embedded_documents": len(store),
+            "kb_version": get_kb_version(),
+            "loading": loading
         },
         "available_models": ["local", "openai", "deepseek"]
     }
@@ -288,6 +311,8 @@ async def update_configuration(
             "model": embed_model,
             "dimension": embed_dimension
         }
+        # 嵌入模型可能已变化，缓存的检索结果不再可靠；新配置同步给其他工作进程
+        await run_in_threadpool(bump_kb_version, current_config)
         
         return {
             "success": True,
@@ -340,24 +365,26 @@ async def generate_protocol(request: ProtocolGenerationRequest):
         seen = set()
         unique_docs = []
         for doc in sorted(all_relevant_docs, key=lambda x: x['score'], reverse=True):
-            doc_id = doc.get('content', '')[:100]  # 用前100字符作为ID
+            doc_id = doc.get('content_hash') or chunk_hash(doc.get('content', ''))
             if doc_id not in seen:
                 seen.add(doc_id)
                 unique_docs.append(doc)
         
         # 3. 生成各模块内容
         protocol_sections = {}
+        context_infos = {}
         for module in ['研究背景与目的', '研究设计', '研究人群', '给药方案', 
                        '安全性评估', '疗效评估', '统计分析', '数据管理与质量控制']:
             
-            # 获取该模块最相关的知识
+            # 该模块相关的知识按相关度在token预算内打包
             module_knowledge = [doc for doc in unique_docs 
                               if any(keyword in doc['content'] 
-                                    for keyword in module.split())][:3]
+                                    for keyword in module.split())]
+            knowledge_context, context_infos[module] = pack_context(module_knowledge)
             
             # 生成该模块
             module_prompt = get_module_generation_prompt(
-                module, extracted_info, module_knowledge
+                module, extracted_info, knowledge_context
             )
             
             module_content = call_local_llm(module_prompt, request.temperature)
@@ -365,6 +392,10 @@ async def generate_protocol(request: ProtocolGenerationRequest):
         
         # 4. 质量检查
         if request.include_quality_check:
+            protocol_summary = truncate_to_tokens(
+                "\n".join(f"## {name}\n{text}" for name, text in protocol_sections.items()),
+                QUALITY_CHECK_TOKEN_BUDGET,
+            )
             quality_check_prompt = f"""
             评估临床试验方案质量：
             1. 完整性（0-25分）：所有必需章节是否齐全
@@ -372,7 +403,7 @@ async def generate_protocol(request: ProtocolGenerationRequest):
             3. 合规性（0-25分）：是否符合法规要求
             4. 一致性（0-25分）：前后逻辑是否一致
             
-            方案概要：{str(protocol_sections)[:2000]}
+            方案概要：{protocol_summary}
             
             给出总分和具体问题。
             """
@@ -384,6 +415,7 @@ async def generate_protocol(request: ProtocolGenerationRequest):
             "protocol_content": protocol_sections,
             "extracted_info": extracted_info,
             "knowledge_used": len(unique_docs),
+            "context": context_infos,
             "quality_report": quality_result if request.include_quality_check else None
         }
         
@@ -491,23 +523,22 @@ async def generate_protocol_simplified(request: ProtocolGenerationRequest):
 
 @app.get("/knowledge/stats")
 async def get_knowledge_stats():
-    """获取知识库统计信息（基于真实向量数据）"""
+    """获取知识库统计信息（增量维护的计数器，与文档数量无关）"""
     try:
-        # 动态计算各类型的真实文档数量
+        counters = store.stats.snapshot()
+        by_type = counters["by_type"]
         real_stats = {}
-        
-        # 从向量数据库中统计各类型文档数量
-        for knowledge_type in knowledge_stats.keys():
-            count = sum(1 for doc in embedded_documents if doc["knowledge_type"] == knowledge_type)
-            real_stats[knowledge_type] = {"document_count": count}
-        
-        # 计算用户上传文档的数量
-        user_uploaded_count = sum(1 for doc in embedded_documents if doc["knowledge_type"] == "用户上传文档")
-        real_stats["用户上传文档"] = {"document_count": user_uploaded_count}
+        for knowledge_type in list(knowledge_stats.keys()) + [t for t in by_type if t not in knowledge_stats]:
+            values = by_type.get(knowledge_type, {})
+            real_stats[knowledge_type] = {
+                "document_count": values.get("chunks", 0),
+                "file_count": values.get("files", 0),
+                "file_bytes": values.get("file_bytes", 0),
+            }
         
         # 添加总体统计信息
-        total_embedded = len(embedded_documents)
-        total_files = len(uploaded_files)
+        total_embedded = counters["total_chunks"]
+        total_files = counters["total_files"]
         
         return {
             "success": True, 
@@ -515,28 +546,43 @@ async def get_knowledge_stats():
             "summary": {
                 "total_embedded_documents": total_embedded,
                 "total_uploaded_files": total_files,
+                "total_file_bytes": counters["total_file_bytes"],
+                "embedding_dimensions": counters["embedding_dimensions"],
                 "embedding_model": current_config["embedding"]["type"],
-                "avg_docs_per_file": total_embedded / total_files if total_files > 0 else 0
+                "avg_docs_per_file": total_embedded / total_files if total_files > 0 else 0,
+                "knowledge_base_status": store.status["state"]
             }
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取统计信息失败: {str(e)}")
 
+@app.get("/metrics")
+async def metrics():
+    """以Prometheus文本格式导出知识库计数器"""
+    from fastapi.responses import PlainTextResponse
+    return PlainTextResponse(store.stats.to_prometheus(), media_type="text/plain; version=0.0.4")
+
 @app.get("/knowledge/search")
 async def search_knowledge(query: str, top_k: int = 5):
     """搜索知识库（真正的向量相似度搜索）"""
+    if not store.ready:
+        return {"success": False, "status": "warming", "results": [],
+                "message": "知识库正在加载，请稍后重试", "loading": store.loading_status()}
     try:
-        if not embedded_documents:
+        # 搜索期间持有开始时的知识库快照，不等待也不受并发入库/删除影响
+        snapshot = store.snapshot()
+        if not len(snapshot):
             return {"success": True, "results": [], "message": "知识库为空，请先上传文档"}
         
         # 获取查询文本的向量
         query_embedding = get_embedding(query)
         
-        # 计算与所有文档的相似度
+        # 计算与所有文档的相似度（大知识库由分片进程池并行计算并只返回top_k）
+        scored = await sharded_search(snapshot, query_embedding, top_k)
+        if scored is None:
+            scored = [(doc, cosine_similarity(query_embedding, doc['embedding'])) for doc in snapshot.documents()]
         results = []
-        for doc in embedded_documents:
-            similarity = cosine_similarity(query_embedding, doc['embedding'])
-            
+        for doc, similarity in scored:
             if similarity > 0.1:  # 只返回相似度大于0.1的结果
                 results.append({
                     "knowledge_type": doc["knowledge_type"],
@@ -553,9 +599,10 @@ async def search_knowledge(query: str, top_k: int = 5):
             "results": results[:top_k],
             "search_info": {
                 "query": query,
-                "total_docs_searched": len(embedded_documents),
+                "total_docs_searched": len(snapshot),
                 "results_found": len(results),
-                "embedding_dimension": len(query_embedding)
+                "embedding_dimension": len(query_embedding),
+                "kb_version": snapshot.version
             }
         }
         
@@ -564,125 +611,233 @@ async def search_knowledge(query: str, top_k: int = 5):
 
 # 添加文本分块功能
 
+async def enqueue_upload(file: UploadFile, knowledge_type: str, title: Optional[str],
+                         replace_filename: Optional[str] = None) -> Dict[str, Any]:
+    """将上传文件写入uploads目录并加入后台入库队列"""
+    # 保存文件到uploads目录
+    file_path = UPLOAD_DIR / file.filename
+    
+    # 如果文件已存在，添加时间戳
+    if file_path.exists():
+        stem = file_path.stem
+        suffix = file_path.suffix
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        file_path = UPLOAD_DIR / f"{stem}_{timestamp}{suffix}"
+    
+    # 分块流式写入磁盘并同时计算哈希，内存占用与文件大小无关
+    file_size, file_hash = await spool_upload(file, file_path)
+    
+    # 提取、分块和向量化交给后台入库任务，请求立即返回任务ID
+    # 目录库的读写可能等待其他进程的写事务，放到线程池中执行，不阻塞事件循环
+    job = await run_in_threadpool(
+        ingestion_queue.enqueue,
+        file_path,
+        original_name=file.filename,
+        knowledge_type=knowledge_type,
+        title=title,
+        size=file_size,
+        sha256=file_hash,
+        replace_filename=replace_filename,
+    )
+    
+    return {
+        "success": True,
+        "message": f"文件 {file.filename} 上传成功，已加入后台入库队列",
+        "job_id": job["id"],
+        "status": job["status"],
+        "file_path": str(file_path),
+        "size": file_size,
+    }
+
 @app.post("/knowledge/upload")
 async def upload_knowledge_file(
     file: UploadFile = File(...),
     knowledge_type: str = Form("用户上传文档"),
     title: Optional[str] = Form(None)
 ):
-    """上传文件到知识库（真正的向量化处理）"""
+    """上传文件到知识库，向量化处理在后台任务中进行，可通过 /knowledge/jobs/{job_id} 查询进度"""
     try:
-        # 读取文件内容
-        file_content = await file.read()
-        
-        # 保存文件到uploads目录
-        file_path = UPLOAD_DIR / file.filename
-        
-        # 如果文件已存在，添加时间戳
-        if file_path.exists():
-            stem = file_path.stem
-            suffix = file_path.suffix
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            file_path = UPLOAD_DIR / f"{stem}_{timestamp}{suffix}"
-        
-        # 保存文件
-        with open(file_path, "wb") as buffer:
-            buffer.write(file_content)
-        
-        # 提取文本内容
-        text_chunks = extract_text_from_file(file_content, file.filename)
-        
-        # 进行文本分块处理
-        processed_chunks = []
-        for chunk in text_chunks:
-            # 对较长的文本进行进一步分块
-            sub_chunks = chunk_text(chunk, chunk_size=500, overlap=50)
-            processed_chunks.extend(sub_chunks)
-        
-        # 真正的向量化处理 - 每个文本块都生成embedding
-        embedded_count = 0
-        embeddings_info = []
-        
-        for i, chunk in enumerate(processed_chunks):
-            try:
-                # 调用embedding API
-                embedding = get_embedding(chunk)
-                
-                # 创建文档条目
-                doc_entry = {
-                    "id": f"{file.filename}_{i}_{datetime.now().timestamp()}",
-                    "content": chunk,
-                    "embedding": embedding,
-                    "knowledge_type": knowledge_type,
-                    "metadata": {
-                        "title": title or file.filename,
-                        "source_file": file.filename,
-                        "chunk_index": i,
-                        "upload_time": datetime.now().isoformat(),
-                        "file_type": file_path.suffix,
-                        "embedding_dimension": len(embedding)
-                    }
-                }
-                
-                # 添加到全局向量数据库
-                embedded_documents.append(doc_entry)
-                embedded_count += 1
-                
-                # 记录embedding信息用于调试
-                embeddings_info.append({
-                    "chunk_length": len(chunk),
-                    "embedding_dimension": len(embedding),
-                    "embedding_sample": embedding[:3] if len(embedding) > 3 else embedding
-                })
-                
-            except Exception as e:
-                logger.error(f"为文本块 {i} 生成embedding失败: {e}")
-                continue
-        
-        # 记录文件信息（只存储预览，不存储所有chunks）
-        file_info = {
-            "filename": file_path.name,
-            "original_name": file.filename,
-            "size": file_path.stat().st_size,
-            "modified": file_path.stat().st_mtime,
-            "knowledge_type": knowledge_type,
-            "title": title or file.filename,
-            "upload_time": datetime.now().isoformat(),
-            "chunks_count": len(processed_chunks),
-            "embedded_count": embedded_count,
-            "chunks": processed_chunks[:3] if len(processed_chunks) > 3 else processed_chunks  # 只保存前3个块作为预览
-        }
-        
-        uploaded_files.append(file_info)
-        save_data(embedded_documents, uploaded_files)
-        
-        return {
-            "success": True,
-            "message": f"文件 {file.filename} 上传并向量化成功",
-            "file_path": str(file_path),
-            "records_added": embedded_count,
-            "chunks_count": len(processed_chunks),
-            "processing_info": {
-                "file_type": file_path.suffix,
-                "text_extracted": len(text_chunks) > 0,
-                "chunking_applied": True,
-                "embedding_applied": embedded_count > 0,
-                "embedding_model": current_config["embedding"]["type"],
-                "embedding_failures": len(processed_chunks) - embedded_count
-            },
-            "embeddings_sample": embeddings_info[:3]  # 返回前3个embedding的信息
-        }
+        return await enqueue_upload(file, knowledge_type, title)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"文件上传失败: {str(e)}")
 
+@app.put("/knowledge/file/{filename}")
+async def replace_knowledge_file(
+    filename: str,
+    file: UploadFile = File(...),
+    knowledge_type: Optional[str] = Form(None),
+    title: Optional[str] = Form(None)
+):
+    """上传文件的新版本替换已有文件：仅向量化新增或修改的分块，完成后一次性切换，搜索不会看到半更新状态"""
+    existing = await run_in_threadpool(get_file_info, filename)
+    if not existing:
+        raise HTTPException(status_code=404, detail="文件未找到")
+    try:
+        result = await enqueue_upload(
+            file,
+            knowledge_type or existing["knowledge_type"],
+            title or existing.get("title"),
+            replace_filename=filename,
+        )
+        result["message"] = f"文件 {filename} 的新版本已加入后台入库队列，完成后将替换旧版本"
+        return result
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"文件替换失败: {str(e)}")
+
+@app.post("/knowledge/bulk")
+async def bulk_ingest(
+    archive: Optional[UploadFile] = File(None),
+    directory: Optional[str] = Form(None),
+    knowledge_type: str = Form("用户上传文档")
+):
+    """批量入库：上传zip压缩包或指定服务器目录（须位于 config.BULK_IMPORT_ALLOWED_DIRS 内）。
+    知识类型取自根目录的 manifest.json/manifest.csv，其次为一级文件夹名，否则使用 knowledge_type。
+    文件经后台入库队列并发处理，可通过 /knowledge/batches/{batch_id} 查询汇总吞吐量"""
+    import asyncio
+    import uuid
+
+    if (archive is None) == (not directory):
+        raise HTTPException(status_code=400, detail="请提供zip压缩包或服务器目录之一")
+    batch_id = uuid.uuid4().hex
+    loop = asyncio.get_running_loop()
+    try:
+        if archive is not None:
+            archive_path = UPLOAD_DIR / f".bulk_{batch_id}.zip"
+            await spool_upload(archive, archive_path)
+            source = archive.filename
+            specs, skipped = await loop.run_in_executor(None, stage_archive, archive_path, batch_id, knowledge_type)
+        else:
+            source = directory
+            specs, skipped = await loop.run_in_executor(None, stage_directory, directory, batch_id, knowledge_type)
+    except PermissionError as e:
+        raise HTTPException(status_code=403, detail=str(e))
+    except (ValueError, zipfile.BadZipFile) as e:
+        raise HTTPException(status_code=400, detail=f"批量入库失败: {str(e)}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"批量入库失败: {str(e)}")
+
+    batch = await run_in_threadpool(ingestion_queue.enqueue_batch, batch_id, source, specs, skipped)
+    return {
+        "success": True,
+        "message": f"已加入 {len(specs)} 个文件到后台入库队列，跳过 {len(skipped)} 个",
+        "batch_id": batch_id,
+        "files_queued": len(specs),
+        "skipped": skipped,
+        "status": batch["status"],
+    }
+
+@app.get("/knowledge/batches")
+async def list_ingestion_batches():
+    """列出批量入库任务及其汇总进度"""
+    return {"success": True, "batches": await run_in_threadpool(ingestion_queue.list_batches)}
+
+@app.get("/knowledge/batches/{batch_id}")
+async def get_ingestion_batch(batch_id: str):
+    """查询批量入库汇总：文件/秒、分块/秒、向量化调用次数和失败列表"""
+    batch = await run_in_threadpool(ingestion_queue.get_batch, batch_id)
+    if not batch:
+        raise HTTPException(status_code=404, detail="批量入库任务未找到")
+    return {"success": True, "batch": batch}
+
+@app.get("/knowledge/jobs")
+async def list_ingestion_jobs():
+    """列出入库任务及其进度"""
+    return {"success": True, "jobs": await run_in_threadpool(ingestion_queue.list_jobs)}
+
+@app.get("/knowledge/jobs/{job_id}")
+async def get_ingestion_job(job_id: str):
+    """查询单个入库任务的阶段、已处理分块数、吞吐量和失败信息"""
+    job = await run_in_threadpool(ingestion_queue.get_job, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="入库任务未找到")
+    return {"success": True, "job": job}
+
+@app.get("/knowledge/jobs/{job_id}/events")
+async def stream_ingestion_job(job_id: str):
+    """以SSE推送入库任务进度，任务结束后关闭连接"""
+    from fastapi.responses import StreamingResponse
+    import asyncio
+
+    if not await run_in_threadpool(ingestion_queue.get_job, job_id):
+        raise HTTPException(status_code=404, detail="入库任务未找到")
+
+    async def stream():
+        last_sent = None
+        while True:
+            job = await run_in_threadpool(ingestion_queue.get_job, job_id)
+            if job is None:
+                break
+            snapshot = (job["status"], job["stage"], job["chunks_processed"], job["embedding_failures"])
+            if snapshot != last_sent:
+                last_sent = snapshot
+                yield f"data: {json.dumps(job, ensure_ascii=False)}\n\n"
+            if job["status"] in ("completed", "failed"):
+                break
+            await asyncio.sleep(0.5)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "Access-Control-Allow-Origin": "*"
+        }
+    )
+
+# 列表与详情接口的分页大小
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+def parse_fields(fields: Optional[str]) -> Optional[set]:
+    """解析逗号分隔的字段投影参数，"all" 或空表示不投影"""
+    if not fields or fields == "all":
+        return None
+    return {f.strip() for f in fields.split(",") if f.strip()}
+
+def project(record: Dict[str, Any], fields: Optional[set], required: tuple = ()) -> Dict[str, Any]:
+    if fields is None:
+        return record
+    return {k: v for k, v in record.items() if k in fields or k in required}
+
 @app.get("/knowledge/files")
-async def list_uploaded_files():
-    """列出已上传的文件"""
+async def list_uploaded_files(
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+    knowledge_type: Optional[str] = None,
+    name: Optional[str] = None,
+    uploaded_after: Optional[str] = None,
+    uploaded_before: Optional[str] = None,
+    sort: str = "upload_time",
+    order: str = "desc",
+    fields: Optional[str] = None,
+):
+    """分页列出已上传的文件
+
+    支持按知识类型、文件名（部分匹配）和上传时间筛选，按上传时间/文件名排序，
+    通过 next_cursor 翻页。默认不返回分块预览（chunks），fields=all 返回完整记录，
+    也可用逗号分隔的字段列表只返回需要的字段。
+    """
+    try:
+        files, next_cursor, total = await run_in_threadpool(
+            query_files,
+            knowledge_type=knowledge_type, name=name,
+            uploaded_after=uploaded_after, uploaded_before=uploaded_before,
+            sort=sort, descending=order != "asc",
+            limit=max(1, min(limit, MAX_PAGE_SIZE)), cursor=cursor,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     try:
+        projection = parse_fields(fields)
+        if fields is None:
+            files = [{k: v for k, v in f.items() if k != "chunks"} for f in files]
         return {
             "success": True, 
-            "files": uploaded_files,
-            "total_embedded_documents": len(embedded_documents)
+            "files": [project(f, projection, ("filename",)) for f in files],
+            "next_cursor": next_cursor,
+            "total": total,
+            "total_embedded_documents": len(store)
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取文件列表失败: {str(e)}")
@@ -690,31 +845,19 @@ async def list_uploaded_files():
 @app.delete("/knowledge/file/{filename}")
 async def delete_knowledge_file(filename: str):
     """删除知识库中的文件"""
+    if not store.ready:
+        raise HTTPException(status_code=503, detail="知识库正在加载，请稍后重试")
     try:
-        global uploaded_files, embedded_documents
-        
-        # 查找并删除文件信息
-        file_to_delete = None
-        
-        for i, file_info in enumerate(uploaded_files):
-            if file_info["filename"] == filename:
-                file_to_delete = uploaded_files.pop(i)
-                break
-        
-        if not file_to_delete:
+        # 删除文件信息及其引用表，仅删除不再被其他文件引用的向量分块
+        removed = await run_in_threadpool(remove_file, filename)
+        if not removed:
             raise HTTPException(status_code=404, detail="文件未找到")
-        
-        # 删除相关的向量文档
-        original_count = len(embedded_documents)
-        embedded_documents = [doc for doc in embedded_documents 
-                            if doc["metadata"]["source_file"] != file_to_delete["original_name"]]
-        deleted_vectors = original_count - len(embedded_documents)
+        file_to_delete, deleted_vectors = removed
         
         # 删除物理文件
         file_path = UPLOAD_DIR / filename
         if file_path.exists():
             file_path.unlink()
-        save_data(embedded_documents, uploaded_files)
         
         return {
             "success": True,
@@ -726,125 +869,149 @@ async def delete_knowledge_file(filename: str):
         raise HTTPException(status_code=500, detail=f"删除文件失败: {str(e)}")
 
 @app.get("/knowledge/file/{filename}/details")
-async def get_file_details(filename: str):
-    """获取文件的详细信息，包括内容和embedding结果"""
+async def get_file_details(
+    filename: str,
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+    fields: Optional[str] = None,
+    include_original: bool = True,
+):
+    """获取文件的详细信息，包括内容和embedding结果
+
+    分块按 chunk_index 分页返回，cursor 为上一页返回的 next_cursor；fields 为分块字段投影
+    （如 "chunk_index,page,chunk_length" 不返回分块内容）。原始内容只在第一页返回，
+    include_original=false 时不读取原始文件。
+    """
+    if not store.ready:
+        raise HTTPException(status_code=503, detail="知识库正在加载，请稍后重试")
     try:
-        # 查找文件信息
-        file_info = None
-        for f in uploaded_files:
-            if f["filename"] == filename or f.get("original_name") == filename:
-                file_info = f
-                break
+        # 查找文件信息（按存储文件名或原始文件名查询目录库）
+        file_info = await run_in_threadpool(find_file, filename)
         
         if not file_info:
             raise HTTPException(status_code=404, detail=f"文件 {filename} 未找到")
         
-        # 查找相关的embedding文档
-        related_docs = [doc for doc in embedded_documents 
-                       if doc["metadata"]["source_file"] == file_info.get("original_name", filename)]
+        # 通过分块引用表分页查找该文件的embedding文档（含与其他文件共享的分块）
+        try:
+            file_chunks, next_cursor = await run_in_threadpool(
+                get_file_chunks_page, file_info["filename"], cursor, max(1, min(limit, MAX_PAGE_SIZE)))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        summary = await run_in_threadpool(file_chunk_summary, file_info["filename"])
+        
+        if not summary["chunks"]:
+            raise HTTPException(status_code=404, detail=f"未找到文件 {filename} 的embedding数据")
+        
+        # 限制内容长度以避免前端显示问题
+        MAX_CONTENT_LENGTH = 8000  # 增加到8000字符以适应PDF
+        PREVIEW_LENGTH = 1500      # 预览1500字符
         
-        if not related_docs:
-            raise HTTPException(status_code=404, detail=f"未找到文件 {filename} 的embedding数据")        # 读取原始文件内容
+        # 读取原始文件内容（只在第一页返回，且只读取显示所需的长度）
         original_content = ""
         content_preview = ""
         content_truncated = False
         
-        try:
-            file_path = UPLOAD_DIR / file_info["filename"]
-            logger.info(f"📂 [API] 正在读取原始文件: {file_path}")
-            if file_path.exists():
-                # 根据文件类型选择不同的读取方式
-                file_extension = file_path.suffix.lower()
-                
-                if file_extension == '.pdf':
-                    # 对于PDF文件，从已处理的分块中重构内容，避免重新解析
-                    logger.info(f"📄 [API] PDF文件，从分块重构内容")
-                    if related_docs:
-                        # 按页面顺序重构PDF内容
+        if include_original and cursor is None:
+            try:
+                file_path = UPLOAD_DIR / file_info["filename"]
+                logger.info(f"📂 [API] 正在读取原始文件: {file_path}")
+                if file_path.exists():
+                    # 根据文件类型选择不同的读取方式
+                    file_extension = file_path.suffix.lower()
+                    
+                    if file_extension == '.pdf':
+                        # 对于PDF文件，从已处理的分块中重构内容，避免重新解析；
+                        # 按页码元数据分组，同一页的分块按顺序拼接，凑够显示长度即停止
+                        logger.info(f"📄 [API] PDF文件，从分块重构内容")
                         pdf_pages = {}
-                        for doc in related_docs:
-                            content = doc["content"]
-                            # 提取页面信息（如果内容包含"第X页:"标识）
-                            if content.startswith("第") and "页:" in content:
-                                try:
-                                    page_num = int(content.split("页:")[0][1:])
-                                    page_content = content.split("页:", 1)[1].strip()
-                                    pdf_pages[page_num] = page_content
-                                except:
-                                    # 如果解析失败，直接使用内容
-                                    pdf_pages[len(pdf_pages) + 1] = content
-                            else:
-                                pdf_pages[len(pdf_pages) + 1] = content
+                        reconstructed = 0
+                        page_cursor = None
+                        while reconstructed <= MAX_CONTENT_LENGTH:
+                            batch, page_cursor = await run_in_threadpool(
+                                get_file_chunks_page, file_info["filename"], page_cursor, MAX_PAGE_SIZE)
+                            for doc, ref in batch:
+                                content = doc["content"]
+                                page_num = ref.get("page")
+                                if page_num is None and content.startswith("第") and "页:" in content:
+                                    # 兼容旧数据：页码以"第X页:"前缀写在分块内容中
+                                    try:
+                                        page_num = int(content.split("页:")[0][1:])
+                                        content = content.split("页:", 1)[1].strip()
+                                    except ValueError:
+                                        page_num = None
+                                if page_num is None:
+                                    page_num = len(pdf_pages) + 1
+                                pdf_pages.setdefault(page_num, []).append(content)
+                                reconstructed += len(content)
+                            if page_cursor is None:
+                                break
                         
-                        # 按页面顺序组合内容
                         if pdf_pages:
+                            # 按页面顺序组合内容
                             sorted_pages = sorted(pdf_pages.items())
-                            full_content = "\n\n".join([f"第{page}页:\n{content}" for page, content in sorted_pages])
+                            full_content = "\n\n".join([f"第{page}页:\n" + "\n".join(parts) for page, parts in sorted_pages])
                         else:
-                            full_content = "\n\n".join([doc["content"] for doc in related_docs])
+                            full_content = "PDF文件暂无可显示的文本内容"
+                            
                     else:
-                        full_content = "PDF文件暂无可显示的文本内容"
+                        # 对于非PDF文件，优先使用上传元数据中缓存的编码，仅首次读取时检测；
+                        # 只读取显示长度多一个字符，用于判断是否截断
+                        full_content, encoding = await run_in_threadpool(
+                            read_text_file, file_path, file_info.get("encoding"), max_chars=MAX_CONTENT_LENGTH + 1)
+                        if encoding and encoding != file_info.get("encoding"):
+                            await run_in_threadpool(update_file_info, file_info["filename"], encoding=encoding)
+                    
+                    if len(full_content) > MAX_CONTENT_LENGTH:
+                        original_content = full_content[:MAX_CONTENT_LENGTH] + "\n\n... [内容过长已截断，完整内容包含更多页面]"
+                        content_truncated = True
+                    else:
+                        original_content = full_content
+                    
+                    # 生成预览内容
+                    if len(full_content) > PREVIEW_LENGTH:
+                        content_preview = full_content[:PREVIEW_LENGTH] + "..."
+                    else:
+                        content_preview = full_content
                         
                 else:
-                    # 对于非PDF文件，使用智能编码检测
-                    full_content = read_file_with_encoding_detection(file_path)
-                
-                # 限制内容长度以避免前端显示问题
-                MAX_CONTENT_LENGTH = 8000  # 增加到8000字符以适应PDF
-                PREVIEW_LENGTH = 1500      # 预览1500字符
-                
-                if len(full_content) > MAX_CONTENT_LENGTH:
-                    original_content = full_content[:MAX_CONTENT_LENGTH] + "\n\n... [内容过长已截断，完整内容包含更多页面]"
-                    content_truncated = True
-                else:
-                    original_content = full_content
-                
-                # 生成预览内容
-                if len(full_content) > PREVIEW_LENGTH:
-                    content_preview = full_content[:PREVIEW_LENGTH] + "..."
-                else:
-                    content_preview = full_content
+                    original_content = "原始文件未找到"
+                    content_preview = "原始文件未找到"
                     
-            else:
-                original_content = "原始文件未找到"
-                content_preview = "原始文件未找到"
-                
-            logger.info(f"📄 [API] 原始文件内容长度: {len(original_content)} (截断: {content_truncated})")
-        except Exception as e:
-            logger.error(f"❌ [API] 读取原始文件失败: {e}")
-            original_content = f"无法读取原始文件: {str(e)}"
-            content_preview = original_content
+                logger.info(f"📄 [API] 原始文件内容长度: {len(original_content)} (截断: {content_truncated})")
+            except Exception as e:
+                logger.error(f"❌ [API] 读取原始文件失败: {e}")
+                original_content = f"无法读取原始文件: {str(e)}"
+                content_preview = original_content
         
-        # 构建分块信息
+        # 构建分块信息（已按chunk_index排序）
+        projection = parse_fields(fields)
         chunks = []
-        for i, doc in enumerate(related_docs):
+        for doc, ref in file_chunks:
             chunk_info = {
                 "id": doc["id"],
                 "content": doc["content"],
-                "knowledge_type": doc["knowledge_type"],
+                "knowledge_type": ref["knowledge_type"],
                 "chunk_length": len(doc["content"]),
-                "chunk_index": doc["metadata"].get("chunk_index", i),
+                "chunk_index": ref["chunk_index"],
+                "page": ref.get("page"),
                 "embedding_dimension": len(doc["embedding"]),
                 "metadata": doc["metadata"]
             }
-            chunks.append(chunk_info)
-        
-        # 按chunk_index排序
-        chunks.sort(key=lambda x: x["chunk_index"])
+            chunks.append(project(chunk_info, projection, ("chunk_index",)))
         
-        # 计算统计信息
+        # 计算统计信息（覆盖整个文件，而不仅是当前页）
         file_stats = {
             "original_size": len(original_content),
-            "chunks_count": len(chunks),
-            "knowledge_types": len(set(chunk["knowledge_type"] for chunk in chunks))
+            "chunks_count": summary["chunks"],
+            "knowledge_types": len(summary["knowledge_types"])
         }
         
         # 计算embedding信息
         embedding_info = {
-            "total_embeddings": len(chunks),
-            "embedding_dimensions": chunks[0]["embedding_dimension"] if chunks else 0,
-            "avg_chunk_length": sum(chunk["chunk_length"] for chunk in chunks) / len(chunks) if chunks else 0,
-            "knowledge_types": list(set(chunk["knowledge_type"] for chunk in chunks))
+            "total_embeddings": summary["chunks"],
+            "embedding_dimensions": summary["embedding_dimension"],
+            "avg_chunk_length": summary["avg_chunk_length"],
+            "knowledge_types": summary["knowledge_types"]
         }
         return {
             "success": True,
@@ -853,6 +1020,7 @@ async def get_file_details(filename: str):
             "content_preview": content_preview,
             "content_truncated": content_truncated,
             "chunks": chunks,
+            "next_cursor": next_cursor,
             "file_stats": file_stats,
             "embedding_info": embedding_info
         }
@@ -884,6 +1052,7 @@ class SectionStreamRequest(BaseModel):
     section: Dict[str, Any]
     knowledge_types: List[str] = []
     custom_prompt: Optional[str] = None
+    # settings.force_regenerate=True 时跳过章节缓存
     settings: Dict[str, Any] = {}
 
 class SectionPromptRequest(BaseModel):
@@ -896,6 +1065,14 @@ class ExportProtocolRequest(BaseModel):
     format: str
     metadata: Dict[str, Any]
 
+class WorkflowStreamRequest(BaseModel):
+    input_text: str
+    settings: Dict[str, Any] = {}
+
+class WorkflowConfirmRequest(BaseModel):
+    gate: str
+    payload: Optional[Any] = None
+
 
 @app.post("/extract_key_info")
 async def extract_key_info(request: KeyInfoExtractionRequest):
@@ -950,11 +1127,8 @@ async def extract_key_info(request: KeyInfoExtractionRequest):
         
         try:
             # 解析JSON响应
-            import re
-            json_match = re.search(r'\{.*?\}', response, re.DOTALL)
-            if json_match:
-                extracted_info = json.loads(json_match.group())
-            else:
+            extracted_info = parse_json_block(response, "{")
+            if not extracted_info:
                 # 如果无法解析JSON，返回默认的临床试验相关字段
                 extracted_info = {
                     "drug_type": "待确定的研究药物",
@@ -1011,78 +1185,16 @@ async def extract_key_info(request: KeyInfoExtractionRequest):
         raise HTTPException(status_code=500, detail=f"关键信息提取失败: {str(e)}")
 
 
-@app.post("/extract_key_info_stream", include_in_schema=False)
-async def extract_key_info_stream_v1(request: KeyInfoExtractionRequest):
-    """(已废弃) 流式提取关键信息，返回系统提示词和内容"""
-    from fastapi.responses import StreamingResponse
-    import asyncio
-
-    async def generate():
-        try:
-            system_prompt = "你是一位专业的临床试验方案专家。请从用户输入中提取临床试验方案的关键信息。"
-            extraction_prompt = (
-                "请从以下文本中提取临床试验方案的关键信息，并以JSON格式返回。\n\n"
-                f"输入文本：\n{request.input_text}\n\n"
-                "请提取以下关键信息：\n"
-                "1. drug_type（药物类型）\n"
-                "2. disease（目标疾病）\n"
-                "3. trial_phase（试验分期）\n"
-                "4. primary_objective（主要目的）\n"
-                "5. primary_endpoint（主要终点）\n"
-                "6. secondary_endpoints（次要终点）\n"
-                "7. patient_population（目标人群）\n"
-                "8. estimated_enrollment（预计入组）\n"
-                "9. study_design（研究设计）\n"
-                "10. treatment_line（治疗线数）\n\n"
-                "返回纯JSON格式，不要有其他文字。"
-            )
-
-            yield f"data: {json.dumps({'type': 'system_prompt', 'content': extraction_prompt})}\n\n"
-            await asyncio.sleep(0.1)
-
-            accumulated = ""
-            for token in call_local_llm_stream(extraction_prompt, 0.1):
-                accumulated += token
-                yield f"data: {json.dumps({'type': 'content', 'content': token})}\n\n"
-                await asyncio.sleep(0.02)
-
-            try:
-                import re
-                match = re.search(r'\{.*?\}', accumulated, re.DOTALL)
-                info = json.loads(match.group()) if match else {}
-                yield f"data: {json.dumps({'type': 'extracted_info', 'content': info})}\n\n"
-            except Exception as parse_error:
-                yield f"data: {json.dumps({'type': 'error', 'content': str(parse_error)})}\n\n"
-
-            yield f"data: {json.dumps({'type': 'done'})}\n\n"
-        except Exception as e:
-            yield f"data: {json.dumps({'type': 'error', 'content': str(e)})}\n\n"
-
-    return StreamingResponse(
-        generate(),
-        media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            "Access-Control-Allow-Origin": "*"
-        }
-    )
+EXTRACTION_SYSTEM_PROMPT = "你是一位专业的临床试验方案专家。请从用户输入中提取临床试验方案的关键信息。"
 
 
-@app.post("/extract_key_info_stream", include_in_schema=False)
-async def extract_key_info_stream_v2(request: KeyInfoExtractionRequest):
-    """(已废弃) 流式提取关键信息，并同时返回系统提示词"""
-    from fastapi.responses import StreamingResponse
-    import asyncio
-
-    async def generate():
-        try:
-            system_prompt = "你是一位专业的临床试验方案专家。请从用户输入中提取临床试验方案的关键信息。"
-            extraction_prompt = f"""
+def build_extraction_prompt(input_text: str) -> str:
+    """构建流式关键信息提取的提示词"""
+    return f"""
 请从以下文本中提取临床试验方案的关键信息，并以JSON格式返回。
 
 输入文本：
-{request.input_text}
+{input_text}
 
 请提取以下关键信息：
 1. drug_type（药物类型）
@@ -1099,50 +1211,24 @@ async def extract_key_info_stream_v2(request: KeyInfoExtractionRequest):
 返回纯JSON格式，不要有其他文字。
 """
 
-            yield f"data: {json.dumps({'type': 'system_prompt', 'content': extraction_prompt})}\n\n"
-            await asyncio.sleep(0.1)
 
-            accumulated = ""
-            for token in call_local_llm_stream(extraction_prompt, system_prompt, 0.1):
-                accumulated += token
-                yield f"data: {json.dumps({'type': 'content', 'content': token})}\n\n"
-                await asyncio.sleep(0.02)
-
-            try:
-                import re
-                json_match = re.search(r'\{.*?\}', accumulated, re.DOTALL)
-                if json_match:
-                    info = json.loads(json_match.group())
-                else:
-                    info = {
-                        "drug_type": "待确定",
-                        "disease": "待确定",
-                        "trial_phase": "I期",
-                        "primary_objective": "评估安全性和耐受性",
-                        "primary_endpoint": "DLT和MTD",
-                        "secondary_endpoints": ["ORR", "DCR", "PFS"],
-                        "patient_population": "待确定",
-                        "estimated_enrollment": "20-30例",
-                        "study_design": "开放标签、剂量递增研究"
-                    }
-
-                yield f"data: {json.dumps({'type': 'extracted_info', 'content': info})}\n\n"
-            except Exception as parse_error:
-                yield f"data: {json.dumps({'type': 'error', 'content': '信息提取失败: ' + str(parse_error)})}\n\n"
-
-            yield f"data: {json.dumps({'type': 'done', 'content': ''})}\n\n"
-        except Exception as e:
-            yield f"data: {json.dumps({'type': 'error', 'content': str(e)})}\n\n"
-
-    return StreamingResponse(
-        generate(),
-        media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            "Access-Control-Allow-Origin": "*"
-        }
-    )
+def parse_extracted_info(text: str) -> Dict[str, Any]:
+    """从LLM输出中解析关键信息，无法解析时返回默认字段"""
+    info = parse_json_block(text, "{")
+    if info:
+        return info
+    return {
+        "drug_type": "待确定",
+        "disease": "待确定",
+        "trial_phase": "I期",
+        "primary_objective": "评估安全性和耐受性",
+        "primary_endpoint": "DLT/MTD",
+        "secondary_endpoints": ["ORR", "PFS"],
+        "patient_population": "待确定",
+        "estimated_enrollment": "20-30例",
+        "study_design": "开放标签、剂量递增研究",
+        "treatment_line": "待确定"
+    }
 
 
 @app.post("/extract_key_info_stream")
@@ -1153,55 +1239,23 @@ async def extract_key_info_stream(request: KeyInfoExtractionRequest):
 
     async def generate():
         try:
-            system_prompt = "你是一位专业的临床试验方案专家。请从用户输入中提取临床试验方案的关键信息。"
-            extraction_prompt = f"""
-请从以下文本中提取临床试验方案的关键信息，并以JSON格式返回。
-
-输入文本：
-{request.input_text}
-
-请提取以下关键信息：
-1. drug_type（药物类型）
-2. disease（目标疾病）
-3. trial_phase（试验分期）
-4. primary_objective（主要目的）
-5. primary_endpoint（主要终点）
-6. secondary_endpoints（次要终点）
-7. patient_population（目标人群）
-8. estimated_enrollment（预计入组）
-9. study_design（研究设计）
-10. treatment_line（治疗线数）
-
-返回纯JSON格式，不要有其他文字。
-"""
+            extraction_prompt = build_extraction_prompt(request.input_text)
 
             yield f"data: {json.dumps({'type': 'system_prompt', 'content': extraction_prompt})}\n\n"
             await asyncio.sleep(0.1)
 
             accumulated = ""
-            for token in call_local_llm_stream(extraction_prompt, system_prompt, 0.1):
+            parser = IncrementalJSONParser("{")
+            for token in call_local_llm_stream(extraction_prompt, EXTRACTION_SYSTEM_PROMPT, 0.1):
                 accumulated += token
                 yield f"data: {json.dumps({'type': 'content', 'content': token})}\n\n"
+                # 每个字段解析完成即推送，前端无需等待整个JSON结束
+                for key, value in parser.feed(token):
+                    yield f"data: {json.dumps({'type': 'extracted_field', 'key': key, 'content': value})}\n\n"
                 await asyncio.sleep(0.02)
 
             try:
-                import re
-                match = re.search(r'\{.*?\}', accumulated, re.DOTALL)
-                if match:
-                    info = json.loads(match.group())
-                else:
-                    info = {
-                        "drug_type": "待确定",
-                        "disease": "待确定",
-                        "trial_phase": "I期",
-                        "primary_objective": "评估安全性和耐受性",
-                        "primary_endpoint": "DLT/MTD",
-                        "secondary_endpoints": ["ORR", "PFS"],
-                        "patient_population": "待确定",
-                        "estimated_enrollment": "20-30例",
-                        "study_design": "开放标签、剂量递增研究",
-                        "treatment_line": "待确定"
-                    }
+                info = parse_extracted_info(accumulated)
                 yield f"data: {json.dumps({'type': 'extracted_info', 'content': info})}\n\n"
             except Exception as e:
                 logger.error(f"JSON解析失败: {e}")
@@ -1327,10 +1381,8 @@ async def generate_outline(request: OutlineGenerationRequest):
         
         try:
             # 尝试解析JSON响应
-            import re
-            json_match = re.search(r'\[.*?\]', response, re.DOTALL)
-            if json_match:
-                outline = json.loads(json_match.group())
+            outline = parse_json_block(response, "[", dict)
+            if outline:
                 # 确保每个章节都有subsections字段
                 for section in outline:
                     if 'subsections' not in section:
@@ -1354,63 +1406,14 @@ async def generate_outline(request: OutlineGenerationRequest):
         raise HTTPException(status_code=500, detail=f"大纲生成失败: {str(e)}")
 
 
-# 旧版接口保留以兼容历史调用，实际功能由下方新版实现
-@app.post("/generate_outline_stream", include_in_schema=False)
-async def generate_outline_stream_legacy(request: OutlineGenerationRequest):
-    """(已废弃) 流式生成协议大纲"""
-    from fastapi.responses import StreamingResponse
-    import asyncio
-
-    async def generate():
-        try:
-            system_prompt = "你是一位临床试验方案撰写专家。请生成符合ICH-GCP标准的临床试验方案章节目录。"
-            outline_prompt = json.dumps(request.confirmed_info, ensure_ascii=False)
-
-            yield f"data: {json.dumps({'type': 'system_prompt', 'content': outline_prompt})}\n\n"
-            await asyncio.sleep(0.1)
-
-            accumulated = ""
-            for token in call_local_llm_stream(outline_prompt, 0.2):
-                accumulated += token
-                yield f"data: {json.dumps({'type': 'content', 'content': token})}\n\n"
-                await asyncio.sleep(0.02)
-
-            try:
-                import re
-                match = re.search(r'\[.*?\]', accumulated, re.DOTALL)
-                outline = json.loads(match.group()) if match else get_standard_protocol_outline(request.confirmed_info)
-                yield f"data: {json.dumps({'type': 'outline', 'content': outline})}\n\n"
-            except Exception as parse_error:
-                outline = get_standard_protocol_outline(request.confirmed_info)
-                yield f"data: {json.dumps({'type': 'outline', 'content': outline})}\n\n"
-
-            yield f"data: {json.dumps({'type': 'done'})}\n\n"
-        except Exception as e:
-            yield f"data: {json.dumps({'type': 'error', 'content': str(e)})}\n\n"
-
-    return StreamingResponse(
-        generate(),
-        media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            "Access-Control-Allow-Origin": "*"
-        }
-    )
-
+OUTLINE_SYSTEM_PROMPT = "你是一位临床试验方案撰写专家。请生成符合ICH-GCP标准的临床试验方案目录。"
 
-@app.post("/generate_outline_stream", include_in_schema=False)
-async def generate_outline_stream_v1(request: OutlineGenerationRequest):
-    """(已废弃) 流式生成协议大纲"""
-    from fastapi.responses import StreamingResponse
-    import asyncio
 
-    async def generate():
-        try:
-            system_prompt = "你是一位临床试验方案撰写专家。请生成符合ICH-GCP标准的临床试验方案目录。"
-            outline_prompt = f"""
+def build_outline_prompt(confirmed_info: Dict[str, Any]) -> str:
+    """构建流式大纲生成的提示词"""
+    return f"""
 基于以下确认的临床试验信息，生成协议目录，仅需标题：
-{json.dumps(request.confirmed_info, ensure_ascii=False)}
+{json.dumps(confirmed_info, ensure_ascii=False)}
 
 返回格式示例：
 [
@@ -1419,43 +1422,8 @@ async def generate_outline_stream_v1(request: OutlineGenerationRequest):
 ]
 """
 
-            yield f"data: {json.dumps({'type': 'system_prompt', 'content': outline_prompt})}\n\n"
-            await asyncio.sleep(0.1)
-
-            accumulated = ""
-            for token in call_local_llm_stream(outline_prompt, system_prompt, 0.2):
-                accumulated += token
-                yield f"data: {json.dumps({'type': 'content', 'content': token})}\n\n"
-                await asyncio.sleep(0.02)
 
-            try:
-                import re
-                json_match = re.search(r'\[.*?\]', accumulated, re.DOTALL)
-                if json_match:
-                    outline = json.loads(json_match.group())
-                else:
-                    outline = get_standard_protocol_outline(request.confirmed_info)
-                yield f"data: {json.dumps({'type': 'outline', 'content': outline})}\n\n"
-            except Exception as parse_error:
-                outline = get_standard_protocol_outline(request.confirmed_info)
-                yield f"data: {json.dumps({'type': 'outline', 'content': outline})}\n\n"
-
-            yield f"data: {json.dumps({'type': 'done', 'content': ''})}\n\n"
-        except Exception as e:
-            yield f"data: {json.dumps({'type': 'error', 'content': str(e)})}\n\n"
-
-    return StreamingResponse(
-        generate(),
-        media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            "Access-Control-Allow-Origin": "*"
-        }
-    )
-
-
-# 最终版本的流式大纲生成接口
+# 流式大纲生成接口
 @app.post("/generate_outline_stream")
 async def generate_outline_stream(request: OutlineGenerationRequest):
     """步骤2：流式生成协议大纲"""
@@ -1464,33 +1432,22 @@ async def generate_outline_stream(request: OutlineGenerationRequest):
 
     async def generate():
         try:
-            system_prompt = "你是一位临床试验方案撰写专家。请生成符合ICH-GCP标准的临床试验方案目录。"
-            outline_prompt = f"""
-基于以下确认的临床试验信息，生成协议目录，仅需标题：
-{json.dumps(request.confirmed_info, ensure_ascii=False)}
-
-返回格式示例：
-[
-  {{"title": "1. 研究背景与目的", "subsections": ["1.1 ...", "1.2 ..."]}},
-  ...
-]
-"""
+            outline_prompt = build_outline_prompt(request.confirmed_info)
 
             yield f"data: {json.dumps({'type': 'system_prompt', 'content': outline_prompt})}\n\n"
             await asyncio.sleep(0.1)
 
-            accumulated = ""
-            for token in call_local_llm_stream(outline_prompt, system_prompt, 0.2):
-                accumulated += token
+            parser = IncrementalJSONParser("[", dict)
+            for token in call_local_llm_stream(outline_prompt, OUTLINE_SYSTEM_PROMPT, 0.2):
                 yield f"data: {json.dumps({'type': 'content', 'content': token})}\n\n"
+                # 每个章节条目解析完成即推送
+                for index, entry in parser.feed(token):
+                    yield f"data: {json.dumps({'type': 'outline_entry', 'index': index, 'content': entry})}\n\n"
                 await asyncio.sleep(0.02)
 
             try:
-                import re
-                match = re.search(r'\[.*?\]', accumulated, re.DOTALL)
-                if match:
-                    outline = json.loads(match.group())
-                else:
+                outline = parser.result()
+                if not outline:
                     outline = get_standard_protocol_outline(request.confirmed_info)
                 yield f"data: {json.dumps({'type': 'outline', 'content': outline})}\n\n"
             except Exception as e:
@@ -1772,14 +1729,15 @@ def get_module_generation_prompt(module_name, confirmed_info, knowledge_context=
 
     return prompt
 
-def generate_protocol_with_knowledge_enhancement(module_name, confirmed_info, knowledge_results):
-    """结合知识库检索结果生成协议内容"""
+# 章节检索候选数量，具体使用多少由上下文token预算决定
+SECTION_RETRIEVAL_TOP_K = 8
+
+
+def build_section_prompt(module_name, confirmed_info, knowledge_results):
+    """结合知识库检索结果生成协议内容，返回提示词及上下文打包信息"""
     
-    # 整理知识库检索结果
-    knowledge_context = "\n\n".join([
-        f"【{result['knowledge_type']}】\n{result['content']}"
-        for result in knowledge_results[:3]  # 使用最相关的前3个结果
-    ])
+    # 按相关度在token预算内整理知识库检索结果
+    knowledge_context, context_info = pack_context(knowledge_results)
     
     # 获取该模块的生成提示词
     prompt = get_module_generation_prompt(module_name, confirmed_info, knowledge_context)
@@ -1796,7 +1754,11 @@ def generate_protocol_with_knowledge_enhancement(module_name, confirmed_info, kn
 6. 请勿在每个章节单独列出文献，将所有文献汇总到文章末尾。
 """
     
-    return prompt
+    return prompt, context_info
+
+def generate_protocol_with_knowledge_enhancement(module_name, confirmed_info, knowledge_results):
+    """结合知识库检索结果生成协议内容"""
+    return build_section_prompt(module_name, confirmed_info, knowledge_results)[0]
 
 @app.post("/generate_protocol_stream")
 async def generate_protocol_stream(request: ProtocolStreamRequest):
@@ -1822,31 +1784,25 @@ async def generate_protocol_stream(request: ProtocolStreamRequest):
                         search_result = await search_knowledge_embedding(query, top_k=3)
                         if search_result['success']:
                             knowledge_results.extend(search_result['results'])
-                            for r in search_result['results']:
-                                title = r.get('metadata', {}).get('title')
-                                if title:
-                                    reference_titles.add(title)
             
             # 2. 按照大纲逐个模块生成内容
             full_content = ""
             total_sections = len(request.outline)
+            context_infos = {}
             
             for idx, section in enumerate(request.outline):
                 # 获取该模块相关的知识
                 relevant_knowledge = [k for k in knowledge_results
                                     if any(keyword in k['content']
                                           for keyword in section['title'].split())]
-                for r in relevant_knowledge[:3]:
-                    title = r.get('metadata', {}).get('title')
-                    if title:
-                        reference_titles.add(title)
                 
-                # 构建该模块的生成提示词
-                module_prompt = generate_protocol_with_knowledge_enhancement(
+                # 构建该模块的生成提示词，参考文献只列出实际打包进提示词的来源
+                module_prompt, context_infos[section['title']] = build_section_prompt(
                     section['title'],
                     request.confirmed_info,
-                    relevant_knowledge[:3]
+                    relevant_knowledge
                 )
+                reference_titles.update(context_infos[section['title']]['sources'])
                 
                 # 调用LLM生成该模块内容
                 module_tokens = ""
@@ -1883,7 +1839,7 @@ async def generate_protocol_stream(request: ProtocolStreamRequest):
                 4. 逻辑一致性（前后是否矛盾）
                 
                 方案内容：
-                {full_content[:3000]}...
+                {truncate_to_tokens(full_content, QUALITY_CHECK_TOKEN_BUDGET)}...
                 
                 请给出0-100的评分和改进建议。
                 """
@@ -1907,7 +1863,8 @@ async def generate_protocol_stream(request: ProtocolStreamRequest):
                 "content": "",
                 "progress": 1.0,
                 "done": True,
-                "total_length": len(full_content)
+                "total_length": len(full_content),
+                "context": context_infos
             }
             yield f"data: {json.dumps(final_data)}\n\n"
             
@@ -1931,17 +1888,20 @@ async def generate_protocol_stream(request: ProtocolStreamRequest):
 
 @app.post("/get_section_prompt")
 async def get_section_prompt(request: SectionPromptRequest):
-    """返回生成指定章节默认提示词"""
+    """返回生成指定章节默认提示词
+
+    检索参数与 /generate_section_stream 保持一致，随后的生成请求会直接命中检索缓存。
+    """
     knowledge_results = []
     if request.knowledge_types:
         query = f"{request.confirmed_info.get('drug_type', '')} {request.confirmed_info.get('indication', '')} {request.section.get('title', '')}"
-        search = await search_knowledge_embedding(query, top_k=3, types=request.knowledge_types)
+        search = await search_knowledge_embedding(query, top_k=SECTION_RETRIEVAL_TOP_K, types=request.knowledge_types)
         if search['success']:
             knowledge_results.extend(search['results'])
-    prompt = generate_protocol_with_knowledge_enhancement(
-        request.section['title'], request.confirmed_info, knowledge_results[:3]
+    prompt, context_info = build_section_prompt(
+        request.section['title'], request.confirmed_info, knowledge_results
     )
-    return {"prompt": prompt}
+    return {"prompt": prompt, "context": context_info}
 
 
 @app.post("/generate_section_stream")
@@ -1955,25 +1915,39 @@ async def generate_section_stream(request: SectionStreamRequest):
             knowledge_results = []
             if request.knowledge_types:
                 query = f"{request.confirmed_info.get('drug_type', '')} {request.confirmed_info.get('indication', '')} {request.section.get('title', '')}"
-                search = await search_knowledge_embedding(query, top_k=3, types=request.knowledge_types)
+                search = await search_knowledge_embedding(query, top_k=SECTION_RETRIEVAL_TOP_K, types=request.knowledge_types)
                 if search['success']:
                     knowledge_results.extend(search['results'])
 
             if request.custom_prompt:
-                knowledge_context = "\n\n".join([f"【{r['knowledge_type']}】\n{r['content']}" for r in knowledge_results[:3]])
+                knowledge_context, context_info = pack_context(knowledge_results)
                 prompt = request.custom_prompt + "\n\n" + knowledge_context
             else:
-                prompt = generate_protocol_with_knowledge_enhancement(
-                    request.section['title'], request.confirmed_info, knowledge_results[:3]
+                prompt, context_info = build_section_prompt(
+                    request.section['title'], request.confirmed_info, knowledge_results
                 )
 
             # 先发送系统提示词，便于前端展示和编辑
-            yield f"data: {json.dumps({'type': 'system_prompt', 'content': prompt})}\n\n"
-
-            for token in call_local_llm_stream(prompt, temperature=request.settings.get('detail_level', 0.3)):
+            yield f"data: {json.dumps({'type': 'system_prompt', 'content': prompt, 'context': context_info})}\n\n"
+
+            temperature = request.settings.get('detail_level', 0.3)
+            cache_key = section_cache_key(prompt, current_config["llm"]["model"], temperature, get_kb_version())
+            cached = None if request.settings.get('force_regenerate') else get_cached_section(cache_key)
+            if cached is not None:
+                # 命中缓存：按相同协议全速回放，不再调用LLM
+                for i in range(0, len(cached), 512):
+                    yield f"data: {json.dumps({'content': cached[i:i + 512]})}\n\n"
+                yield f"data: {json.dumps({'done': True, 'cached': True})}\n\n"
+                return
+
+            section_text = ""
+            for token in call_local_llm_stream(prompt, temperature=temperature):
+                section_text += token
                 yield f"data: {json.dumps({'content': token})}\n\n"
                 await asyncio.sleep(0.02)
 
+            if section_text:
+                store_section(cache_key, section_text)
             yield f"data: {json.dumps({'done': True})}\n\n"
         except Exception as e:
             yield f"data: {json.dumps({'error': str(e), 'done': True})}\n\n"
@@ -1989,6 +1963,53 @@ async def generate_section_stream(request: SectionStreamRequest):
     )
 
 
+@app.post("/workflow_stream")
+async def workflow_stream(request: WorkflowStreamRequest):
+    """流水线式生成：在单个SSE连接中完成提取、大纲和章节生成
+
+    settings 支持：
+    - knowledge_types：检索的知识库类型
+    - max_parallel_sections：并行生成的章节数上限（默认3）
+    - confirm_info / confirm_outline：在提取结果或大纲完成后等待 /workflow/{id}/confirm
+    - confirmation_timeout：等待确认的秒数（默认600）
+    """
+    from fastapi.responses import StreamingResponse
+
+    pipeline = ProtocolPipeline(
+        llm_stream=call_local_llm_stream,
+        embedding_searcher=search_knowledge_embedding,
+        extraction_prompt_builder=build_extraction_prompt,
+        outline_prompt_builder=build_outline_prompt,
+        section_prompt_builder=generate_protocol_with_knowledge_enhancement,
+        extraction_parser=parse_extracted_info,
+        fallback_outline=get_standard_protocol_outline,
+        extraction_system_prompt=EXTRACTION_SYSTEM_PROMPT,
+        outline_system_prompt=OUTLINE_SYSTEM_PROMPT,
+    )
+
+    async def stream():
+        async for event in pipeline.run(request.input_text, request.settings):
+            yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "Access-Control-Allow-Origin": "*"
+        }
+    )
+
+
+@app.post("/workflow/{workflow_id}/confirm")
+async def confirm_workflow_gate(workflow_id: str, request: WorkflowConfirmRequest):
+    """放行流水线中的确认关卡，payload可携带修改后的确认信息或大纲"""
+    if not await run_in_threadpool(confirm_workflow, workflow_id, request.gate, request.payload):
+        raise HTTPException(status_code=404, detail="未找到等待确认的工作流")
+    return {"success": True, "workflow_id": workflow_id, "gate": request.gate}
+
+
 @app.post("/export_protocol")
 async def export_protocol(request: ExportProtocolRequest):
     """导出协议为不同格式"""
@@ -2085,6 +2106,11 @@ async def export_protocol(request: ExportProtocolRequest):
 async def startup_event():
     """应用启动时的初始化"""
     logger.info("🚀 医学AI Agent API服务启动中...")
+    # 知识库在后台加载，/health 立即可用，加载进度见 /status
+    start_loading()
+    # 多个工作进程共享目录库与向量段，轮询变更日志以获取其他进程的上传、删除和配置修改
+    start_sync()
+    ingestion_queue.start()
     logger.info("✅ 带真实LLM调用的API服务启动成功!")
     logger.info("📖 API文档地址: http://localhost:8000/docs")
     logger.info("🌐 前端地址: http://localhost:3000")
@@ -2094,12 +2120,15 @@ async def startup_event():
 async def shutdown_event():
     """应用关闭时的清理"""
     logger.info("👋 医学AI Agent API服务正在关闭...")
+    await ingestion_queue.stop()
 
 if __name__ == "__main__":
+    # 多工作进程时不能使用自动重载（环境变量 MED_AGENT_WORKERS 设置进程数）
     uvicorn.run(
         "start_simple:app",
         host="0.0.0.0",
         port=8000,
-        reload=True,
+        reload=API_WORKERS == 1,
+        workers=API_WORKERS,
         log_level="info"
     ) 
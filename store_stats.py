@@ -0,0 +1,105 @@
+import threading
+from collections import Counter
+from typing import Any, Dict, Iterable
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class KnowledgeStats:
+    """Knowledge-base counters kept up to date as chunks and files change.
+
+    Chunks are counted under their stored knowledge type, files under their
+    upload type. Reading a snapshot costs O(knowledge types), independent
+    of the number of chunks.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.chunks_by_type: Counter = Counter()
+            self.content_chars_by_type: Counter = Counter()
+            self.files_by_type: Counter = Counter()
+            self.file_bytes_by_type: Counter = Counter()
+            self.embedding_dimensions: Counter = Counter()
+
+    def chunk_added(self, doc):
+        with self._lock:
+            self.chunks_by_type[doc.knowledge_type] += 1
+            self.content_chars_by_type[doc.knowledge_type] += len(doc.content)
+            self.embedding_dimensions[len(doc.embedding)] += 1
+
+    def chunk_removed(self, doc):
+        with self._lock:
+            self.chunks_by_type[doc.knowledge_type] -= 1
+            self.content_chars_by_type[doc.knowledge_type] -= len(doc.content)
+            self.embedding_dimensions[len(doc.embedding)] -= 1
+            self._drop_zeros()
+
+    def file_added(self, file_info: Dict[str, Any]):
+        with self._lock:
+            self.files_by_type[file_info.get("knowledge_type")] += 1
+            self.file_bytes_by_type[file_info.get("knowledge_type")] += file_info.get("size") or 0
+
+    def file_removed(self, file_info: Dict[str, Any]):
+        with self._lock:
+            self.files_by_type[file_info.get("knowledge_type")] -= 1
+            self.file_bytes_by_type[file_info.get("knowledge_type")] -= file_info.get("size") or 0
+            self._drop_zeros()
+
+    def load_files(self, files: Iterable[Dict[str, Any]]):
+        """Recount files from scratch (used once the catalog is loaded)."""
+        with self._lock:
+            self.files_by_type.clear()
+            self.file_bytes_by_type.clear()
+        for file_info in files:
+            self.file_added(file_info)
+
+    def _drop_zeros(self):
+        for counter in (self.chunks_by_type, self.content_chars_by_type, self.files_by_type,
+                        self.file_bytes_by_type, self.embedding_dimensions):
+            for key in [k for k, v in counter.items() if v == 0]:
+                del counter[key]
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            types = set(self.chunks_by_type) | set(self.files_by_type)
+            return {
+                "by_type": {
+                    t: {
+                        "chunks": self.chunks_by_type[t],
+                        "files": self.files_by_type[t],
+                        "file_bytes": self.file_bytes_by_type[t],
+                        "content_chars": self.content_chars_by_type[t],
+                    }
+                    for t in types
+                },
+                "total_chunks": sum(self.chunks_by_type.values()),
+                "total_files": sum(self.files_by_type.values()),
+                "total_file_bytes": sum(self.file_bytes_by_type.values()),
+                "total_content_chars": sum(self.content_chars_by_type.values()),
+                "embedding_dimensions": dict(self.embedding_dimensions),
+            }
+
+    def to_prometheus(self) -> str:
+        """The counters in Prometheus text exposition format."""
+        snapshot = self.snapshot()
+        lines = []
+        for name, field, help_text in (
+            ("knowledge_chunks", "chunks", "Stored chunks per knowledge type"),
+            ("knowledge_files", "files", "Uploaded files per knowledge type"),
+            ("knowledge_file_bytes", "file_bytes", "Bytes of uploaded files per knowledge type"),
+            ("knowledge_content_chars", "content_chars", "Characters of chunk text per knowledge type"),
+        ):
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+            for knowledge_type, values in sorted(snapshot["by_type"].items(), key=lambda kv: str(kv[0])):
+                lines.append(f'{name}{{knowledge_type="{_escape(knowledge_type)}"}} {values[field]}')
+        lines += ["# HELP knowledge_embedding_dimension_chunks Stored chunks per embedding dimension",
+                  "# TYPE knowledge_embedding_dimension_chunks gauge"]
+        for dimension, count in sorted(snapshot["embedding_dimensions"].items()):
+            lines.append(f'knowledge_embedding_dimension_chunks{{dimension="{dimension}"}} {count}')
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,193 @@
+import json
+from typing import Any, List, Optional, Tuple, Union
+
+_WHITESPACE = " \t\r\n"
+_FENCE = "```json"
+
+
+class IncrementalJSONParser:
+    """Incrementally parse a JSON object or array from streamed LLM output.
+
+    Text before the root container (code fences, prose) and after it is
+    ignored. ``feed`` returns the top-level members that completed in the
+    fed text as ``(key, value)`` pairs for objects or ``(index, value)``
+    pairs for arrays.
+
+    With ``members`` (e.g. ``dict`` for an outline), a container whose
+    first member is of another type, or that closes without members, is
+    not the root: a citation like "[1]" in leading prose is skipped and the
+    scan continues after its opening bracket.
+    """
+
+    def __init__(self, root: Optional[str] = None, members: Optional[type] = None):
+        if root not in (None, "{", "["):
+            raise ValueError("root must be '{', '[' or None")
+        self.root = root
+        self.members = members
+        self.buffer = ""
+        self.pos = 0
+        self.started = False
+        self.finished = False
+        self.is_object = False
+        self.root_start = -1
+        self.root_end = -1
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.string_role: Optional[str] = None
+        self.key_start = -1
+        self.key: Optional[str] = None
+        self.expect = ""
+        self.value_start = -1
+        self.value_kind: Optional[str] = None
+        self.fields: dict = {}
+        self.items: list = []
+
+    def _complete_value(self, end: int, events: List[Tuple[Union[str, int], Any]]) -> bool:
+        """Record a completed top-level member; False if it shows that the
+        container is not the root, in which case the scan was restarted."""
+        text = self.buffer[self.value_start:end]
+        self.value_kind = None
+        self.expect = "comma"
+        try:
+            value = json.loads(text)
+        except json.JSONDecodeError:
+            return True
+        if self.members is not None and not isinstance(value, self.members):
+            self._restart(self.root_start + 1)
+            return False
+        if self.is_object:
+            if self.key is not None:
+                self.fields[self.key] = value
+                events.append((self.key, value))
+        else:
+            events.append((len(self.items), value))
+            self.items.append(value)
+        return True
+
+    def _root_is_valid(self) -> bool:
+        try:
+            json.loads(self.buffer[self.root_start:self.root_end])
+        except json.JSONDecodeError:
+            return False
+        return True
+
+    def _restart(self, pos: int):
+        self.pos = pos
+        self.started = False
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.string_role = None
+        self.key = None
+        self.value_kind = None
+        self.fields = {}
+        self.items = []
+
+    def feed(self, text: str) -> List[Tuple[Union[str, int], Any]]:
+        """Feed more text and return newly completed top-level members."""
+        events: List[Tuple[Union[str, int], Any]] = []
+        if self.finished:
+            return events
+        self.buffer += text
+        buffer = self.buffer
+        while self.pos < len(buffer) and not self.finished:
+            pos = self.pos
+            ch = buffer[pos]
+            self.pos += 1
+
+            if not self.started:
+                if ch in "{[" and (self.root is None or ch == self.root):
+                    self.started = True
+                    self.is_object = ch == "{"
+                    self.root_start = pos
+                    self.depth = 1
+                    self.expect = "key" if self.is_object else "value"
+                continue
+
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+                    if self.string_role == "key":
+                        self.key = json.loads(buffer[self.key_start:pos + 1])
+                        self.expect = "colon"
+                    elif self.string_role == "value":
+                        self._complete_value(pos + 1, events)
+                    self.string_role = None
+                continue
+
+            if self.value_kind == "primitive" and self.depth == 1 and (ch in ",}]" or ch in _WHITESPACE):
+                if not self._complete_value(pos, events):
+                    continue
+
+            if ch == '"':
+                self.in_string = True
+                if self.depth == 1:
+                    if self.is_object and self.expect == "key":
+                        self.string_role = "key"
+                        self.key_start = pos
+                    elif self.expect == "value":
+                        self.string_role = "value"
+                        self.value_start = pos
+                        self.value_kind = "string"
+                        self.expect = "end"
+            elif ch in "{[":
+                if self.depth == 1 and self.expect == "value":
+                    self.value_start = pos
+                    self.value_kind = "container"
+                    self.expect = "end"
+                self.depth += 1
+            elif ch in "}]":
+                self.depth -= 1
+                if self.depth == 0:
+                    self.root_end = pos + 1
+                    if self.fields or self.items or (self.members is None and self._root_is_valid()):
+                        self.finished = True
+                    else:
+                        # A bracket in leading prose (e.g. "[注]") is not the
+                        # real root; keep scanning right after it.
+                        self._restart(self.root_start + 1)
+                elif self.depth == 1 and self.value_kind == "container":
+                    self._complete_value(pos + 1, events)
+            elif self.depth == 1:
+                if ch == ":":
+                    self.expect = "value"
+                elif ch == ",":
+                    self.expect = "key" if self.is_object else "value"
+                elif ch not in _WHITESPACE and self.expect == "value":
+                    self.value_start = pos
+                    self.value_kind = "primitive"
+                    self.expect = "end"
+        return events
+
+    def result(self) -> Any:
+        """Return the parsed root value, or the members completed so far."""
+        if self.finished and self._root_is_valid():
+            return json.loads(self.buffer[self.root_start:self.root_end])
+        if not self.started:
+            return None
+        return dict(self.fields) if self.is_object else list(self.items)
+
+
+def parse_json_block(text: str, root: Optional[str] = None, members: Optional[type] = None) -> Any:
+    """Parse the first JSON object/array in ``text``; return None if absent.
+
+    A ```json fenced block is tried first, so brackets in the prose before
+    it are not mistaken for the root.
+    """
+    fence = text.find(_FENCE)
+    if fence >= 0:
+        start = fence + len(_FENCE)
+        end = text.find("```", start)
+        parser = IncrementalJSONParser(root, members)
+        parser.feed(text[start:end if end >= 0 else len(text)])
+        result = parser.result()
+        if result:
+            return result
+    parser = IncrementalJSONParser(root, members)
+    parser.feed(text)
+    return parser.result()
@@ -2,6 +2,8 @@ import sys
 from types import SimpleNamespace
 from pathlib import Path
 
+import pytest
+
 ROOT = Path(__file__).resolve().parents[1]
 if str(ROOT) not in sys.path:
     sys.path.insert(0, str(ROOT))
@@ -58,6 +60,11 @@ if 'fastapi' not in sys.modules:
     sys.modules['fastapi.middleware'] = SimpleNamespace(cors=cors_stub)
     sys.modules['fastapi.middleware.cors'] = cors_stub
 
+    async def run_in_threadpool(func, *args, **kwargs):
+        import asyncio
+        return await asyncio.to_thread(func, *args, **kwargs)
+    sys.modules['fastapi.concurrency'] = SimpleNamespace(run_in_threadpool=run_in_threadpool)
+
 if 'pydantic' not in sys.modules:
     class BaseModel:
         def __init__(self, **data):
@@ -82,3 +89,22 @@ if 'requests' not in sys.modules:
 if 'uvicorn' not in sys.modules:
     uvicorn_stub = SimpleNamespace(run=lambda *a, **k: None)
     sys.modules['uvicorn'] = uvicorn_stub
+
+
+@pytest.fixture
+def isolated_store(monkeypatch, tmp_path):
+    """Point chunk_store and ingestion at an empty in-memory store, catalog and
+    vector segment, with a constant embedding; returns ``(store, catalog)``."""
+    from catalog import KnowledgeCatalog
+    from chunk_store import KnowledgeStore
+    from vector_segment import VectorSegment
+
+    store, catalog = KnowledgeStore(), KnowledgeCatalog(":memory:")
+    monkeypatch.setattr('chunk_store.store', store)
+    monkeypatch.setattr('chunk_store.catalog', catalog)
+    monkeypatch.setattr('chunk_store.vector_segment', VectorSegment(":memory:"))
+    monkeypatch.setattr('ingestion.get_embedding', lambda text: [1.0, 0.0])
+    # no legacy job files to import
+    monkeypatch.setattr('data_persistence.INGESTION_JOBS_FILE', tmp_path / "jobs.json")
+    monkeypatch.setattr('data_persistence.INGESTION_BATCHES_FILE', tmp_path / "batches.json")
+    return store, catalog
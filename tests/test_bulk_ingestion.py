@@ -0,0 +1,101 @@
+import asyncio
+import json
+import zipfile
+
+import pytest
+import bulk_ingestion
+from bulk_ingestion import stage_archive, resolve_import_directory
+from ingestion import IngestionQueue
+
+
+def make_archive(path):
+    with zipfile.ZipFile(path, "w") as archive:
+        archive.writestr("manifest.json", json.dumps({"指南/重点": {"knowledge_type": "肿瘤临床指南", "title": "重点指南"}}))
+        archive.writestr("指南/重点/a.txt", "重点内容。")
+        archive.writestr("医学文献/b.md", "文献内容。")
+        archive.writestr("c.txt", "根目录内容。")
+        archive.writestr("image.png", b"\x89PNG")
+        archive.writestr("../evil.txt", "越界")
+
+
+def test_stage_archive_assigns_types(tmp_path, monkeypatch):
+    monkeypatch.setattr(bulk_ingestion, "UPLOAD_DIR", tmp_path)
+    archive_path = tmp_path / "lib.zip"
+    make_archive(archive_path)
+
+    specs, skipped = stage_archive(archive_path, "batch1", "用户上传文档")
+    types = {spec["original_name"]: (spec["knowledge_type"], spec["title"]) for spec in specs}
+    assert types == {
+        "指南/重点/a.txt": ("肿瘤临床指南", "重点指南"),
+        "医学文献/b.md": ("医学文献", None),
+        "c.txt": ("用户上传文档", None),
+    }
+    assert [s["file"] for s in skipped] == ["image.png"]
+    assert (tmp_path / "医学文献__b.md").read_text(encoding="utf-8") == "文献内容。"
+    assert not archive_path.exists()
+
+
+def test_directory_must_be_inside_allowed_root(tmp_path, monkeypatch):
+    allowed = tmp_path / "imports"
+    (allowed / "lib").mkdir(parents=True)
+    monkeypatch.setattr(bulk_ingestion, "BULK_IMPORT_ALLOWED_DIRS", [str(allowed)])
+    assert resolve_import_directory(str(allowed / "lib")) == (allowed / "lib").resolve()
+    with pytest.raises(PermissionError):
+        resolve_import_directory(str(tmp_path))
+
+
+def test_archive_and_directory_limits(tmp_path, monkeypatch):
+    monkeypatch.setattr(bulk_ingestion, "UPLOAD_DIR", tmp_path)
+    monkeypatch.setattr(bulk_ingestion, "BULK_IMPORT_MAX_FILE_BYTES", 100)
+    monkeypatch.setattr(bulk_ingestion, "BULK_IMPORT_MAX_TOTAL_BYTES", 1000)
+    archive_path = tmp_path / "bomb.zip"
+    with zipfile.ZipFile(archive_path, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("big.txt", "0" * 500)
+        archive.writestr("ok.txt", "内容")
+    specs, skipped = stage_archive(archive_path, "batch2", "指南")
+    assert [s["original_name"] for s in specs] == ["ok.txt"]
+    assert skipped[0]["file"] == "big.txt" and not (tmp_path / "big.txt").exists()
+
+    with zipfile.ZipFile(archive_path, "w", zipfile.ZIP_DEFLATED) as archive:
+        for i in range(20):
+            archive.writestr(f"{i}.txt", "0" * 90)
+    with pytest.raises(ValueError):
+        stage_archive(archive_path, "batch3", "指南")
+
+    # a link inside the allowed root must not reach files outside it
+    allowed = tmp_path / "imports"
+    (allowed / "lib").mkdir(parents=True)
+    (tmp_path / "secret.txt").write_text("机密", encoding="utf-8")
+    (allowed / "lib" / "link.txt").symlink_to(tmp_path / "secret.txt")
+    (allowed / "lib" / "a.txt").write_text("内容", encoding="utf-8")
+    monkeypatch.setattr(bulk_ingestion, "BULK_IMPORT_ALLOWED_DIRS", [str(allowed)])
+    specs, skipped = bulk_ingestion.stage_directory(str(allowed / "lib"), "batch4", "指南")
+    assert [s["original_name"] for s in specs] == ["a.txt"]
+    assert [s["file"] for s in skipped] == ["link.txt"]
+
+
+def test_batch_summary_aggregates_jobs(tmp_path, isolated_store):
+    good = tmp_path / "good.txt"
+    good.write_text("第一段。\n\n第二段。", encoding="utf-8")
+    specs = [
+        {"file_path": good, "original_name": "good.txt", "knowledge_type": "指南"},
+        {"file_path": tmp_path / "missing.txt", "original_name": "missing.txt", "knowledge_type": "指南"},
+    ]
+
+    async def run():
+        queue = IngestionQueue(max_concurrent_jobs=2)
+        queue.start()
+        queue.enqueue_batch("b1", "lib.zip", specs, [])
+        for _ in range(200):
+            if queue.get_batch("b1")["status"] == "completed":
+                break
+            await asyncio.sleep(0.01)
+        await queue.stop()
+        return queue.get_batch("b1")
+
+    batch = asyncio.run(run())
+    assert batch["status"] == "completed"
+    assert (batch["files_completed"], batch["files_failed"]) == (1, 1)
+    assert batch["chunks_processed"] == 2 and batch["embedding_calls"] == 2
+    assert batch["failures"][0]["file"] == "missing.txt"
+    assert "files_per_second" in batch and "chunks_per_second" in batch
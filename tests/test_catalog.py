@@ -0,0 +1,167 @@
+import pytest
+
+from catalog import KnowledgeCatalog
+
+
+def test_file_lookups_use_catalog_rows(tmp_path):
+    catalog = KnowledgeCatalog(tmp_path / "catalog.db")
+    with catalog.transaction() as conn:
+        catalog.put_file(conn, {"filename": "a_1.txt", "original_name": "a.txt", "knowledge_type": "指南",
+                                "upload_time": "2024-01-02", "sha256": "h1"})
+        catalog.put_file(conn, {"filename": "b.txt", "original_name": "b.txt", "knowledge_type": "文献",
+                                "upload_time": "2024-01-01", "sha256": "h2"})
+
+    reopened = KnowledgeCatalog(tmp_path / "catalog.db")
+    assert [f["filename"] for f in reopened.list_files()] == ["b.txt", "a_1.txt"]
+    assert [f["filename"] for f in reopened.list_files("指南")] == ["a_1.txt"]
+    assert reopened.find_file("a.txt")["filename"] == "a_1.txt"
+    assert reopened.find_file_by_hash("h2")["filename"] == "b.txt"
+    assert reopened.count_files() == 2
+
+
+def test_refs_and_chunk_counts():
+    catalog = KnowledgeCatalog(":memory:")
+    with catalog.transaction() as conn:
+        catalog.put_chunk(conn, {"content_hash": "c1", "id": "1", "knowledge_type": "指南",
+                                 "metadata": {"source_file": "a.txt"}})
+        catalog.add_refs(conn, [
+            {"content_hash": "c1", "file": "a.txt", "chunk_index": 1, "knowledge_type": "指南", "page": 3},
+            {"content_hash": "c1", "file": "b.txt", "chunk_index": 0, "knowledge_type": "文献"},
+        ])
+    assert catalog.file_refs("a.txt") == [
+        {"content_hash": "c1", "file": "a.txt", "chunk_index": 1, "knowledge_type": "指南", "page": 3}]
+    assert catalog.chunk_type_counts() == {"指南": 1}
+
+    with catalog.transaction() as conn:
+        catalog.delete_chunks(conn, ["c1"])
+    assert catalog.hash_refs("c1") == [] and catalog.count_chunks() == 0
+
+
+def test_failed_transaction_rolls_back():
+    catalog = KnowledgeCatalog(":memory:")
+    try:
+        with catalog.transaction() as conn:
+            catalog.put_file(conn, {"filename": "a.txt"})
+            raise RuntimeError
+    except RuntimeError:
+        pass
+    assert catalog.get_file("a.txt") is None
+
+
+def test_query_files_pages_filters_and_sorts():
+    catalog = KnowledgeCatalog(":memory:")
+    with catalog.transaction() as conn:
+        for i in range(5):
+            catalog.put_file(conn, {"filename": f"f{i}.txt", "original_name": f"report_{i}.txt",
+                                    "knowledge_type": "指南" if i % 2 else "文献",
+                                    "upload_time": f"2024-01-0{i + 1}"})
+
+    seen, cursor = [], None
+    while True:
+        files, cursor, total = catalog.query_files(limit=2, cursor=cursor)
+        seen += [f["filename"] for f in files]
+        if cursor is None:
+            break
+    assert seen == ["f4.txt", "f3.txt", "f2.txt", "f1.txt", "f0.txt"] and total == 5
+
+    files, cursor, total = catalog.query_files(knowledge_type="指南", sort="original_name", descending=False)
+    assert [f["filename"] for f in files] == ["f1.txt", "f3.txt"] and cursor is None and total == 2
+    files, _, _ = catalog.query_files(name="t_2", uploaded_after="2024-01-02")
+    assert [f["filename"] for f in files] == ["f2.txt"]
+    files, _, _ = catalog.query_files(name="%")
+    assert files == []
+
+    with pytest.raises(ValueError):
+        catalog.query_files(sort="info")
+    with pytest.raises(ValueError):
+        catalog.query_files(cursor="not a cursor")
+
+
+def test_file_refs_page_and_summary():
+    catalog = KnowledgeCatalog(":memory:")
+    with catalog.transaction() as conn:
+        catalog.add_refs(conn, [{"content_hash": f"c{i}", "file": "a.txt", "chunk_index": i,
+                                 "knowledge_type": "指南" if i else "文献"} for i in range(3)])
+    assert [r["chunk_index"] for r in catalog.file_refs_page("a.txt", limit=2)] == [0, 1]
+    assert [r["chunk_index"] for r in catalog.file_refs_page("a.txt", after_index=1)] == [2]
+    summary = catalog.file_ref_summary("a.txt")
+    assert summary["chunks"] == 3 and set(summary["knowledge_types"]) == {"文献", "指南"}
+
+
+def test_change_log_numbers_changes_and_detects_gaps(monkeypatch):
+    catalog = KnowledgeCatalog(":memory:")
+    with catalog.transaction() as conn:
+        first = catalog.log_change(conn, [("chunk", "c1"), ("file", "a.txt")])
+    with catalog.transaction() as conn:
+        second = catalog.log_change(conn, [])
+    assert (first, second) == (1, 2) and catalog.generation() == 2
+    assert catalog.changes_since(0) == [(1, "chunk", "c1"), (1, "file", "a.txt"), (2, "version", None)]
+    assert catalog.changes_since(2) == []
+
+    monkeypatch.setattr('catalog.CHANGE_LOG_RETENTION', 1)
+    with catalog.transaction() as conn:
+        catalog.log_change(conn, [("chunk", "c2")])
+    assert catalog.changes_since(2) == [(3, "chunk", "c2")]
+    assert catalog.changes_since(0) is None
+
+
+def test_job_is_leased_to_one_worker():
+    catalog = KnowledgeCatalog(":memory:")
+    with catalog.transaction() as conn:
+        catalog.add_job(conn, {"id": "j1", "status": "queued", "created": 1.0})
+    assert catalog.claim_job("w1", 30, now=100.0)["id"] == "j1"
+    assert catalog.claim_job("w2", 30, now=101.0) is None
+    # a lease that ran out is taken over, and the old owner can no longer write
+    job = catalog.claim_job("w2", 30, now=131.0)
+    assert job["id"] == "j1"
+    with catalog.transaction() as conn:
+        assert not catalog.update_job(conn, dict(job, status="completed"), "w1", None)
+        assert catalog.update_job(conn, dict(job, status="completed"), "w2", None)
+    assert catalog.get_job("j1")["status"] == "completed"
+    assert catalog.claim_job("w3", 30, now=1000.0) is None
+
+
+def test_duplicate_refs_are_removed_from_older_catalogs(tmp_path):
+    import sqlite3
+    path = tmp_path / "catalog.db"
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE chunk_refs (content_hash TEXT NOT NULL, filename TEXT NOT NULL, "
+                 "chunk_index INTEGER NOT NULL, knowledge_type TEXT, page INTEGER)")
+    conn.executemany("INSERT INTO chunk_refs VALUES (?, ?, ?, ?, ?)",
+                     [("c1", "a.txt", 0, "指南", None)] * 2 + [("c1", "a.txt", 1, "指南", None)])
+    conn.commit()
+    conn.close()
+
+    catalog = KnowledgeCatalog(path)
+    assert [ref["chunk_index"] for ref in catalog.file_refs("a.txt")] == [0, 1]
+    with catalog.transaction() as conn:
+        catalog.add_refs(conn, [{"content_hash": "c1", "file": "a.txt", "chunk_index": 0, "knowledge_type": "指南"}])
+    assert len(catalog.file_refs("a.txt")) == 2
+
+
+def test_reads_do_not_wait_for_a_write_transaction(tmp_path):
+    import threading
+    catalog = KnowledgeCatalog(tmp_path / "catalog.db")
+    with catalog.transaction() as conn:
+        catalog.put_file(conn, {"filename": "a.txt", "knowledge_type": "指南"})
+    writing, release = threading.Event(), threading.Event()
+
+    def writer():
+        with catalog.transaction() as conn:
+            catalog.put_file(conn, {"filename": "b.txt", "knowledge_type": "指南"})
+            # reads inside the transaction see its own writes
+            assert catalog.count_files() == 2
+            writing.set()
+            release.wait(5)
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    assert writing.wait(5)
+    counts = []
+    reader = threading.Thread(target=lambda: counts.append(catalog.count_files()))
+    reader.start()
+    reader.join(5)
+    release.set()
+    thread.join()
+    assert counts == [1]
+    assert catalog.count_files() == 2
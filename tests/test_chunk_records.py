@@ -0,0 +1,49 @@
+from chunk_records import ChunkRecord, file_metadata
+
+
+def make_doc(i, **metadata):
+    return {
+        "id": str(i), "content": f"内容{i}", "content_hash": f"h{i}", "embedding": [0.5, -0.25],
+        "knowledge_type": "指" + "南",
+        "metadata": {"title": "指南", "source_file": "a.pdf", "upload_time": "2024-01-01",
+                     "file_type": ".pdf", "embedding_dimension": 2, "chunk_index": i, **metadata},
+    }
+
+
+def test_record_round_trips_chunk_dict():
+    doc = make_doc(0, page=3, section="背景")
+    record = ChunkRecord.of(doc)
+    assert record.to_dict() == doc
+    assert record["metadata"] == doc["metadata"] and record.get("missing") is None
+    assert ChunkRecord.of(record) is record
+
+
+def test_chunks_of_a_file_share_metadata_row():
+    rows = len(file_metadata)
+    first, second = ChunkRecord.of(make_doc(1)), ChunkRecord.of(make_doc(2, page=2))
+    assert first.file_row is second.file_row
+    assert len(file_metadata) <= rows + 1
+    assert first.knowledge_type is second.knowledge_type
+    assert second.metadata["chunk_index"] == 2 and second.metadata["page"] == 2
+
+
+def test_set_metadata_moves_record_to_other_file():
+    record = ChunkRecord.of(make_doc(3))
+    metadata = record.metadata
+    metadata.update(source_file="b.pdf", chunk_index=7)
+    record.set_metadata(metadata)
+    assert record["metadata"]["source_file"] == "b.pdf"
+    assert record["metadata"]["chunk_index"] == 7
+
+
+def test_metadata_rows_are_freed_with_their_records():
+    import gc
+    record = ChunkRecord.of(make_doc(4, title="仅此文件"))
+    rows = len(file_metadata)
+    copy = record.copy()
+    del record
+    gc.collect()
+    assert len(file_metadata) == rows
+    copy.set_metadata({**copy.metadata, "source_file": "c.pdf"})
+    gc.collect()
+    assert len(file_metadata) == rows
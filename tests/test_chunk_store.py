@@ -0,0 +1,266 @@
+from types import SimpleNamespace
+
+import pytest
+
+import chunk_store
+from catalog import KnowledgeCatalog
+from ingestion import ingest_file
+from vector_segment import VectorSegment
+
+
+def ingest(tmp_path, name, text, knowledge_type="指南"):
+    path = tmp_path / name
+    path.write_text(text, encoding="utf-8")
+    return ingest_file({"file_path": str(path), "original_name": name, "knowledge_type": knowledge_type})
+
+
+def test_duplicate_chunks_reuse_embeddings(isolated_store, monkeypatch, tmp_path):
+    store, catalog = isolated_store
+    calls = []
+    monkeypatch.setattr('ingestion.get_embedding', lambda text: calls.append(text) or [1.0, 0.0])
+
+    ingest(tmp_path, "a.txt", "共同的模板段落。\n\n方案A特有内容。")
+    result = ingest(tmp_path, "b.txt", "共同的模板段落。\n\n方案B特有内容。\n\n方案B特有内容。")
+
+    assert len(calls) == 3
+    assert len(store) == 3
+    assert result["records_added"] == 1
+    assert result["processing_info"]["embeddings_reused"] == 2
+    assert [ref["chunk_index"] for _, ref in chunk_store.get_file_chunks("b.txt")] == [0, 1, 2]
+
+
+def test_reused_chunk_deleted_during_embedding_is_stored_again(isolated_store, monkeypatch, tmp_path):
+    store, catalog = isolated_store
+    ingest(tmp_path, "a.txt", "共同的模板段落。\n\n方案A特有内容。")
+
+    def embed_and_delete_a(text):
+        # the old version is deleted while the new file is still embedding
+        if chunk_store.get_file_info("a.txt") is not None:
+            chunk_store.remove_file("a.txt")
+        return [1.0, 0.0]
+
+    monkeypatch.setattr('ingestion.get_embedding', embed_and_delete_a)
+    ingest(tmp_path, "b.txt", "共同的模板段落。\n\n方案B特有内容。")
+
+    pairs = chunk_store.get_file_chunks("b.txt")
+    assert [doc["content"] for doc, _ in pairs] == ["共同的模板段落。", "方案B特有内容。"]
+    assert pairs[0][0]["metadata"]["source_file"] == "b.txt"
+    assert len(store) == 2
+    assert catalog.hash_refs(pairs[0][0]["content_hash"])[0]["file"] == "b.txt"
+
+
+def test_delete_keeps_chunks_shared_with_other_files(isolated_store, tmp_path):
+    store, catalog = isolated_store
+    ingest(tmp_path, "a.txt", "共同段落。\n\n仅A。")
+    ingest(tmp_path, "b.txt", "共同段落。", knowledge_type="文献")
+
+    file_info, deleted = chunk_store.remove_file("a.txt")
+    assert file_info["original_name"] == "a.txt" and deleted == 1
+    docs = store.list_documents()
+    assert [d["content"] for d in docs] == ["共同段落。"]
+    assert docs[0]["metadata"]["source_file"] == "b.txt"
+    assert chunk_store.chunk_knowledge_types(docs[0]) == {"文献"}
+
+    assert chunk_store.remove_file("b.txt")[1] == 1
+    assert store.list_documents() == [] and catalog.list_files() == []
+    assert chunk_store.remove_file("b.txt") is None
+
+
+def test_legacy_documents_are_merged_on_rebuild(isolated_store):
+    legacy = [
+        {"id": str(i), "content": "重复  内容", "embedding": [1.0], "knowledge_type": "指南",
+         "metadata": {"source_file": "g.txt", "chunk_index": 0}}
+        for i in range(2)
+    ]
+    store, catalog = isolated_store
+    with catalog.transaction() as conn:
+        catalog.put_file(conn, {"filename": "g.txt", "original_name": "g.txt"})
+        catalog.put_file(conn, {"filename": "g_2024.txt", "original_name": "g.txt"})
+    assert chunk_store.rebuild_index(legacy)
+    docs = store.list_documents()
+    assert len(docs) == 1
+    refs = catalog.hash_refs(docs[0]["content_hash"])
+    assert [ref["file"] for ref in refs] == ["g.txt", "g_2024.txt"]
+    assert not chunk_store.rebuild_index()
+
+
+def test_replace_file_embeds_only_changed_chunks(isolated_store, monkeypatch, tmp_path):
+    store, catalog = isolated_store
+    monkeypatch.setattr('ingestion.UPLOAD_DIR', tmp_path)
+    calls = []
+    monkeypatch.setattr('ingestion.get_embedding', lambda text: calls.append(text) or [1.0, 0.0])
+    ingest(tmp_path, "v1.txt", "背景不变。\n\n旧的给药方案。\n\n统计不变。")
+
+    path = tmp_path / "v2.txt"
+    path.write_text("背景不变。\n\n新的给药方案。\n\n统计不变。", encoding="utf-8")
+    result = ingest_file({"file_path": str(path), "original_name": "v2.txt",
+                          "knowledge_type": "指南", "replace_filename": "v1.txt"})
+
+    assert calls[3:] == ["新的给药方案。"]
+    assert result["replacement"]["chunks_unchanged"] == 2
+    assert result["replacement"]["chunks_dropped"] == 1
+    docs = store.list_documents()
+    assert sorted(d["content"] for d in docs) == ["新的给药方案。", "统计不变。", "背景不变。"]
+    files = catalog.list_files()
+    assert [f["filename"] for f in files] == ["v2.txt"] and files[0]["version"] == 2
+    assert not (tmp_path / "v1.txt").exists()
+    assert {d["metadata"]["source_file"] for d in docs} == {"v2.txt"}
+
+
+def test_deletes_are_tombstones_until_compaction(monkeypatch):
+    store = chunk_store.KnowledgeStore(
+        {"content_hash": str(i), "content": str(i), "embedding": [1.0]} for i in range(4))
+    monkeypatch.setattr('chunk_store.COMPACTION_MIN_GARBAGE', 10)
+    reader = store.documents()
+    assert next(reader)["content"] == "0"
+
+    store.publish([{"content_hash": "4", "content": "4", "embedding": [1.0]}], ["1", "2"])
+    assert [d["content"] for d in store.documents()] == ["0", "3", "4"]
+    # an iteration that started earlier keeps seeing its own version
+    assert [d["content"] for d in reader] == ["1", "2", "3"]
+    assert store.get("1") is None and store.garbage == 2 and len(store) == 3
+
+    store.compact()
+    assert store.garbage == 0
+    assert [d["content"] for d in store.documents()] == ["0", "3", "4"]
+    assert store.get("4")["content"] == "4"
+
+
+def test_one_compaction_runs_at_a_time(monkeypatch):
+    started = []
+
+    class RecordingThread:
+        def __init__(self, target, **kwargs):
+            started.append(target)
+
+        def start(self):
+            pass
+
+    store = chunk_store.KnowledgeStore(
+        {"content_hash": str(i), "content": str(i), "embedding": [1.0]} for i in range(4))
+    monkeypatch.setattr(chunk_store, "threading", SimpleNamespace(Thread=RecordingThread))
+    monkeypatch.setattr('chunk_store.COMPACTION_MIN_GARBAGE', 1)
+    store.publish([], ["0", "1"])
+    store.publish([], ["2"])
+    assert len(started) == 1
+    store.compact()
+    store.publish([], ["3"])
+    assert len(started) == 2
+
+
+def test_stats_follow_uploads_and_deletes(isolated_store, tmp_path):
+    store, catalog = isolated_store
+    ingest(tmp_path, "a.txt", "共同段落。\n\n仅A。")
+    ingest(tmp_path, "b.txt", "共同段落。", knowledge_type="文献")
+
+    stats = store.stats.snapshot()
+    assert stats["by_type"]["指南"]["chunks"] == 2 and stats["by_type"]["文献"]["files"] == 1
+    assert stats["total_files"] == 2 and stats["embedding_dimensions"] == {2: 2}
+
+    chunk_store.remove_file("a.txt")
+    stats = store.stats.snapshot()
+    assert list(stats["by_type"]) == ["文献"]
+    assert stats["by_type"]["文献"]["chunks"] == 1 and stats["total_chunks"] == len(store)
+    assert 'knowledge_chunks{knowledge_type="文献"} 1' in store.stats.to_prometheus()
+
+
+def test_file_chunks_page_through_cursor(isolated_store, tmp_path):
+    store, catalog = isolated_store
+    ingest(tmp_path, "a.txt", "第一段。\n\n第二段内容。\n\n第三段。")
+
+    first, cursor = chunk_store.get_file_chunks_page("a.txt", limit=2)
+    rest, last = chunk_store.get_file_chunks_page("a.txt", cursor, limit=2)
+    assert [ref["chunk_index"] for _, ref in first + rest] == [0, 1, 2] and last is None
+    with pytest.raises(ValueError):
+        chunk_store.get_file_chunks_page("a.txt", "bad")
+
+    summary = chunk_store.file_chunk_summary("a.txt")
+    assert summary["chunks"] == 3 and summary["knowledge_types"] == ["指南"]
+    assert summary["embedding_dimension"] == 2 and summary["avg_chunk_length"] == 14 / 3
+
+
+def test_snapshot_is_isolated_from_later_publishes(isolated_store, tmp_path):
+    store, catalog = isolated_store
+    ingest(tmp_path, "a.txt", "共同段落。\n\n仅A。")
+    ingest(tmp_path, "b.txt", "共同段落。", knowledge_type="文献")
+    before = store.snapshot()
+    shared = before.get(chunk_store.chunk_hash("共同段落。"))
+    assert chunk_store.chunk_knowledge_types(shared) == {"指南", "文献"}
+
+    chunk_store.remove_file("a.txt")
+    after = store.snapshot()
+    assert after.version == before.version + 1 == store.version
+    # the old snapshot still reads its records, unchanged
+    assert sorted(d["content"] for d in before.documents()) == ["仅A。", "共同段落。"]
+    assert shared["knowledge_type"] == "指南" and shared["metadata"]["source_file"] == "a.txt"
+    assert len(before) == 2 and len(after) == 1
+    # the new one sees the shared chunk retyped to its remaining file
+    current = after.get(shared["content_hash"])
+    assert current["knowledge_type"] == "文献" and current["metadata"]["source_file"] == "b.txt"
+    assert chunk_store.chunk_knowledge_types(current) == {"文献"}
+    assert store.stats.snapshot()["by_type"]["文献"]["chunks"] == 1
+
+
+def test_workers_follow_each_others_changes(monkeypatch, tmp_path):
+    def worker():
+        return (chunk_store.KnowledgeStore(), KnowledgeCatalog(tmp_path / "catalog.db"),
+                VectorSegment(tmp_path / "vectors.seg"))
+
+    def use(w):
+        monkeypatch.setattr('chunk_store.store', w[0])
+        monkeypatch.setattr('chunk_store.catalog', w[1])
+        monkeypatch.setattr('chunk_store.vector_segment', w[2])
+
+    a, b = worker(), worker()
+    config = {}
+    monkeypatch.setattr('chunk_store.current_config', config)
+    monkeypatch.setattr('ingestion.get_embedding', lambda text: [1.0, 0.0])
+    use(a)
+    ingest(tmp_path, "a.txt", "第一段。\n\n第二段。")
+
+    use(b)
+    assert chunk_store.sync_changes() and not chunk_store.sync_changes()
+    assert sorted(d["content"] for d in b[0].documents()) == ["第一段。", "第二段。"]
+    assert b[0].version == a[0].version and b[0].stats.snapshot()["total_files"] == 1
+    doc = b[0].list_documents()[0]
+    assert isinstance(doc.embedding, memoryview) and list(doc.embedding) == [1.0, 0.0]
+
+    chunk_store.remove_file("a.txt")
+    chunk_store.advance_version({"llm": {"model": "m2"}})
+    use(a)
+    assert chunk_store.sync_changes()
+    assert len(a[0]) == 0 and a[0].version == b[0].version
+    assert config == {"llm": {"model": "m2"}}
+
+    # a compaction in one worker moves the other's records to the new segment
+    ingest(tmp_path, "c.txt", "第三段。")
+    assert chunk_store.compact_vector_segment()
+    use(b)
+    assert chunk_store.sync_changes()
+    doc = b[0].list_documents()[0]
+    assert isinstance(doc.embedding, memoryview) and list(doc.embedding) == [1.0, 0.0]
+    assert b[0].stats.snapshot()["total_files"] == 1
+    assert chunk_store.catalog.chunk_rows()[0][-1] == 1
+
+
+def test_vector_segment_is_compacted_after_deletes(isolated_store, monkeypatch, tmp_path):
+    store, catalog = isolated_store
+    segment = VectorSegment(tmp_path / "vectors.seg")
+    monkeypatch.setattr('chunk_store.vector_segment', segment)
+    monkeypatch.setattr('ingestion.get_embedding', lambda text: [float(len(text)), 1.0])
+    ingest(tmp_path, "a.txt", "仅A的段落。\n\n另一个A段落。")
+    ingest(tmp_path, "b.txt", "B段落。")
+
+    assert not chunk_store.compact_vector_segment()
+    chunk_store.remove_file("a.txt")
+    assert chunk_store.compact_vector_segment()
+    assert segment.size(1) == 2 and catalog.get_meta("vector_segment_id") == "1"
+    docs = store.list_documents()
+    assert [(d["content"], list(d["embedding"])) for d in docs] == [("B段落。", [4.0, 1.0])]
+    # the replaced file is kept for readers until the next compaction deletes it
+    assert (tmp_path / "vectors.seg").exists()
+    ingest(tmp_path, "c.txt", "C段落。")
+    chunk_store.remove_file("b.txt")
+    assert chunk_store.compact_vector_segment()
+    assert not (tmp_path / "vectors.seg").exists() and (tmp_path / "vectors.1.seg").exists()
+    assert [list(d["embedding"]) for d in store.list_documents()] == [[4.0, 1.0]]
@@ -0,0 +1,40 @@
+from context_packer import estimate_tokens, pack_context, truncate_to_tokens
+
+
+def test_estimate_tokens_cjk_aware():
+    assert estimate_tokens("临床试验") == 4
+    assert estimate_tokens("abcdefgh") == 2
+    assert estimate_tokens("") == 0
+
+
+def test_pack_context_orders_by_score_and_drops_overlap():
+    base = "入选标准要求年龄十八岁以上并签署知情同意书。" * 3
+    docs = [
+        {"knowledge_type": "指南", "content": "排除标准包括活动性感染。", "score": 0.5},
+        {"knowledge_type": "模板", "content": base, "score": 0.9},
+        {"knowledge_type": "模板", "content": base[2:], "score": 0.8},
+    ]
+    context, info = pack_context(docs, budget=1000)
+    assert context.index("入选标准") < context.index("排除标准")
+    assert info["chunks_used"] == 2
+    assert info["chunks_redundant"] == 1
+    assert info["packed_tokens"] <= 1000
+
+
+def test_pack_context_respects_budget():
+    docs = [{"knowledge_type": "t", "content": "内容" * 200, "score": 1.0}]
+    context, info = pack_context(docs, budget=100)
+    assert info["chunks_truncated"] == 1
+    assert estimate_tokens(context) <= 100
+    assert truncate_to_tokens("abcd" * 10, 2) == "abcdabcd"
+
+
+def test_pack_context_lists_sources_of_packed_chunks():
+    docs = [
+        {"content": "入选标准。" * 40, "score": 0.9, "metadata": {"title": "方案模板"}},
+        {"content": "排除标准。" * 40, "score": 0.8, "metadata": {"source_file": "指南.pdf"}},
+        {"content": "随访计划。" * 40, "score": 0.1, "metadata": {"title": "未打包"}},
+    ]
+    _, info = pack_context(docs, budget=420)
+    assert info["chunks_used"] == 2
+    assert info["sources"] == ["方案模板", "指南.pdf"]
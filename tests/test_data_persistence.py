@@ -1,16 +1,22 @@
-from data_persistence import load_data, save_data
+import json
 
+from data_persistence import load_chunk_refs, load_uploaded_files, load_vectors
 
-def test_load_and_save_data(tmp_path, monkeypatch):
+
+def test_legacy_files_are_read_for_import(tmp_path, monkeypatch):
     vec_file = tmp_path / "vec.json"
     upload_file = tmp_path / "upl.json"
     monkeypatch.setattr('data_persistence.VECTOR_STORE_FILE', vec_file)
     monkeypatch.setattr('data_persistence.UPLOADED_FILES_FILE', upload_file)
+    monkeypatch.setattr('data_persistence.CHUNK_REFS_FILE', tmp_path / "missing.json")
 
     sample_vec = [{"id": 1}]
     sample_up = [{"name": "file"}]
-    save_data(sample_vec, sample_up)
+    vec_file.write_text(json.dumps(sample_vec), encoding="utf-8")
+    upload_file.write_text(json.dumps(sample_up), encoding="utf-8")
 
-    loaded_vec, loaded_up = load_data()
-    assert loaded_vec == sample_vec
-    assert loaded_up == sample_up
+    progress = []
+    assert load_vectors(lambda read, total: progress.append((read, total))) == sample_vec
+    assert progress[-1][0] == progress[-1][1] == vec_file.stat().st_size
+    assert load_uploaded_files() == sample_up
+    assert load_chunk_refs() == {}
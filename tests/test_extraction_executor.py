@@ -0,0 +1,89 @@
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pytest
+import extraction_executor
+from extraction_executor import ExtractionExecutor, ExtractionError, ExtractionTimeout
+
+
+def echo_worker(path, filename, out_path, memory_limit_mb, pdf_workers=1):
+    with open(out_path, "w", encoding="utf-8") as out:
+        for page, line in enumerate(["第一段", "第二段"], 1):
+            out.write(json.dumps({"text": line, "meta": {"page": page}}, ensure_ascii=False) + "\n")
+        out.write(json.dumps({"error": "损坏的表格"}, ensure_ascii=False) + "\n")
+
+
+def slow_worker(path, filename, out_path, memory_limit_mb, pdf_workers=1):
+    time.sleep(5)
+
+
+def forking_worker(path, filename, out_path, memory_limit_mb, pdf_workers=1):
+    # stands in for the PDF page workers started by the extraction process
+    page_worker = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"])
+    Path(path).with_suffix(".pid").write_text(str(page_worker.pid))
+    time.sleep(30)
+
+
+def _running(pid):
+    try:
+        status = Path(f"/proc/{pid}/status").read_text()
+    except FileNotFoundError:
+        return False
+    return "State:\tZ" not in status
+
+
+def test_plain_text_is_read_inline(tmp_path):
+    path = tmp_path / "doc.txt"
+    path.write_text("第一段\n\n第二段", encoding="utf-8")
+    executor = ExtractionExecutor(max_workers=1, timeout=30)
+    assert list(executor.iter_segments(path)) == [("第一段", {}), ("第二段", {})]
+
+
+def test_worker_segments_and_errors_are_relayed(tmp_path, monkeypatch):
+    monkeypatch.setattr(extraction_executor, "_extraction_worker", echo_worker)
+    path = tmp_path / "doc.pdf"
+    path.write_bytes(b"%PDF")
+    segments = []
+    with pytest.raises(ExtractionError, match="损坏的表格"):
+        for segment in ExtractionExecutor(max_workers=1, timeout=30).iter_segments(path):
+            segments.append(segment)
+    assert segments == [("第一段", {"page": 1}), ("第二段", {"page": 2})]
+    assert not list(tmp_path.glob("*.segments"))
+
+
+def test_worker_is_killed_on_timeout(tmp_path, monkeypatch):
+    monkeypatch.setattr(extraction_executor, "_extraction_worker", slow_worker)
+    path = tmp_path / "doc.xlsx"
+    path.write_bytes(b"PK")
+    started = time.time()
+    with pytest.raises(ExtractionTimeout):
+        list(ExtractionExecutor(max_workers=1, timeout=0.5).iter_segments(path))
+    assert time.time() - started < 4
+
+
+@pytest.mark.skipif(not hasattr(os, "killpg") or not Path("/proc").is_dir(), reason="needs process groups")
+def test_timeout_kills_the_page_workers_too(tmp_path, monkeypatch):
+    monkeypatch.setattr(extraction_executor, "_extraction_worker", forking_worker)
+    path = tmp_path / "doc.pdf"
+    path.write_bytes(b"%PDF")
+    with pytest.raises(ExtractionTimeout):
+        list(ExtractionExecutor(max_workers=1, timeout=1).iter_segments(path))
+    pid = int(path.with_suffix(".pid").read_text())
+    deadline = time.time() + 2
+    while _running(pid) and time.time() < deadline:
+        time.sleep(0.05)
+    assert not _running(pid)
+
+
+def test_memory_limit_is_split_across_page_workers(monkeypatch, tmp_path):
+    limits = []
+    monkeypatch.setattr(extraction_executor, "_limit_memory", limits.append)
+    monkeypatch.setattr("file_utils.iter_segments_from_path", lambda *args, **kwargs: iter(()))
+    out = tmp_path / "out"
+    extraction_executor._extraction_worker("a.pdf", "a.pdf", str(out), 2000, pdf_workers=4)
+    extraction_executor._extraction_worker("a.xlsx", "a.xlsx", str(out), 2000, pdf_workers=4)
+    assert limits == [400, 2000]
@@ -18,3 +18,120 @@ def test_extract_text_from_file_txt():
     content = b"abc\n\n123"
     paragraphs = extract_text_from_file(content, "test.txt")
     assert paragraphs == ["abc", "123"]
+
+
+def test_spool_upload_streams_and_hashes(tmp_path):
+    import asyncio
+    import hashlib
+    from file_utils import spool_upload
+
+    data = b"x" * 2500
+
+    class FakeUpload:
+        def __init__(self):
+            self.offset = 0
+            self.reads = []
+
+        async def read(self, size=-1):
+            self.reads.append(size)
+            block = data[self.offset:self.offset + size]
+            self.offset += len(block)
+            return block
+
+    upload = FakeUpload()
+    dest = tmp_path / "spooled.txt"
+    size, digest = asyncio.run(spool_upload(upload, dest, chunk_size=1000))
+    assert size == 2500
+    assert digest == hashlib.sha256(data).hexdigest()
+    assert dest.read_bytes() == data
+    assert upload.reads == [1000, 1000, 1000, 1000]
+
+
+def test_unknown_extension_is_read_as_paragraphs():
+    assert extract_text_from_file("甲段\n\n乙段".encode("utf-8"), "notes.log") == ["甲段", "乙段"]
+    assert extract_text_from_file(b"  \n", "notes.log") == ["文件 notes.log 内容为空"]
+    assert extract_text_from_file(b"\xff\xfe\x00", "blob.bin") == ["不支持的文件格式: .bin，无法解析为文本"]
+
+def test_iter_text_from_path(tmp_path):
+    from file_utils import iter_text_from_path
+    path = tmp_path / "doc.md"
+    path.write_text("第一段\n第一段续\n\n\n第二段\n", encoding="utf-8")
+    assert list(iter_text_from_path(path)) == ["第一段\n第一段续", "第二段"]
+
+
+def test_text_without_blank_lines_is_cut_at_sentence_ends():
+    from file_utils import _iter_paragraphs
+    sentences = ["第%d句内容。" % i for i in range(40)]
+    lines = iter(["".join(sentences[:20]), "".join(sentences[20:]), "\n", "末段"])
+    paragraphs = list(_iter_paragraphs(lines, max_chars=50))
+    assert "".join(paragraphs[:-1]) == "".join(sentences) and paragraphs[-1] == "末段"
+    assert len(paragraphs) == 3 and all(p.endswith("。") for p in paragraphs[:-1])
+    assert list(_iter_paragraphs(iter(["x" * 30, "y" * 30]), max_chars=50)) == ["x" * 30 + "y" * 30]
+
+
+def test_iter_chunks_streams_segments_without_empty_chunks():
+    from file_utils import iter_chunks
+    segments = ["The dose is 3.5 mg. Next sentence here! 中文句子。", "", "x" * 25]
+    chunks = list(iter_chunks(segments, chunk_size=20, overlap=0))
+    assert chunks == ["The dose is 3.5 mg.", "Next sentence here!", "中文句子。", "x" * 20, "x" * 5]
+    # 首句超长时不应产生空的首块
+    assert all(chunk_text("很" * 30 + "。短句。", chunk_size=10, overlap=3))
+
+
+def test_iter_chunks_token_budget():
+    from file_utils import iter_chunks
+    text = "word " * 200
+    chunks = list(iter_chunks([text], chunk_size=40, overlap=0, length=lambda t: len(t.split())))
+    assert len(chunks) == 5
+    assert all(len(chunk.split()) == 40 for chunk in chunks)
+
+
+def test_detect_file_encoding_fast_paths(tmp_path, monkeypatch):
+    import codecs
+    import file_utils
+    from file_utils import detect_file_encoding, read_text_file
+
+    bom = tmp_path / "bom.txt"
+    bom.write_bytes(codecs.BOM_UTF8 + "临床方案".encode("utf-8"))
+    utf8 = tmp_path / "utf8.txt"
+    utf8.write_bytes("临床方案".encode("utf-8") * 1000)
+    gbk = tmp_path / "gbk.txt"
+    gbk.write_bytes("临床方案".encode("gbk") * 1000)
+
+    samples = []
+
+    def fake_detect(data):
+        samples.append(len(data))
+        return {"encoding": "GB2312", "confidence": 0.99}
+
+    monkeypatch.setattr(file_utils.chardet, "detect", fake_detect, raising=False)
+    assert detect_file_encoding(bom) == "utf-8-sig"
+    assert detect_file_encoding(utf8) == "utf-8"
+    assert samples == []
+    assert detect_file_encoding(gbk, sample_size=1024) == "gb18030"
+    assert samples == [1024]
+    assert read_text_file(gbk, "gb18030") == ("临床方案" * 1000, "gb18030")
+
+
+def test_csv_rows_streamed_with_header():
+    content = "药物,剂量,频次\nTCR-T,1e8,Q3W\n,,\n对照,,QD\n".encode("utf-8")
+    assert extract_text_from_file(content, "dose.csv") == [
+        "表头: 药物 | 剂量 | 频次",
+        "行1: TCR-T | 1e8 | Q3W",
+        "行3: 对照 | QD",
+    ]
+
+
+def test_pdf_pages_keep_full_text_and_page_metadata(monkeypatch):
+    import pdf_extraction
+
+    long_text = "第一页内容很长。" * 400
+    records = [
+        {"page": 1, "text": long_text, "seconds": 0.01},
+        {"page": 2, "text": "", "seconds": 0.02, "error": "bad xref"},
+    ]
+    monkeypatch.setattr(pdf_extraction, "iter_pdf_pages", lambda source, workers=1: iter(records))
+    segments = list(pdf_extraction.iter_pdf_segments("doc.pdf", "doc.pdf"))
+    assert segments[0] == (long_text, {"page": 1, "extract_seconds": 0.01})
+    assert segments[1] == ("", {"page": 2, "extract_seconds": 0.02, "error": "bad xref"})
+    assert pdf_extraction.clean_page_text("第一行\n第二行。。。  末尾") == "第一行 第二行。 末尾"
@@ -0,0 +1,114 @@
+import asyncio
+import time
+
+from ingestion import IngestionQueue
+
+
+def test_queue_processes_job_in_background(isolated_store, tmp_path):
+    store, catalog = isolated_store
+    path = tmp_path / "guide.txt"
+    path.write_text("第一段内容。\n\n第二段内容。", encoding="utf-8")
+
+    async def run():
+        queue = IngestionQueue(max_concurrent_jobs=1)
+        queue.start()
+        job = queue.enqueue(path, original_name="guide.txt", knowledge_type="指南")
+        assert job["status"] == "queued"
+        for _ in range(200):
+            if queue.get_job(job["id"])["status"] in ("completed", "failed"):
+                break
+            await asyncio.sleep(0.01)
+        await queue.stop()
+        return queue.get_job(job["id"])
+
+    job = asyncio.run(run())
+    assert job["status"] == "completed"
+    assert job["chunks_processed"] == 2
+    assert job["result"]["records_added"] == 2
+    assert "chunks_per_second" in job
+    assert len(store) == 2 and catalog.list_files()[0]["original_name"] == "guide.txt"
+
+
+def test_unfinished_jobs_are_requeued_after_restart(isolated_store, tmp_path):
+    _, catalog = isolated_store
+    path = tmp_path / "guide.txt"
+    path.write_text("内容", encoding="utf-8")
+    first = IngestionQueue()
+    job = first.enqueue(path, original_name="guide.txt", knowledge_type="指南")
+    # the worker that leased the job died without renewing its lease
+    with catalog.transaction() as conn:
+        conn.execute("UPDATE ingestion_jobs SET status = 'running', lease_owner = 'gone', lease_expires = ?",
+                     (time.time() - 1,))
+
+    async def run():
+        restarted = IngestionQueue(max_concurrent_jobs=1)
+        restarted.start()
+        for _ in range(200):
+            if restarted.get_job(job["id"])["status"] == "completed":
+                break
+            await asyncio.sleep(0.01)
+        await restarted.stop()
+        return restarted.get_job(job["id"])
+
+    assert asyncio.run(run())["status"] == "completed"
+
+
+def test_workers_sharing_the_catalog_ingest_a_job_once(isolated_store, monkeypatch, tmp_path):
+    store, catalog = isolated_store
+    path = tmp_path / "guide.txt"
+    path.write_text("第一段内容。\n\n第二段内容。", encoding="utf-8")
+    calls = []
+    monkeypatch.setattr('ingestion.get_embedding', lambda text: calls.append(text) or [1.0, 0.0])
+
+    async def run():
+        workers = [IngestionQueue(max_concurrent_jobs=2) for _ in range(3)]
+        for worker in workers:
+            worker.start()
+        job = workers[0].enqueue(path, original_name="guide.txt", knowledge_type="指南")
+        for _ in range(200):
+            if workers[2].get_job(job["id"])["status"] == "completed":
+                break
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.1)
+        for worker in workers:
+            await worker.stop()
+        return workers[1].get_job(job["id"])
+
+    job = asyncio.run(run())
+    assert job["status"] == "completed" and len(calls) == 2
+    assert len(catalog.file_refs(path.name)) == 2
+    assert store.stats.snapshot()["by_type"]["指南"]["files"] == 1
+
+
+def test_progress_is_stored_while_a_stage_runs(isolated_store, monkeypatch, tmp_path):
+    path = tmp_path / "guide.txt"
+    path.write_text("\n\n".join(f"第{i}段内容。" for i in range(6)), encoding="utf-8")
+    monkeypatch.setattr('ingestion.CHUNK_SIZE', 8)
+    monkeypatch.setattr('ingestion.CHUNK_OVERLAP', 0)
+    monkeypatch.setattr('ingestion.INGESTION_PROGRESS_SAVE_SECONDS', 0.01)
+
+    def slow_embedding(text):
+        time.sleep(0.05)
+        return [1.0, 0.0]
+
+    monkeypatch.setattr('ingestion.get_embedding', slow_embedding)
+
+    async def run():
+        queue = IngestionQueue(max_concurrent_jobs=1)
+        queue.start()
+        job = queue.enqueue(path, original_name="guide.txt", knowledge_type="指南")
+        seen = set()
+        for _ in range(300):
+            stored = queue.get_job(job["id"])
+            if stored["status"] in ("completed", "failed"):
+                break
+            if stored["stage"] == "embedding":
+                seen.add(stored["chunks_embedded"])
+            await asyncio.sleep(0.01)
+        await queue.stop()
+        return queue.get_job(job["id"]), seen
+
+    job, seen = asyncio.run(run())
+    assert job["status"] == "completed" and job["chunks_processed"] == 6
+    # the stored progress advanced chunk by chunk, not only on stage changes
+    assert len(seen) >= 3
@@ -1,17 +1,46 @@
 import asyncio
+from catalog import KnowledgeCatalog
+from chunk_store import KnowledgeStore
 from knowledge_store import search_knowledge_embedding
 
 
 def test_search_knowledge_embedding(monkeypatch):
     docs = [{
+        "content_hash": "h1",
         "knowledge_type": "test",
         "content": "hello world",
         "metadata": {},
         "embedding": [1.0, 0.0]
     }]
-    monkeypatch.setattr('knowledge_store.embedded_documents', docs, raising=False)
+    monkeypatch.setattr('knowledge_store.store', KnowledgeStore(docs))
     monkeypatch.setattr('knowledge_store.get_embedding', lambda text: [1.0, 0.0])
 
     result = asyncio.run(search_knowledge_embedding("hello", top_k=1))
     assert result["success"]
     assert len(result["results"]) == 1
+
+
+def test_search_results_cached_until_kb_changes(monkeypatch, tmp_path):
+    from knowledge_store import bump_kb_version
+    docs = [{
+        "content_hash": "h1",
+        "knowledge_type": "test",
+        "content": "hello world",
+        "metadata": {},
+        "embedding": [1.0, 0.0]
+    }]
+    calls = []
+    store = KnowledgeStore(docs)
+    monkeypatch.setattr('knowledge_store.store', store)
+    monkeypatch.setattr('chunk_store.store', store)
+    monkeypatch.setattr('chunk_store.catalog', KnowledgeCatalog(":memory:"))
+    monkeypatch.setattr('knowledge_store.get_embedding', lambda text: calls.append(text) or [1.0, 0.0])
+
+    bump_kb_version()
+    asyncio.run(search_knowledge_embedding("cached query", top_k=3, types=["test"]))
+    asyncio.run(search_knowledge_embedding("cached query", top_k=3, types=["test"]))
+    assert len(calls) == 1
+
+    bump_kb_version()
+    asyncio.run(search_knowledge_embedding("cached query", top_k=3, types=["test"]))
+    assert len(calls) == 2
@@ -0,0 +1,106 @@
+import asyncio
+import json
+import time
+from catalog import KnowledgeCatalog
+from protocol_pipeline import ProtocolPipeline, confirm_workflow
+
+EXTRACTION = '{"drug_type": "TCR-T", "disease": "肺癌", "trial_phase": "I期"}'
+OUTLINE = '[{"title": "1. 研究背景", "subsections": ["1.1 疾病"]}, {"title": "2. 研究设计"}]'
+
+
+def dummy_stream(prompt, system_prompt=None, temperature=0.3):
+    if prompt == "extract":
+        text = EXTRACTION
+    elif prompt == "outline":
+        text = OUTLINE
+    else:
+        text = f"正文:{prompt}"
+    for i in range(0, len(text), 7):
+        if prompt == "outline":
+            time.sleep(0.01)
+        yield text[i:i + 7]
+
+
+async def dummy_search(query, top_k=5, types=None):
+    return {"success": True, "results": [{"knowledge_type": "t", "content": "研究背景资料", "score": 0.9}]}
+
+
+def make_pipeline():
+    return ProtocolPipeline(
+        llm_stream=dummy_stream,
+        embedding_searcher=dummy_search,
+        extraction_prompt_builder=lambda text: "extract",
+        outline_prompt_builder=lambda info: "outline",
+        section_prompt_builder=lambda title, info, knowledge: title,
+        extraction_parser=json.loads,
+        fallback_outline=lambda info: [],
+    )
+
+
+async def collect(pipeline, settings, on_event=None):
+    events = []
+    async for event in pipeline.run("需求", settings):
+        events.append(event)
+        if on_event:
+            on_event(event)
+    return events
+
+
+def test_pipeline_runs_all_stages():
+    events = asyncio.run(collect(make_pipeline(), {}))
+    types = [e["type"] for e in events]
+    assert types[0] == "workflow"
+    assert types.index("retrieval_started") < types.index("extracted_info")
+    assert types.count("outline_entry") == 2
+    # 第一个章节在大纲流结束之前就已开始生成
+    assert types.index("section_start") < types.index("outline")
+    done = {e["index"]: e["content"] for e in events if e["type"] == "section_done"}
+    assert done == {0: "正文:1. 研究背景", 1: "正文:2. 研究设计"}
+    assert types[-1] == "done"
+
+
+def test_pipeline_confirmation_gate(monkeypatch, tmp_path):
+    # the confirmation arrives on another API worker sharing the catalog file
+    monkeypatch.setattr('protocol_pipeline.catalog', KnowledgeCatalog(tmp_path / "catalog.db"))
+    other_worker = KnowledgeCatalog(tmp_path / "catalog.db")
+    pipeline = make_pipeline()
+
+    def on_event(event):
+        if event["type"] == "awaiting_confirmation":
+            assert not other_worker.confirm_gate("unknown", event["gate"])
+            assert other_worker.confirm_gate(event["workflow_id"], event["gate"], [{"title": "仅此一章"}])
+
+    events = asyncio.run(collect(pipeline, {"confirm_outline": True}, on_event))
+    done = [e for e in events if e["type"] == "section_done"]
+    assert [e["title"] for e in done] == ["仅此一章"]
+    # the gate is closed once passed
+    assert not confirm_workflow(pipeline.workflow_id, "outline")
+
+
+def test_cancelled_stream_stops_upstream():
+    produced, closed = [], []
+
+    def endless_stream(prompt, system_prompt=None, temperature=0.3):
+        try:
+            for i in range(1000):
+                time.sleep(0.005)
+                produced.append(i)
+                yield str(i)
+        finally:
+            closed.append(True)
+
+    pipeline = make_pipeline()
+    pipeline.llm_stream = endless_stream
+
+    async def run():
+        stream = pipeline._stream_tokens("p", None, 0.3)
+        received = [await stream.__anext__() for _ in range(2)]
+        await stream.aclose()
+        for _ in range(100):
+            if closed:
+                break
+            await asyncio.sleep(0.01)
+        return received
+
+    assert asyncio.run(run()) == ["0", "1"]
+    assert closed and len(produced) < 10
@@ -27,3 +27,19 @@ def test_extract_quality_score():
     gen = RealProtocolGenerator(dummy_llm, dummy_search)
     assert gen._extract_quality_score("评分：90分") == 90
     assert gen._extract_quality_score("没有评分") in (70, 80)
+
+
+def test_modular_content_reports_packed_context():
+    import asyncio
+
+    gen = RealProtocolGenerator(dummy_llm, dummy_search, context_token_budget=1000)
+    details = []
+
+    async def record(step, progress, status, detail):
+        details.append(detail)
+
+    gen.set_progress_callback(record)
+    docs = [{"content": "入选标准要求年龄十八岁以上。", "score": 0.9}]
+    asyncio.run(gen.generate_modular_content("需求", {}, docs, 0.3))
+    assert gen.last_context_info["chunks_used"] == 1
+    assert any(detail.startswith("知识上下文: 1/1 个分块") for detail in details)
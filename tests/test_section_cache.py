@@ -0,0 +1,28 @@
+from section_cache import section_cache_key, get_cached_section, store_section
+
+
+def test_section_cache_roundtrip(tmp_path, monkeypatch):
+    monkeypatch.setattr('section_cache.SECTION_CACHE_DIR', tmp_path / "cache")
+    key = section_cache_key("prompt", "model", 0.3, 1)
+    assert get_cached_section(key) is None
+    store_section(key, "章节内容")
+    assert get_cached_section(key) == "章节内容"
+    # 知识库版本变化后键不同
+    assert section_cache_key("prompt", "model", 0.3, 2) != key
+
+
+def test_section_cache_prunes_old_versions_and_lru(tmp_path, monkeypatch):
+    import os
+    monkeypatch.setattr('section_cache.SECTION_CACHE_DIR', tmp_path / "cache")
+    monkeypatch.setattr('section_cache.SECTION_CACHE_MAX_ENTRIES', 2)
+    old = section_cache_key("p", "m", 0.3, 1)
+    store_section(old, "旧版本")
+    keys = [section_cache_key(f"p{i}", "m", 0.3, 2) for i in range(3)]
+    for i, key in enumerate(keys[:2]):
+        store_section(key, str(i))
+        os.utime(tmp_path / "cache" / f"{key}.json", (i, i))
+    assert get_cached_section(old) is None
+    # a hit marks the oldest entry as recently used, so the other one is evicted
+    assert get_cached_section(keys[0]) == "0"
+    store_section(keys[2], "2")
+    assert [get_cached_section(key) for key in keys] == ["0", None, "2"]
@@ -0,0 +1,106 @@
+import asyncio
+
+import pytest
+
+import numpy as np
+
+import sharded_search
+from chunk_store import KnowledgeStore
+from sharded_search import merge_top_k
+
+# conftest replaces numpy with a stub when it is not installed
+requires_numpy = pytest.mark.skipif(not hasattr(np, "frombuffer"), reason="numpy not installed")
+
+
+def test_merge_top_k_across_shards():
+    parts = [([0, 3], [0.2, 0.9]), ([], []), ([5, 7, 8], [0.5, 0.95, 0.1])]
+    assert merge_top_k(parts, 3) == [(7, 0.95), (3, 0.9), (5, 0.5)]
+    assert merge_top_k(parts, 10)[-1] == (8, 0.1)
+
+
+def test_small_or_unindexed_snapshots_fall_back(monkeypatch):
+    store = KnowledgeStore([{"content_hash": "h1", "knowledge_type": "指南", "content": "a",
+                             "metadata": {}, "embedding": [1.0, 0.0]}])
+    builds = []
+    monkeypatch.setattr(sharded_search, "_build", lambda: builds.append(1))
+    monkeypatch.setattr(sharded_search, "SEARCH_SHARDS", 0)
+    assert asyncio.run(sharded_search.sharded_search(store.snapshot(), [1.0, 0.0], 5)) is None
+    assert builds == []
+
+    # enabled but no index yet: scan in process, build in the background
+    monkeypatch.setattr(sharded_search, "SEARCH_SHARDS", 2)
+    monkeypatch.setattr(sharded_search, "SHARDED_SEARCH_MIN_VECTORS", 1)
+    monkeypatch.setattr(sharded_search, "_index", None)
+    monkeypatch.setattr(sharded_search, "_building", False)
+    assert asyncio.run(sharded_search.sharded_search(store.snapshot(), [1.0, 0.0], 5)) is None
+    assert builds == [1]
+
+
+def _doc(i):
+    return {"content_hash": f"h{i}", "knowledge_type": "指南" if i % 2 else "法规", "content": str(i),
+            "metadata": {}, "embedding": [float(i % 7), float(i % 5) + 1, float(i % 3)]}
+
+
+def test_snapshot_lists_records_added_since_an_epoch():
+    store = KnowledgeStore([_doc(i) for i in range(3)])
+    start = store.snapshot()
+    store.publish(added=[_doc(3), _doc(4)], removed=[])
+    store.publish(added=[], removed=["h0", "h3"])
+    assert [doc.content for doc in store.snapshot().added_since(start.epoch)] == ["4"]
+    assert start.added_since(start.epoch) == []
+    # a load starts a new epoch, so everything counts as added since
+    store.load([_doc(5)])
+    assert [doc.content for doc in store.snapshot().added_since(start.epoch)] == ["5"]
+
+
+def _expected(snapshot, query, types=None):
+    q = np.asarray(query) / np.linalg.norm(query)
+    scores = [(doc.content, float(np.asarray(doc.embedding) @ q / np.linalg.norm(doc.embedding)))
+              for doc in snapshot.documents() if not types or doc.knowledge_type in types]
+    return sorted(scores, key=lambda s: s[1], reverse=True)[:5]
+
+
+def _assert_matches(found, expected):
+    found = [(doc.content, score) for doc, score in found]
+    # parallel vectors tie, so compare the contents below the cut-off score as a set
+    assert [score for _, score in found] == pytest.approx([s for _, s in expected], abs=1e-5)
+    cut = expected[-1][1] + 1e-5
+    assert {c for c, s in found if s > cut} == {c for c, s in expected if s > cut}
+
+
+@requires_numpy
+def test_sharded_index_matches_full_scan(tmp_path):
+    from concurrent.futures import ProcessPoolExecutor
+    import multiprocessing
+
+    store = KnowledgeStore([_doc(i) for i in range(40)])
+    snapshot = store.snapshot()
+    index = sharded_search.ShardedIndex.build(snapshot, tmp_path, 3)
+    query = [1.0, 2.0, 0.5]
+
+    with ProcessPoolExecutor(2, mp_context=multiprocessing.get_context("spawn")) as pool:
+        for types in (None, ["法规"]):
+            _assert_matches(asyncio.run(index.search(pool, snapshot, query, 5, types)),
+                            _expected(snapshot, query, types))
+        assert asyncio.run(index.search(pool, snapshot, query, 5, ["unknown"])) == []
+
+        # later versions are served by the same index: deleted rows are skipped,
+        # new records are scored in process
+        store.publish(added=[_doc(i) for i in range(40, 44)] + [{**_doc(1), "content": "1b"}],
+                      removed=["h2", "h5", "h9", "h1"])
+        later = store.snapshot()
+        unindexed, dead = index.delta(later)
+        assert len(unindexed) == 5 and dead == 4
+        for types in (None, ["指南"]):
+            _assert_matches(asyncio.run(index.search(pool, later, query, 5, types)), _expected(later, query, types))
+
+        # another worker opens the same files for its own records
+        other = KnowledgeStore([_doc(i) for i in range(1, 42)])
+        opened = sharded_search.ShardedIndex.open(index.stem, other.snapshot(), 3)
+        assert [doc.content for doc in opened.uncovered] == ["40", "41"]
+        _assert_matches(asyncio.run(opened.search(pool, other.snapshot(), query, 5)),
+                        _expected(other.snapshot(), query))
+
+        # too much changed for the index to help
+        store.load([_doc(i) for i in range(100, 150)])
+        assert asyncio.run(index.search(pool, store.snapshot(), query, 5)) is None
@@ -0,0 +1,23 @@
+import asyncio
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "benchmarks"))
+
+from bench_startup import measure_startup  # noqa: E402
+from chunk_store import KnowledgeStore  # noqa: E402
+from knowledge_store import search_knowledge_embedding  # noqa: E402
+
+
+def test_import_does_not_load_the_corpus():
+    # timings are reported by benchmarks/bench_startup.py; here only the behaviour
+    result = measure_startup(500, dimension=32)
+    assert result["state_after_import"] == "cold"
+    assert result["state_after_load"] == "ready"
+    assert result["documents"] == 500
+
+
+def test_cold_store_reports_warming_search(monkeypatch):
+    monkeypatch.setattr('knowledge_store.store', KnowledgeStore(ready=False))
+    result = asyncio.run(search_knowledge_embedding("入组标准"))
+    assert result["status"] == "warming" and not result["success"]
@@ -0,0 +1,44 @@
+from streaming_json import IncrementalJSONParser, parse_json_block
+
+
+def test_object_fields_emitted_as_they_complete():
+    parser = IncrementalJSONParser("{")
+    events = []
+    text = '```json\n{"drug_type": "TCR-T", "endpoints": {"primary": "DLT"}, "n": 12, "ok": true}\n```\n以上为结果'
+    for i in range(0, len(text), 3):
+        events.extend(parser.feed(text[i:i + 3]))
+    assert events == [
+        ("drug_type", "TCR-T"),
+        ("endpoints", {"primary": "DLT"}),
+        ("n", 12),
+        ("ok", True),
+    ]
+    assert parser.result()["endpoints"] == {"primary": "DLT"}
+
+
+def test_nested_outline_array_is_not_truncated():
+    text = '说明 [注] 如下：[{"title": "1. 背景", "subsections": ["1.1 疾病", "1.2 药物"]}, {"title": "2. 设计"}] 完'
+    outline = parse_json_block(text, "[")
+    assert outline == [
+        {"title": "1. 背景", "subsections": ["1.1 疾病", "1.2 药物"]},
+        {"title": "2. 设计"},
+    ]
+
+
+def test_truncated_output_keeps_completed_members():
+    assert parse_json_block('{"a": "x\\"y", "b": [1, 2', "{") == {"a": 'x"y'}
+    assert parse_json_block("没有JSON", "{") is None
+
+
+def test_citation_bracket_before_outline_is_skipped():
+    text = '参见[1]说明\n```json\n[{"title": "a"}]\n```'
+    assert parse_json_block(text, "[", dict) == [{"title": "a"}]
+
+    # streamed without the fence: the citation is not taken as the root either
+    parser = IncrementalJSONParser("[", dict)
+    events = []
+    for ch in '参见[1]与[2, 3]说明：[{"title": "a"}, {"title": "b"}]':
+        events.extend(parser.feed(ch))
+    assert events == [(0, {"title": "a"}), (1, {"title": "b"})]
+    assert parser.result() == [{"title": "a"}, {"title": "b"}]
+    assert parse_json_block("参见[1]，无大纲", "[", dict) is None
@@ -0,0 +1,44 @@
+from vector_segment import VectorSegment
+
+
+def test_appended_vectors_are_read_back_by_other_instances(tmp_path):
+    writer = VectorSegment(tmp_path / "vectors.seg")
+    reader = VectorSegment(tmp_path / "vectors.seg")
+    assert writer.append([[1.0, 2.0], [3.0, 4.0, 5.0]]) == [(0, 2), (2, 3)]
+    assert list(reader.read(2, 3)) == [3.0, 4.0, 5.0]
+
+    # a torn write leaves a partial vector; later appends stay aligned
+    with open(tmp_path / "vectors.seg", "ab") as f:
+        f.write(b"\1\2\3")
+    assert writer.append([[6.0]]) == [(6, 1)]
+    assert list(reader.read(6, 1)) == [6.0] and list(reader.read(0, 2)) == [1.0, 2.0]
+
+
+def test_memory_segment():
+    segment = VectorSegment(":memory:")
+    assert segment.append([[1.0], [2.0, 3.0]]) == [(0, 1), (1, 2)]
+    assert list(segment.read(1, 2)) == [2.0, 3.0]
+
+
+def test_growth_maps_only_the_new_tail(tmp_path):
+    import mmap
+    page = mmap.ALLOCATIONGRANULARITY // 8
+    segment = VectorSegment(tmp_path / "vectors.seg")
+    segment.append([[1.0] * page])
+    first = segment.read(0, page)
+    segment.append([[3.0, 4.0]])
+    assert list(segment.read(page, 2)) == [3.0, 4.0]
+    # growing the file does not replace the map earlier records view into
+    assert segment.read(0, page).obj is first.obj
+    assert segment.read(page, 2).obj is not first.obj
+
+
+def test_live_vectors_move_to_a_new_segment(tmp_path):
+    segment = VectorSegment(tmp_path / "vectors.seg")
+    segment.append([[1.0, 2.0], [3.0, 4.0]])
+    assert segment.write_segment(1, [segment.read(2, 2)]) == [(0, 2)]
+    assert segment.segment_path(1) == str(tmp_path / "vectors.1.seg")
+    assert list(segment.read(0, 2, 1)) == [3.0, 4.0]
+    assert segment.append([[5.0]], 1) == [(2, 1)] and segment.size(1) == 3
+    segment.drop_segment(0)
+    assert not (tmp_path / "vectors.seg").exists() and segment.size(0) == 0
@@ -0,0 +1,156 @@
+import mmap
+import os
+import threading
+from array import array
+from bisect import bisect_right
+from pathlib import Path
+from typing import Dict, Iterable, List, Sequence, Tuple, Union
+
+try:
+    import fcntl
+except ImportError:  # Windows: appends are only serialized within one process
+    fcntl = None
+
+_ITEM_SIZE = array("d").itemsize
+
+
+class VectorSegment:
+    """Append-only files of float64 embeddings shared by worker processes.
+
+    ``append`` writes vectors at the end of a segment file under an
+    exclusive file lock and returns their ``(offset, dimension)`` in floats;
+    the catalog stores these and the segment number next to the chunk rows.
+    ``read`` returns a zero-copy view into a read-only memory map, so every
+    worker on the host reads the same page-cache pages.
+
+    A file is mapped in extents as it grows: each new map covers only what
+    was appended after the previous one, so growth never supersedes a map
+    that records still view into. Vectors of deleted chunks stay in the file
+    until a compaction copies the live ones into the next segment with
+    ``write_segment``; ``drop_segment`` then deletes the retired file.
+
+    ``VectorSegment(":memory:")`` keeps the vectors in process memory.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = str(path)
+        self._lock = threading.Lock()
+        self._memory: Dict[int, array] = {} if self.path == ":memory:" else None
+        # segment -> (extent start offsets, extent views), ordered by start
+        self._extents: Dict[int, Tuple[List[int], List[memoryview]]] = {}
+
+    def segment_path(self, segment: int) -> str:
+        """File of a segment; segment 0 is the configured path itself."""
+        if not segment:
+            return self.path
+        path = Path(self.path)
+        return str(path.with_name(f"{path.stem}.{segment}{path.suffix}"))
+
+    def append(self, embeddings: Iterable[Sequence[float]], segment: int = 0) -> List[Tuple[int, int]]:
+        return self._write(embeddings, segment, "ab")
+
+    def write_segment(self, segment: int, embeddings: Iterable[Sequence[float]]) -> List[Tuple[int, int]]:
+        """Write ``embeddings`` into a fresh file for ``segment``."""
+        return self._write(embeddings, segment, "wb")
+
+    def _write(self, embeddings: Iterable[Sequence[float]], segment: int, mode: str) -> List[Tuple[int, int]]:
+        vectors = [embedding if isinstance(embedding, array) else array("d", embedding) for embedding in embeddings]
+        with self._lock:
+            if self._memory is not None:
+                if mode == "wb" or segment not in self._memory:
+                    self._memory[segment] = array("d")
+                return [self._append_to(self._memory[segment], vector) for vector in vectors]
+            with open(self.segment_path(segment), mode) as f:
+                if fcntl:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    end = f.seek(0, os.SEEK_END)
+                    if end % _ITEM_SIZE:
+                        # a crash left a partial vector; keep offsets aligned
+                        f.write(b"\0" * (_ITEM_SIZE - end % _ITEM_SIZE))
+                        end = f.tell()
+                    offset = end // _ITEM_SIZE
+                    placed = []
+                    for vector in vectors:
+                        placed.append((offset, len(vector)))
+                        offset += len(vector)
+                    f.write(b"".join(vector.tobytes() for vector in vectors))
+                    f.flush()
+                    os.fsync(f.fileno())
+                finally:
+                    if fcntl:
+                        fcntl.flock(f, fcntl.LOCK_UN)
+            return placed
+
+    @staticmethod
+    def _append_to(memory: array, vector: array) -> Tuple[int, int]:
+        offset = len(memory)
+        memory.extend(vector)
+        return offset, len(vector)
+
+    def read(self, offset: int, dimension: int, segment: int = 0) -> Sequence[float]:
+        """The vector at ``offset``; a view of the shared map for file segments."""
+        if self._memory is not None:
+            return self._memory[segment][offset:offset + dimension]
+        extents = self._extents.get(segment)
+        if extents:
+            starts, views = extents
+            i = bisect_right(starts, offset) - 1
+            if i >= 0 and offset + dimension <= starts[i] + len(views[i]):
+                return views[i][offset - starts[i]:offset - starts[i] + dimension]
+        start, view = self._map_tail(segment, offset)
+        return view[offset - start:offset - start + dimension]
+
+    def _map_tail(self, segment: int, offset: int) -> Tuple[int, memoryview]:
+        """Map the file from the end of its last extent, or from ``offset`` if
+        a vector straddles that end, up to the file's current end."""
+        with self._lock:
+            starts, views = self._extents.setdefault(segment, ([], []))
+            mapped = starts[-1] + len(views[-1]) if starts else 0
+            first = min(offset, mapped) * _ITEM_SIZE
+            first -= first % mmap.ALLOCATIONGRANULARITY
+            path = self.segment_path(segment)
+            size = os.path.getsize(path) // _ITEM_SIZE * _ITEM_SIZE
+            if size <= first:
+                raise ValueError(f"向量偏移 {offset} 超出向量段 {path} 的末尾")
+            with open(path, "rb") as f:
+                view = memoryview(mmap.mmap(f.fileno(), size - first, access=mmap.ACCESS_READ,
+                                            offset=first)).cast("d")
+            start = first // _ITEM_SIZE
+            # extents starting inside the new one are superseded by it
+            while starts and starts[-1] >= start:
+                starts.pop()
+                views.pop()
+            starts.append(start)
+            views.append(view)
+            return start, view
+
+    def size(self, segment: int = 0) -> int:
+        """Length of a segment in floats."""
+        if self._memory is not None:
+            return len(self._memory.get(segment, ()))
+        try:
+            return os.path.getsize(self.segment_path(segment)) // _ITEM_SIZE
+        except FileNotFoundError:
+            return 0
+
+    def release(self, segment: int = 0):
+        """Forget a segment's maps, so the next read maps the whole file as one
+        extent; the old maps are freed once no record views into them."""
+        with self._lock:
+            self._extents.pop(segment, None)
+
+    def drop_segment(self, segment: int):
+        """Release a retired segment and delete its file."""
+        with self._lock:
+            self._extents.pop(segment, None)
+            if self._memory is not None:
+                self._memory.pop(segment, None)
+                return
+        try:
+            os.remove(self.segment_path(segment))
+        except FileNotFoundError:
+            pass
+        except PermissionError:
+            # Windows cannot delete a file that is still mapped; the next compaction retries
+            pass